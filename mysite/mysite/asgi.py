@@ -0,0 +1,22 @@
+"""
+ASGI config for mysite project, for uvicorn, daphne or hypercorn:
+
+    uvicorn mysite.asgi:application
+
+It exposes the ASGI callable as a module-level variable named
+``application``. Django 1.8 itself only speaks WSGI, mysite/asgi_handler.py
+runs it in a thread pool behind the event loop. Needs Python 3.5+.
+"""
+
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
+
+from mysite.asgi_handler import ASGIHandler  # noqa
+
+application = ASGIHandler()
+
+# ASGI servers say when they stop through the lifespan protocol, that is
+# where the vote buffer gets written out (see mysite/wsgi.py).
+from polls.votes import vote_buffer  # noqa
+application.on_shutdown = vote_buffer.stop
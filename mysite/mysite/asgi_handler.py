@@ -0,0 +1,232 @@
+"""ASGI adapter for the Django 1.8 request handler. Needs Python 3.5+.
+
+Django 1.8 has no async views, every view and every ORM call blocks. Under
+WSGI each worker is then tied up for the whole life of a request, including
+the time spent waiting for a slow client to send its request and to read the
+response, so a few hundred phones on a bad connection can use up all the
+workers while the database sits idle.
+
+ASGIHandler runs on the event loop of an ASGI server (uvicorn, daphne,
+hypercorn). It reads the request body and writes the response on the loop,
+where waiting for a client costs nothing, and hands only the Django part
+(middleware, view, ORM, template) to a pool of POLLS_ASGI_THREADS threads.
+So a thread, and the database connection it holds, is only busy while Django
+is actually working, and no more than POLLS_ASGI_THREADS requests query the
+database at the same time however many clients are connected.
+
+The request body is read whole before Django sees it, the polls forms are
+small. A streaming response (the CSV export) is iterated and closed in the
+thread of its request, which keeps one of the POLLS_ASGI_THREADS until it is
+done: the generator may query, and request_finished has to close that
+thread's database connection. A streaming response with a `pollable_content`
+attribute (the server-sent events of polls/live.py) is sent from the event
+loop instead: its poll() never blocks and it calls back when it has
+something new, so thousands of open streams don't need a thread each. Both
+stop as soon as the client disconnects.
+"""
+
+import asyncio
+import io
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core import signals
+from django.core.wsgi import get_wsgi_application
+
+
+class ASGIHandler(object):
+    """ASGI 3 application ("async def app(scope, receive, send)") wrapping
+    @param 'wsgi_application', by default Django's own.
+    """
+
+    def __init__(self, wsgi_application=None, threads=None,
+                 on_shutdown=None):
+        self.wsgi_application = wsgi_application or get_wsgi_application()
+        self.executor = ThreadPoolExecutor(
+            threads or getattr(settings, 'POLLS_ASGI_THREADS', 10))
+        # Called in a thread when the server shuts down, see mysite/asgi.py.
+        self.on_shutdown = on_shutdown
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError('Unsupported ASGI scope %r' % scope['type'])
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.on_shutdown is not None:
+                    await asyncio.get_event_loop().run_in_executor(
+                        self.executor, self.on_shutdown)
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        body = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+        environ = self.environ(scope, b''.join(body))
+        loop = asyncio.get_event_loop()
+        # Set once the client has gone, wake is set with it to stop the
+        # wait of pump().
+        gone = threading.Event()
+        wake = asyncio.Event()
+        watcher = asyncio.ensure_future(self.watch(receive, gone, wake))
+
+        def send_from_thread(message):
+            if not gone.is_set():
+                asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        try:
+            result = await loop.run_in_executor(
+                self.executor, self.respond, environ, send_from_thread, gone)
+            if result is None:
+                # A streaming response, sent by respond() already.
+                return
+            status, headers, content = result
+            await send(self.start_message(status, headers))
+            if isinstance(content, bytes):
+                await send({'type': 'http.response.body', 'body': content})
+            else:
+                await self.pump(content, send, gone, wake)
+        finally:
+            watcher.cancel()
+
+    async def watch(self, receive, gone, wake):
+        """Sets @param 'gone' and @param 'wake' when the client
+        disconnects.
+        """
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                gone.set()
+                wake.set()
+                return
+
+    def start_message(self, status, headers):
+        return {
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin-1'),
+                         value.encode('latin-1'))
+                        for name, value in headers],
+        }
+
+    async def pump(self, stream, send, gone, wake):
+        """Sends @param 'stream', a response's pollable_content, from the
+        event loop until it ends or the client is @param 'gone'.
+        """
+        loop = asyncio.get_event_loop()
+        stream.on_ready(lambda: loop.call_soon_threadsafe(wake.set))
+        try:
+            while True:
+                wake.clear()
+                if gone.is_set():
+                    return
+                try:
+                    chunk = stream.poll()
+                except StopIteration:
+                    break
+                if chunk is None:
+                    try:
+                        await asyncio.wait_for(wake.wait(), stream.timeout())
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await send({'type': 'http.response.body',
+                            'body': chunk.encode('utf-8'),
+                            'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            stream.close()
+
+    def respond(self, environ, send, gone):
+        """Runs Django in this thread. Returns (status, headers, content),
+        content being the whole body as bytes or a pollable_content. A
+        streaming response is sent right here through @param 'send' instead,
+        chunk by chunk until it ends or the client is @param 'gone', and
+        None is returned.
+        """
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = headers
+
+        response = self.wsgi_application(environ, start_response)
+        stream = getattr(response, 'pollable_content', None)
+        if stream is not None:
+            # Django is done, the stream only waits for updates. The
+            # response's close() would close the stream as well, so the
+            # request_finished it sends is sent here, in this thread.
+            signals.request_finished.send(sender=self.__class__)
+            return started['status'], started['headers'], stream
+        try:
+            if not getattr(response, 'streaming', False):
+                return (started['status'], started['headers'],
+                        b''.join(response))
+            send(self.start_message(started['status'], started['headers']))
+            for chunk in response:
+                if gone.is_set():
+                    break
+                send({'type': 'http.response.body', 'body': chunk,
+                      'more_body': True})
+            send({'type': 'http.response.body', 'body': b''})
+        finally:
+            # Sends request_finished, which gives back this thread's
+            # database connection. It has to happen in the same thread.
+            if hasattr(response, 'close'):
+                response.close()
+
+    def environ(self, scope, body):
+        """The WSGI environ Django expects, made from an ASGI http scope."""
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            # WSGI strings are bytes decoded as latin-1.
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+            'REMOTE_ADDR': client[0],
+            # The body has been read already, whatever the header said.
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.version': (1, 0),
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_LENGTH':
+                continue
+            if name == 'CONTENT_TYPE':
+                environ[name] = value
+                continue
+            key = 'HTTP_%s' % name
+            if key in environ:
+                # Repeated headers are joined like a WSGI server does.
+                value = '%s,%s' % (environ[key], value)
+            environ[key] = value
+        return environ
@@ -0,0 +1,57 @@
+"""django.db.backends.mysql with a connection pool, see mysite/db/pool.py.
+
+Use it with ENGINE 'mysite.db.mysql' and CONN_MAX_AGE 0, so Django gives the
+connection back to the pool at the end of every request. The pool settings
+go in a POOL dict next to the other settings of the database.
+"""
+
+from django.db.backends.mysql import base as mysql
+
+from .. import pool
+
+Database = mysql.Database
+
+
+def _ping(conn):
+    conn.ping()
+
+
+def _reset(conn):
+    # Whatever a failed request left half done must not leak into the next.
+    conn.rollback()
+
+
+class DatabaseWrapper(mysql.DatabaseWrapper):
+
+    def get_pool(self, conn_params):
+        settings_dict = self.settings_dict
+
+        def connect():
+            return mysql.DatabaseWrapper.get_new_connection(self, conn_params)
+
+        return pool.pool_for('%s:%s' % (self.alias, settings_dict['NAME']),
+                             connect, ping=_ping, reset=_reset,
+                             **settings_dict.get('POOL', {}))
+
+    def get_new_connection(self, conn_params):
+        self.pool = self.get_pool(conn_params)
+        try:
+            conn = self.pool.checkout()
+        except pool.PoolTimeout as e:
+            # Django turns this into django.db.OperationalError.
+            raise Database.OperationalError(str(e))
+        # A connection that was used before already had its session set up.
+        self.reused_connection = conn in self.pool.last_used
+        return conn
+
+    def init_connection_state(self):
+        if not self.reused_connection:
+            super(DatabaseWrapper, self).init_connection_state()
+
+    def _close(self):
+        if self.connection is None:
+            return
+        if self.errors_occurred and not self.is_usable():
+            self.pool.discard(self.connection)
+        else:
+            self.pool.checkin(self.connection)
@@ -0,0 +1,209 @@
+"""A small connection pool, used by the mysite.db.mysql backend.
+
+Django keeps one database connection per thread and normally opens it at the
+start of a request and closes it at the end (or keeps it open for
+CONN_MAX_AGE seconds). With the pooled backend "closing" hands the connection
+back to a pool shared by all the threads of the worker process and the next
+request takes it from there, skipping the connect and login round trips.
+
+The pool
+    - opens at most SIZE connections per worker, a thread that needs one when
+      they are all in use waits up to TIMEOUT seconds for one to come back,
+    - closes connections older than MAX_LIFETIME seconds instead of handing
+      them out again, so they're recycled before MySQL's wait_timeout or a
+      load balancer drops them,
+    - pings a connection that sat idle for more than HEALTH_CHECK_AFTER
+      seconds before handing it out, and opens a new one if the ping fails.
+
+stats() returns the counters of every pool in this process, polls:perf_pools
+shows them.
+"""
+
+import collections
+import threading
+import time
+
+DEFAULTS = {
+    'SIZE': 10,
+    'TIMEOUT': 10,
+    'MAX_LIFETIME': 3600,
+    'HEALTH_CHECK_AFTER': 30,
+}
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool(object):
+    """Hands out connections made by @param 'connect'. @param 'ping' is
+    called on a connection that was idle for a while and should raise if it
+    is no good any more. @param 'reset' is called on every connection that
+    comes back, before the next thread gets it.
+    """
+
+    def __init__(self, connect, ping=None, reset=None, **options):
+        self.connect = connect
+        self.ping = ping
+        self.reset = reset
+        for name, default in DEFAULTS.items():
+            setattr(self, name.lower(), options.get(name, default))
+        self.idle = collections.deque()
+        self.born = {}
+        self.last_used = {}
+        self.opening = 0
+        self.lock = threading.Condition()
+        self.counters = dict.fromkeys(
+            ['opened', 'closed', 'checkouts', 'waits', 'timeouts', 'errors',
+             'recycled', 'failed_health_checks'], 0)
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+
+    def checkout(self):
+        started = time.time()
+        waited = False
+        with self.lock:
+            while True:
+                conn = self._take_idle()
+                if conn is not None:
+                    break
+                if len(self.born) + self.opening < self.size:
+                    # Keep the slot, connecting happens outside the lock.
+                    self.opening += 1
+                    break
+                remaining = started + self.timeout - time.time()
+                if remaining <= 0:
+                    self.counters['timeouts'] += 1
+                    raise PoolTimeout(
+                        'All %d connections in use for %ss' %
+                        (self.size, self.timeout))
+                waited = True
+                self.lock.wait(remaining)
+            self.counters['checkouts'] += 1
+            if waited:
+                wait_ms = (time.time() - started) * 1000
+                self.counters['waits'] += 1
+                self.wait_ms_total += wait_ms
+                self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+        if conn is None:
+            conn = self._open()
+        return conn
+
+    def checkin(self, conn):
+        try:
+            if self.reset is not None:
+                self.reset(conn)
+        except Exception:
+            with self.lock:
+                self.counters['errors'] += 1
+            self.discard(conn)
+            return
+        with self.lock:
+            self.last_used[conn] = time.time()
+            self.idle.append(conn)
+            self.lock.notify()
+
+    def discard(self, conn):
+        """Closes @param 'conn' and frees its slot."""
+        with self.lock:
+            self.born.pop(conn, None)
+            self.last_used.pop(conn, None)
+            self.counters['closed'] += 1
+            self.lock.notify()
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        with self.lock:
+            idle, self.idle = list(self.idle), collections.deque()
+        for conn in idle:
+            self.discard(conn)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats.update({
+                'size': self.size,
+                'open': len(self.born) + self.opening,
+                'idle': len(self.idle),
+                'in_use': len(self.born) + self.opening - len(self.idle),
+                'wait_ms_total': self.wait_ms_total,
+                'wait_ms_max': self.wait_ms_max,
+            })
+        return stats
+
+    def _take_idle(self):
+        """Most recently used first, so the spare connections age out. Called
+        with the lock held, pings without it.
+        """
+        now = time.time()
+        while self.idle:
+            conn = self.idle.pop()
+            if now - self.born[conn] > self.max_lifetime:
+                self.counters['recycled'] += 1
+                self._drop(conn)
+                continue
+            if self.ping is not None and \
+                    now - self.last_used[conn] > self.health_check_after:
+                self.lock.release()
+                try:
+                    self.ping(conn)
+                    healthy = True
+                except Exception:
+                    healthy = False
+                finally:
+                    self.lock.acquire()
+                if not healthy:
+                    self.counters['failed_health_checks'] += 1
+                    self._drop(conn)
+                    continue
+            return conn
+        return None
+
+    def _drop(self, conn):
+        """discard() for when the lock is already held."""
+        self.born.pop(conn, None)
+        self.last_used.pop(conn, None)
+        self.counters['closed'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _open(self):
+        try:
+            conn = self.connect()
+        except Exception:
+            with self.lock:
+                self.opening -= 1
+                self.counters['errors'] += 1
+                self.lock.notify()
+            raise
+        with self.lock:
+            self.opening -= 1
+            self.born[conn] = time.time()
+            self.counters['opened'] += 1
+        return conn
+
+
+_lock = threading.Lock()
+_pools = {}
+
+
+def pool_for(name, connect, **kwargs):
+    """The pool called @param 'name' in this process, made with the other
+    arguments the first time it is asked for.
+    """
+    with _lock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = _pools[name] = ConnectionPool(connect, **kwargs)
+        return pool
+
+
+def stats():
+    with _lock:
+        pools = list(_pools.items())
+    return dict((name, pool.stats()) for name, pool in pools)
@@ -43,6 +43,9 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    # Keep this one first, see polls/middleware.py.
+    'polls.middleware.PerformanceMiddleware',
+    'polls.routers.ReadYourWritesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -71,6 +74,21 @@ TEMPLATES = [
     },
 ]
 
+# Production template mode. Without DEBUG the cached loader keeps every
+# compiled template in memory instead of reading and parsing the file on each
+# request, and build/templates/ (written by `python manage.py
+# build_templates`, the templates without their comments) is looked at first.
+if not DEBUG:
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['DIRS'] = ([os.path.join(BASE_DIR, 'build', 'templates')] +
+                            TEMPLATES[0]['DIRS'])
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+
 WSGI_APPLICATION = 'mysite.wsgi.application'
 
 
@@ -80,17 +98,78 @@ login_path = BASE_DIR + '/mysite/login.json'
 with open(login_path) as login_file:
     login = json.load(login_file)
 
+# mysite.db.mysql is the MySQL backend with a connection pool per worker (see
+# mysite/db/pool.py), so a request doesn't have to connect and log in again.
+# CONN_MAX_AGE stays 0, Django hands the connection back to the pool after
+# each request. A "pool" object in login.json overrides the POOL values here,
+# e.g. {"mysql": {..., "pool": {"SIZE": 20}}}.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': 'mysite.db.mysql',
         'NAME': 'poll_site',
         'USER': login['mysql']['username'],
-        'PASSWORD': login['mysql']['password']
+        'PASSWORD': login['mysql']['password'],
+        'CONN_MAX_AGE': 0,
+        'POOL': dict({
+            'SIZE': 10,
+            'TIMEOUT': 10,
+            'MAX_LIFETIME': 3600,
+            'HEALTH_CHECK_AFTER': 30,
+        }, **login['mysql'].get('pool', {})),
     }
 }
 
 login_file.close()
 
+# Reads go to the databases named in POLLS_READ_REPLICAS (add them to
+# DATABASES above), writes always to 'default'. After a POST a browser reads
+# from 'default' for POLLS_REPLICA_PIN_SECONDS so it sees its own vote, and
+# what was read from a replica is cached for no longer than that. See
+# polls/routers.py.
+DATABASE_ROUTERS = ['polls.routers.ShardRouter',
+                    'polls.routers.PrimaryReplicaRouter']
+POLLS_READ_REPLICAS = []
+POLLS_REPLICA_PIN_SECONDS = 5
+
+# Sharding (polls/sharding.py). A list of DATABASES aliases spreads each
+# question with its choices and votes over them by question id, empty keeps
+# everything in 'default'. Run `python manage.py rebalance_shards` after
+# changing it. mysite/settings_shards.py tries it out with SQLite files.
+POLLS_SHARDS = []
+
+# Cache
+# https://docs.djangoproject.com/en/1.8/topics/cache/
+# The local memory cache is per process. Point this at memcached when running
+# more than one worker so every worker sees the same cached results.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Logging
+# https://docs.djangoproject.com/en/1.8/topics/logging/
+# The request timings of polls/middleware.py go to the console as one JSON
+# object per line.
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'polls.perf': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.8/topics/i18n/
 
@@ -109,3 +188,110 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.8/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Polls
+# Number of counter rows each Choice's votes get spread over, see
+# polls/votes.py. 0 keeps every vote on the Choice row itself.
+POLLS_VOTE_SHARDS = 0
+
+# Write-behind vote buffer. When True votes are counted in memory and written
+# in one batched UPDATE every POLLS_VOTE_FLUSH_INTERVAL milliseconds or once
+# POLLS_VOTE_FLUSH_SIZE votes are pending. Votes that have not been flushed
+# are lost if a worker is killed without a graceful shutdown, see
+# polls/votes.py before turning this on.
+POLLS_VOTE_BUFFER = False
+POLLS_VOTE_FLUSH_INTERVAL = 500
+POLLS_VOTE_FLUSH_SIZE = 1000
+
+# Results page cache, see polls/results_cache.py. With a staleness of 0 every
+# vote drops the cached tally. With N seconds a tally may be up to N seconds
+# behind and votes leave it alone. POLLS_RESULTS_CACHE_TIMEOUT is how long a
+# tally is kept when the staleness is 0.
+POLLS_RESULTS_STALENESS = 0
+POLLS_RESULTS_CACHE_TIMEOUT = 300
+
+# Questions per page of the poll archive (polls/archive/).
+POLLS_ARCHIVE_PAGE_SIZE = 20
+
+# Questions returned by the JSON API's question list (polls/api/questions/).
+POLLS_API_PAGE_SIZE = 20
+
+# Fraction of requests PerformanceMiddleware times (polls/middleware.py).
+# Switching the debug cursor on costs a little per query, so keep this low in
+# production, 0.01 still fills the histograms at polls/perf/ quickly.
+POLLS_PERF_SAMPLE_RATE = 0.01
+
+# Live results (polls/live.py). At most this many updates a second are sent
+# per question, votes in between are merged. Streams close after
+# POLLS_LIVE_MAX_AGE seconds and the browser reconnects. Under WSGI every open
+# stream takes a worker thread, under ASGI none.
+POLLS_LIVE_MAX_RATE = 1.0
+POLLS_LIVE_MAX_AGE = 300
+
+# Vote limits (polls/throttle.py). An IP address may vote POLLS_VOTE_RATE times
+# per POLLS_VOTE_RATE_WINDOW seconds. The limit is off (None) by default, like
+# dedup below: it counts by IP address, so everyone behind the same NAT or
+# office proxy shares it. Behind a proxy set POLLS_VOTER_IP_HEADER to e.g.
+# 'HTTP_X_FORWARDED_FOR'. With POLLS_VOTE_DEDUP a voter can vote once per
+# question; that is remembered for one to two
+# POLLS_VOTE_DEDUP_WINDOW seconds in filters sized for
+# POLLS_VOTE_DEDUP_CAPACITY votes per window, which turn away
+# POLLS_VOTE_DEDUP_ERROR of new voters by mistake once full. Dedup is off by
+# default: anonymous voters have no session, so they are told apart by IP
+# address and everyone behind the same NAT would share one vote.
+POLLS_VOTE_RATE = None
+POLLS_VOTE_RATE_WINDOW = 60
+POLLS_VOTER_IP_HEADER = None
+POLLS_VOTE_DEDUP = False
+POLLS_VOTE_DEDUP_WINDOW = 86400
+POLLS_VOTE_DEDUP_CAPACITY = 100000
+POLLS_VOTE_DEDUP_ERROR = 0.001
+POLLS_VOTE_DEDUP_SYNC = 2
+
+# Vote history (polls/history.py). Each vote also adds a row to the events
+# table, `python manage.py compact_votes` rolls those up into minutes, hours
+# and days for the trend API and prunes them after POLLS_HISTORY_KEEP_EVENTS
+# days. Rollups are kept for POLLS_HISTORY_KEEP_ROLLUPS days per period (None
+# for forever), minutes for at least a day since hours are added up from
+# them. The last POLLS_HISTORY_LAG seconds are left for the next run.
+POLLS_VOTE_HISTORY = True
+POLLS_HISTORY_LAG = 60
+POLLS_HISTORY_KEEP_EVENTS = 7
+POLLS_HISTORY_KEEP_ROLLUPS = {'minute': 2, 'hour': 90, 'day': None}
+
+# Search (polls/search.py), results per page of polls/search/ and how many
+# pages deep it goes. A search ranks at most POLLS_SEARCH_MAX_CANDIDATES
+# questions, the ones where its rarest word weighs most.
+POLLS_SEARCH_PAGE_SIZE = 20
+POLLS_SEARCH_MAX_PAGES = 50
+POLLS_SEARCH_MAX_CANDIDATES = 2000
+
+# Admin (polls/admin.py). The question list shows the database's estimate of
+# the number of questions instead of counting them once there are at least
+# POLLS_ADMIN_ESTIMATE_COUNT_OVER (None to always count). A question's change
+# page shows POLLS_ADMIN_CHOICES_PER_PAGE of its choices at a time.
+POLLS_ADMIN_ESTIMATE_COUNT_OVER = 100000
+POLLS_ADMIN_CHOICES_PER_PAGE = 50
+
+# Scheduled publishing (polls/schedule.py). The index page is served from a
+# cached list of the POLLS_SCHEDULE_LIST_SIZE newest visible questions, which
+# `python manage.py publish_scheduled` switches over when the next question's
+# pub_date comes. POLLS_SCHEDULE_TIMEOUT is how long the cache keeps it.
+POLLS_SCHEDULE_LIST_SIZE = 50
+POLLS_SCHEDULE_TIMEOUT = 3600
+
+# ASGI (mysite/asgi.py). Django runs in a pool of POLLS_ASGI_THREADS threads
+# behind the event loop, at most that many requests use the database at once
+# per process. A streaming response (the CSV export) keeps its thread until
+# it is sent, the live results need none.
+POLLS_ASGI_THREADS = 10
+
+# Object cache (polls/object_cache.py). Questions and their choices are kept
+# for POLLS_OBJECT_CACHE_TIMEOUT seconds in the cache above, and the
+# POLLS_OBJECT_CACHE_LOCAL_SIZE most used of them in each process for
+# POLLS_OBJECT_CACHE_LOCAL_TTL seconds, which is how long an edit made through
+# another process can take to show up.
+POLLS_OBJECT_CACHE_TIMEOUT = 3600
+POLLS_OBJECT_CACHE_LOCAL_SIZE = 1000
+POLLS_OBJECT_CACHE_LOCAL_TTL = 5
@@ -0,0 +1,36 @@
+"""Settings for workers that only serve the public polls pages, the ones in
+polls.urls.public_urlpatterns. They skip the admin, sessions, logins,
+messages and static files, so a worker starts faster and uses less memory.
+Staff pages (the admin, exports and the perf numbers) need the full
+mysite/settings.py, run some workers with each and let the web server send
+/admin/ and the staff pages to the full ones.
+
+mysite/wsgi_public.py uses these, `python manage.py bench_startup` compares
+the two.
+"""
+
+import copy
+
+from .settings import *  # noqa
+
+INSTALLED_APPS = (
+    'polls',
+)
+
+MIDDLEWARE_CLASSES = (
+    # Keep this one first, see polls/middleware.py.
+    'polls.middleware.PerformanceMiddleware',
+    'polls.routers.ReadYourWritesMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+)
+
+ROOT_URLCONF = 'mysite.urls_public'
+
+TEMPLATES = copy.deepcopy(TEMPLATES)
+TEMPLATES[0]['OPTIONS']['context_processors'] = [
+    'django.template.context_processors.debug',
+    'django.template.context_processors.request',
+]
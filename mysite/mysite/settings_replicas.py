@@ -0,0 +1,29 @@
+"""Settings for trying the read replica routing locally, with two SQLite
+files standing in for the MySQL primary and its replica. Nothing copies rows
+from one to the other, which makes it easy to see which database a page
+read from.
+
+    python manage.py migrate --settings=mysite.settings_replicas
+    python manage.py migrate --database=replica \\
+        --settings=mysite.settings_replicas
+    python manage.py test polls.tests.ReplicaReadYourWritesTest \\
+        --settings=mysite.settings_replicas
+
+The rest of the polls tests expect to read back what they wrote, so they
+run against the normal settings.
+"""
+
+from .settings import *  # noqa
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'primary.sqlite3'),
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'replica.sqlite3'),
+    },
+}
+
+POLLS_READ_REPLICAS = ['replica']
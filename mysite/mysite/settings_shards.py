@@ -0,0 +1,35 @@
+"""Settings for trying the sharded polls (polls/sharding.py) locally, with
+three SQLite files standing in for the MySQL shards. 'default' is the first
+shard and also holds everything that isn't sharded.
+
+    python manage.py migrate --settings=mysite.settings_shards
+    python manage.py migrate --database=shard1 \\
+        --settings=mysite.settings_shards
+    python manage.py migrate --database=shard2 \\
+        --settings=mysite.settings_shards
+    python manage.py rebalance_shards --settings=mysite.settings_shards
+    python manage.py test polls.tests.ShardingTest \\
+        --settings=mysite.settings_shards
+
+The rest of the polls tests count the queries of a single database, so they
+run against the normal settings.
+"""
+
+from .settings import *  # noqa
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'shard0.sqlite3'),
+    },
+    'shard1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'shard1.sqlite3'),
+    },
+    'shard2': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'shard2.sqlite3'),
+    },
+}
+
+POLLS_SHARDS = ['default', 'shard1', 'shard2']
@@ -0,0 +1,8 @@
+"""The URLs of mysite/settings_public.py, only the public polls pages."""
+from django.conf.urls import include, url
+
+from polls.urls import public_urlpatterns
+
+urlpatterns = [
+    url(r'^polls/', include(public_urlpatterns, namespace='polls')),
+]
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
 
 application = get_wsgi_application()
+
+# When POLLS_VOTE_BUFFER is on, votes wait in memory before being written.
+# Write them out when the server stops this worker gracefully (SIGTERM or a
+# normal interpreter exit), see polls/votes.py.
+from polls.votes import install_shutdown_flush  # noqa
+install_shutdown_flush()
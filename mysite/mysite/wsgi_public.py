@@ -0,0 +1,16 @@
+"""
+WSGI config for the workers that only serve the public polls pages, see
+mysite/settings_public.py.
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings_public")
+
+application = get_wsgi_application()
+
+# See mysite/wsgi.py.
+from polls.votes import install_shutdown_flush  # noqa
+install_shutdown_flush()
@@ -1,10 +1,152 @@
+import datetime
+import math
+from contextlib import contextmanager
+
+from django.conf import settings
 from django.contrib import admin
+from django.db import transaction
+from django.db.models import Case, Value, When
+from django.forms.models import BaseInlineFormSet
+from django.utils import timezone
+
 from .models import Question, Choice
+from .pagination import EstimatedCountPaginator
+from . import search, sharding, signals
+
+
+class ChoicePageFormSet(BaseInlineFormSet):
+    """Holds only one page of a question's choices, a poll with thousands of
+    them would otherwise put thousands of forms on the change page. Which
+    page comes from ?choices_page= and is set by ChoiceInline.get_formset().
+    """
+
+    page = 1
+
+    def get_queryset(self):
+        if not hasattr(self, '_queryset'):
+            per_page = getattr(settings, 'POLLS_ADMIN_CHOICES_PER_PAGE', 50)
+            choices = self.queryset.order_by('pk')
+            self.total = choices.count()
+            self.pages = max(1, int(math.ceil(self.total / float(per_page))))
+            self.page = min(self.page, self.pages)
+            start = (self.page - 1) * per_page
+            self._queryset = choices[start:start + per_page]
+        return self._queryset
 
 
 class ChoiceInline(admin.TabularInline):
     model = Choice
     extra = 3
+    formset = ChoicePageFormSet
+    # The usual tabular inline plus links to the other pages. Changes on this
+    # page are lost when following them, save first.
+    template = 'admin/polls/choice_inline.html'
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super(ChoiceInline, self).get_formset(request, obj, **kwargs)
+        try:
+            formset.page = max(1, int(request.GET.get('choices_page', 1)))
+        except ValueError:
+            pass
+        return formset
+
+
+class PublishedFilter(admin.SimpleListFilter):
+    """Date ranges on the indexed pub_date column. Each choice becomes a
+    WHERE pub_date BETWEEN ... that the database answers from the index.
+    """
+
+    title = 'published'
+    parameter_name = 'published'
+
+    def lookups(self, request, model_admin):
+        return [
+            ('recently', 'In the last day'),
+            ('week', 'In the last 7 days'),
+            ('month', 'In the last 30 days'),
+            ('older', 'Before that'),
+            ('scheduled', 'Not yet'),
+        ]
+
+    def queryset(self, request, queryset):
+        now = timezone.now()
+        days = {'recently': 1, 'week': 7, 'month': 30}
+        if self.value() in days:
+            since = now - datetime.timedelta(days=days[self.value()])
+            return queryset.filter(pub_date__range=(since, now))
+        if self.value() == 'older':
+            return queryset.filter(
+                pub_date__lt=now - datetime.timedelta(days=30))
+        if self.value() == 'scheduled':
+            return queryset.filter(pub_date__gt=now)
+        return queryset
+
+
+class ShardFilter(admin.SimpleListFilter):
+    """With the polls sharded (polls/sharding.py) the list shows the
+    questions of one shard at a time, the first unless another is picked.
+    Only shown then, see QuestionAdmin.get_list_filter().
+    """
+
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in sharding.shards()]
+
+    def value(self):
+        value = super(ShardFilter, self).value()
+        return value if value in sharding.shards() else sharding.shards()[0]
+
+    def choices(self, changelist):
+        # No "All", the shards can't be listed as one.
+        for lookup, title in self.lookup_choices:
+            yield {
+                'selected': self.value() == lookup,
+                'query_string': changelist.get_query_string(
+                    {self.parameter_name: lookup}, []),
+                'display': title,
+            }
+
+    def queryset(self, request, queryset):
+        return queryset.using(self.value())
+
+
+@contextmanager
+def on_question_shard(question_id):
+    """Sends the queries of the block to the shard of @param 'question_id'
+    and runs it in a transaction there, the admin's own transaction is on
+    'default' only. Does nothing without sharding.
+    """
+    try:
+        alias = sharding.shard_for(question_id)
+    except (TypeError, ValueError):
+        # Adding a question, or an object_id that isn't one.
+        alias = None
+    if not sharding.enabled() or alias is None:
+        yield
+        return
+    with sharding.use_shard(alias), transaction.atomic(using=alias):
+        yield
+
+
+def bulk_update(objs, fields):
+    """Writes @param 'fields' of all @param 'objs' (of one model) with a
+    single UPDATE ... SET field = CASE id WHEN ... instead of one UPDATE per
+    object. Like queryset.update() no signals are sent.
+    """
+    if not objs or not fields:
+        return
+    model = type(objs[0])
+    values = {}
+    for name in fields:
+        field = model._meta.get_field(name)
+        values[name] = Case(
+            *[When(pk=obj.pk, then=Value(getattr(obj, field.attname)))
+              for obj in objs],
+            output_field=field)
+    model._default_manager.filter(
+        pk__in=[obj.pk for obj in objs]).update(**values)
 
 
 # This class needs to be created in order to customize the admin form.
@@ -22,16 +164,91 @@ class QuestionAdmin(admin.ModelAdmin):
     # will belong via foreign key to the Question.
     inlines = [ChoiceInline]
 
-    # What is displayed on the list out page of Questions
+    # What is displayed on the list out page of Questions.
+    # was_published_recently is worked out from the pub_date already on the
+    # row, it doesn't cost a query.
     list_display = ('question_text', 'pub_date', 'was_published_recently')
 
     # makes a sidebar which dpending on the type of field in the database,
     # Django knows what kind of filters to create. In this case date types.
-    list_filter = ['pub_date']
+    # PublishedFilter gives the same kind of ranges and adds the upcoming
+    # questions.
+    list_filter = [PublishedFilter]
+
+    # With millions of questions counting them for the page links takes
+    # longer than showing the page. The paginator takes the database's own
+    # estimate instead, and the "(N total)" next to a filtered count, which
+    # would be another COUNT(*) of the whole table, is left out.
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     # add in search fields
     search_fields = ['question_text']
 
+    def get_list_filter(self, request):
+        if sharding.enabled():
+            return [ShardFilter] + list(self.list_filter)
+        return self.list_filter
+
+    # A question's pages read and write on its shard.
+    def changeform_view(self, request, object_id=None, form_url='',
+                        extra_context=None):
+        with on_question_shard(object_id):
+            return super(QuestionAdmin, self).changeform_view(
+                request, object_id, form_url, extra_context)
+
+    def delete_view(self, request, object_id, extra_context=None):
+        with on_question_shard(object_id):
+            return super(QuestionAdmin, self).delete_view(
+                request, object_id, extra_context)
+
+    def history_view(self, request, object_id, extra_context=None):
+        with on_question_shard(object_id):
+            return super(QuestionAdmin, self).history_view(
+                request, object_id, extra_context)
+
+    def save_related(self, request, form, formsets, change):
+        # A new question only has its id (and so its shard) by now. Its
+        # row is already committed there, the choices go in one transaction.
+        with on_question_shard(form.instance.pk):
+            super(QuestionAdmin, self).save_related(
+                request, form, formsets, change)
+
+    def get_search_results(self, request, queryset, search_term):
+        # search_fields has to be there for the search box to show, but
+        # instead of its LIKE '%word%', which reads every question, the words
+        # are looked up in the search index. polls/search.py.
+        if not search_term:
+            return queryset, False
+        return search.matching(queryset, search_term), False
+
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not Choice:
+            return super(QuestionAdmin, self).save_formset(
+                request, form, formset, change)
+        # Saved form by form, every edited choice would be an UPDATE plus the
+        # signal receivers (cache, versions, search index) for each of them.
+        # Here the edits go out as one UPDATE, the new choices as one INSERT,
+        # and the receivers' work is done once for the question.
+        # The admin already runs all of this in one transaction.
+        formset.save(commit=False)
+        for choice in formset.deleted_objects:
+            choice.delete()
+        columns = set(field.name for field in Choice._meta.concrete_fields)
+        fields = set()
+        for choice, changed in formset.changed_objects:
+            fields.update(columns.intersection(changed))
+        bulk_update([choice for choice, changed in formset.changed_objects],
+                    fields)
+        if sharding.enabled() and formset.new_objects:
+            # bulk_create() doesn't call save(), which would take the ids
+            # from the sequence one at a time.
+            first = sharding.allocate_ids(Choice, len(formset.new_objects))
+            for offset, choice in enumerate(formset.new_objects):
+                choice.pk = first + offset
+        Choice.objects.bulk_create(formset.new_objects)
+        signals.choices_changed(formset.instance.pk)
+
 # Register your models here.
 # This is the common workflow to have access to the models in the admin form,
 # as well as being able to modify the form itself.
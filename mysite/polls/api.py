@@ -0,0 +1,121 @@
+"""Read only JSON API for the polls, wired up in polls/urls.py.
+
+The detail and results endpoints send an ETag and Last-Modified taken from
+polls/versions.py. A client (or CDN) that sends them back with
+If-None-Match / If-Modified-Since gets a 304 Not Modified that was decided
+from the cache alone, without loading the question or its choices.
+"""
+
+import datetime
+import hashlib
+
+from django.conf import settings
+from django.http import Http404, HttpResponseBadRequest, JsonResponse
+from django.utils import timezone
+from django.views.decorators.http import condition, etag, require_GET
+
+from .export import parse_when
+from .models import Question
+from . import history, results_cache, sharding, versions
+
+# How far back the trend goes when no ?since= is given.
+TREND_DEFAULT_SPAN = {'minute': 1, 'hour': 7, 'day': 365}
+
+
+def question_dict(question):
+    return {
+        'id': question.pk,
+        'question_text': question.question_text,
+        'pub_date': question.pub_date.isoformat(),
+    }
+
+
+def get_published(pk):
+    try:
+        return Question.objects.published().for_question(pk).get(pk=pk)
+    except Question.DoesNotExist:
+        raise Http404("No such question")
+
+
+def latest_pks(request):
+    size = getattr(settings, 'POLLS_API_PAGE_SIZE', 20)
+    latest = sharding.merge(
+        [questions.values_list('pub_date', 'pk')[:size] for questions in
+         Question.objects.published().order_by('-pub_date').on_each_shard()],
+        key=lambda row: row, limit=size)
+    return [pk for pub_date, pk in latest]
+
+
+def list_etag(request):
+    # The list changes when a question appears or drops off, or one of the
+    # listed questions changes. The ids come straight out of the covering
+    # index on Question.
+    versions_seen = ','.join(versions.etags(latest_pks(request)))
+    return hashlib.md5(versions_seen.encode()).hexdigest()
+
+
+@require_GET
+@etag(list_etag)
+def question_list(request):
+    size = getattr(settings, 'POLLS_API_PAGE_SIZE', 20)
+    questions = sharding.merge(
+        [questions[:size] for questions in
+         Question.objects.published().order_by('-pub_date').on_each_shard()],
+        key=lambda q: (q.pub_date, q.pk), limit=size)
+    return JsonResponse({'questions': [question_dict(q) for q in questions]})
+
+
+@require_GET
+@condition(etag_func=lambda request, pk: versions.etag(pk),
+           last_modified_func=lambda request, pk: versions.last_modified(pk))
+def question_detail(request, pk):
+    question = get_published(pk)
+    data = question_dict(question)
+    data['choices'] = [{'id': c.pk, 'choice_text': c.choice_text}
+                       for c in question.choice_set.all()]
+    return JsonResponse(data)
+
+
+@require_GET
+@condition(etag_func=lambda request, pk: versions.etag(pk),
+           last_modified_func=lambda request, pk: versions.last_modified(pk))
+def question_results(request, pk):
+    question = get_published(pk)
+    data = question_dict(question)
+    data['choices'] = results_cache.get_results(question)
+    return JsonResponse(data)
+
+
+@require_GET
+def question_trend(request, pk):
+    """Votes per choice over time, from the rollups in polls/history.py
+    only. ?period= is minute, hour (default) or day, ?since= and ?until=
+    take ISO 8601 dates.
+    """
+    period = request.GET.get('period', 'hour')
+    if period not in history.PERIODS:
+        return HttpResponseBadRequest("period is minute, hour or day")
+    since = timezone.now() - datetime.timedelta(
+        days=TREND_DEFAULT_SPAN[period])
+    until = None
+    try:
+        if request.GET.get('since'):
+            since = parse_when(request.GET['since'])
+        if request.GET.get('until'):
+            until = parse_when(request.GET['until'])
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    question = get_published(pk)
+    choices = results_cache.get_results(question)
+    with sharding.question_shard(question.pk):
+        buckets = history.trend([c['id'] for c in choices],
+                                history.PERIODS[period], since, until)
+    data = question_dict(question)
+    data.update({
+        'period': period,
+        'choices': [{'id': c['id'], 'choice_text': c['choice_text']}
+                    for c in choices],
+        'buckets': [{'start': start.isoformat(), 'votes': votes}
+                    for start, votes in buckets],
+    })
+    return JsonResponse(data)
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class PollsConfig(AppConfig):
+    name = 'polls'
+
+    def ready(self):
+        # Importing the module is enough to connect the receivers.
+        from . import signals  # noqa
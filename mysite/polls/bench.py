@@ -0,0 +1,73 @@
+"""Helpers shared by the benchmark management commands (bench_indexes,
+bench_polls and friends).
+"""
+
+import datetime
+import json
+import random
+import time
+
+from django.core.management.base import CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Question, Choice
+from . import sharding
+
+
+def seed(questions, choices, batch_size=5000, progress=None,
+         question_text=None, choice_text=None):
+    """Inserts @param 'questions' questions with @param 'choices' choices
+    each, in batches. Dates are spread over ten years with a few in the
+    future. @param 'progress' is called with a message after every batch.
+    @param 'question_text' and @param 'choice_text' are called with the
+    number of the question (choice) for its text, by default it is just the
+    number.
+    """
+    if sharding.enabled():
+        # bulk_create() takes the ids from one database.
+        raise CommandError('Seeding does not support POLLS_SHARDS, seed with '
+                           'it unset and run rebalance_shards.')
+    question_text = question_text or (lambda n: 'Question %d' % n)
+    choice_text = choice_text or (lambda n: 'Choice %d' % n)
+    now = timezone.now()
+    started = time.time()
+    made = 0
+    while made < questions:
+        count = min(batch_size, questions - made)
+        with transaction.atomic():
+            Question.objects.bulk_create(
+                Question(question_text=question_text(made + i),
+                         pub_date=now - datetime.timedelta(
+                             minutes=random.randint(-1000, 5256000)),
+                         has_choices=choices > 0)
+                for i in range(count))
+            # bulk_create doesn't give back the ids on every backend.
+            ids = list(Question.objects.order_by('-pk').values_list(
+                'pk', flat=True)[:count])
+            Choice.objects.bulk_create(
+                Choice(question_id=pk, choice_text=choice_text(n),
+                       votes=random.randint(0, 1000))
+                for pk in ids for n in range(choices))
+        made += count
+        if progress is not None:
+            progress('seeded %d questions (%.0f rows/s)' % (
+                made, made * (choices + 1) / (time.time() - started)))
+
+
+def percentile(ordered, p):
+    """@param 'p' percentile of the already sorted list @param 'ordered'."""
+    if not ordered:
+        return None
+    index = int(round((len(ordered) - 1) * p / 100.0))
+    return ordered[index]
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save(path, results):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
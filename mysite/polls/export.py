@@ -0,0 +1,108 @@
+"""Streaming export of questions, choices and their vote counts, used by the
+export_polls management command and the polls:export view.
+
+Rows are produced by a generator that walks the Question table in chunks of
+primary keys (WHERE id > last_id ORDER BY id LIMIT n) and loads the choices
+of one chunk at a time. Only a single chunk is ever held in memory, however
+many rows get exported, and no chunk needs an OFFSET.
+"""
+
+import csv
+import datetime
+import json
+
+from django.utils import dateparse, timezone
+
+from .models import Question, Choice
+from . import sharding, votes
+
+FIELDS = ['question_id', 'question_text', 'pub_date',
+          'choice_id', 'choice_text', 'votes']
+
+
+def parse_when(value):
+    """Accepts 2015-07-30 or a full ISO 8601 date and time, raises
+    ValueError for anything else.
+    """
+    when = dateparse.parse_datetime(value)
+    if when is None:
+        day = dateparse.parse_date(value)
+        if day is None:
+            raise ValueError('Not a date: %s' % value)
+        when = datetime.datetime(day.year, day.month, day.day)
+    if timezone.is_naive(when):
+        when = timezone.make_aware(when)
+    return when
+
+
+def export_rows(since=None, until=None, chunk_size=1000):
+    """Yields one dict per choice (and one with empty choice fields for a
+    question without choices), for the questions with a pub_date between
+    @param 'since' and @param 'until'. In id order, with the polls sharded
+    one shard after the other.
+    """
+    questions = Question.objects.order_by('pk')
+    if since is not None:
+        questions = questions.filter(pub_date__gte=since)
+    if until is not None:
+        questions = questions.filter(pub_date__lte=until)
+    for shard_questions in questions.on_each_shard():
+        for row in _export_shard(shard_questions, chunk_size):
+            yield row
+
+
+def _export_shard(questions, chunk_size):
+    last_pk = 0
+    while True:
+        chunk = list(questions.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            return
+        last_pk = chunk[-1].pk
+        by_question = {}
+        choices = Choice.objects.for_question(chunk[0].pk).filter(
+            question_id__in=[q.pk for q in chunk]).order_by('pk')
+        # Not pinned while yielding, the next chunk may be asked for from
+        # another thread (mysite/asgi_handler.py).
+        with sharding.question_shard(chunk[0].pk):
+            tallied = votes.tally(choices.iterator())
+        for c in tallied:
+            by_question.setdefault(c.question_id, []).append(c)
+        for q in chunk:
+            row = {'question_id': q.pk, 'question_text': q.question_text,
+                   'pub_date': q.pub_date.isoformat()}
+            question_choices = by_question.get(q.pk)
+            if not question_choices:
+                row.update(choice_id=None, choice_text=None, votes=None)
+                yield row
+                continue
+            for c in question_choices:
+                yield dict(row, choice_id=c.pk, choice_text=c.choice_text,
+                           votes=c.votes)
+
+
+class _Echo(object):
+    """File like object that hands back what csv.writer writes to it."""
+
+    def write(self, value):
+        return value
+
+
+def as_csv(rows):
+    """Turns the dicts from export_rows() into CSV lines, header first."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(FIELDS)
+    for row in rows:
+        yield writer.writerow(['' if row[f] is None else row[f]
+                               for f in FIELDS])
+
+
+def as_ndjson(rows):
+    """Turns the dicts from export_rows() into one JSON object per line."""
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+FORMATS = {
+    'csv': (as_csv, 'text/csv'),
+    'ndjson': (as_ndjson, 'application/x-ndjson'),
+}
@@ -0,0 +1,173 @@
+"""Vote history, for "votes per minute over the last day" questions.
+
+With POLLS_VOTE_HISTORY on every recorded vote also adds a VoteEvent row
+(polls/signals.py). Those are never updated and never read by a page.
+compact(), run every minute or so by `python manage.py compact_votes`, adds
+them up per choice into VoteRollup rows for each minute, hour and day, and
+the trend API (polls/api.py) reads only those, so drawing a chart costs the
+same with a thousand votes or a few billion.
+
+Compacting is repeatable: it redoes every bucket from the newest minute
+rollup on (the newest one may have been only partly done) and replaces the
+rows it had written before. It leaves out the last POLLS_HISTORY_LAG seconds,
+votes still being committed could be missing from those. Days and hours are
+UTC.
+
+prune() deletes old rows in batches, so no single DELETE holds locks for
+long: events older than POLLS_HISTORY_KEEP_EVENTS days once they are rolled
+up, and rollups older than POLLS_HISTORY_KEEP_ROLLUPS days per period.
+
+Both work on the database the router picks for the vote tables. With the
+polls sharded (polls/sharding.py) compact_votes runs them once per shard,
+pinned to it.
+"""
+
+import collections
+import datetime
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .models import Choice, VoteEvent, VoteRollup
+
+PERIODS = dict((name, seconds) for seconds, name
+               in VoteRollup.PERIOD_CHOICES)
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=timezone.utc)
+# Which period is added up from which.
+FEEDS = {VoteRollup.MINUTE: VoteRollup.HOUR, VoteRollup.HOUR: VoteRollup.DAY}
+
+
+def enabled():
+    return getattr(settings, 'POLLS_VOTE_HISTORY', False)
+
+
+def floor(when, seconds):
+    """@param 'when' rounded down to a multiple of @param 'seconds'."""
+    offset = int((when - EPOCH).total_seconds()) // seconds * seconds
+    return EPOCH + datetime.timedelta(seconds=offset)
+
+
+def record(increments, when=None):
+    """Adds a VoteEvent per choice of @param 'increments', a dict of choice
+    id to votes. One INSERT.
+    """
+    when = when or timezone.now()
+    VoteEvent.objects.bulk_create([
+        VoteEvent(choice_id=choice_id, created=when, count=count)
+        for choice_id, count in increments.items()])
+
+
+def watermark():
+    """Where the next compact() starts, None when there is nothing yet."""
+    last = VoteRollup.objects.filter(
+        period=VoteRollup.MINUTE).aggregate(Max('start'))['start__max']
+    if last is not None:
+        return last
+    first = VoteEvent.objects.aggregate(Min('created'))['created__min']
+    return floor(first, VoteRollup.MINUTE) if first is not None else None
+
+
+def compact(now=None):
+    """Rolls the events up to POLLS_HISTORY_LAG seconds before @param 'now'
+    into minutes, those into hours and those into days. Returns how many
+    events were read.
+    """
+    now = now or timezone.now()
+    lag = getattr(settings, 'POLLS_HISTORY_LAG', 60)
+    until = floor(now - datetime.timedelta(seconds=lag), VoteRollup.MINUTE)
+    since = watermark()
+    if since is None or since >= until:
+        return 0
+    minutes = collections.Counter()
+    events = VoteEvent.objects.filter(
+        created__gte=since, created__lt=until
+    ).order_by().values_list('choice_id', 'created', 'count')
+    read = 0
+    for choice_id, created, count in events.iterator():
+        minutes[choice_id, floor(created, VoteRollup.MINUTE)] += count
+        read += 1
+    with transaction.atomic(using=router.db_for_write(VoteRollup)):
+        _replace(VoteRollup.MINUTE, since, until, minutes)
+        smaller = VoteRollup.MINUTE
+        for period in (VoteRollup.HOUR, VoteRollup.DAY):
+            start = floor(since, period)
+            totals = collections.Counter()
+            for choice_id, bucket, votes in VoteRollup.objects.filter(
+                    period=smaller, start__gte=start, start__lt=until
+            ).values_list('choice_id', 'start', 'votes').iterator():
+                totals[choice_id, floor(bucket, period)] += votes
+            _replace(period, start, until, totals)
+            smaller = period
+    return read
+
+
+def _replace(period, since, until, totals):
+    """Swaps the rollups of @param 'period' between @param 'since' and
+    @param 'until' for @param 'totals', a Counter of (choice id, start).
+    """
+    # The events of deleted choices stay around until they are pruned.
+    existing = set(Choice.objects.filter(
+        pk__in=set(choice_id for choice_id, _ in totals)
+    ).values_list('pk', flat=True)) if totals else set()
+    VoteRollup.objects.filter(
+        period=period, start__gte=since, start__lt=until).delete()
+    VoteRollup.objects.bulk_create([
+        VoteRollup(choice_id=choice_id, period=period, start=start,
+                   votes=votes)
+        for (choice_id, start), votes in totals.items()
+        if choice_id in existing], batch_size=500)
+
+
+def _delete_before(queryset, field, limit, batch_size):
+    deleted = 0
+    while True:
+        ids = list(queryset.filter(**{field + '__lt': limit}).order_by(
+        ).values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        queryset.filter(pk__in=ids).delete()
+        deleted += len(ids)
+
+
+def prune(now=None, batch_size=10000):
+    """Deletes old events and rollups, returns how many of each as a dict."""
+    now = now or timezone.now()
+    deleted = {}
+    keep = getattr(settings, 'POLLS_HISTORY_KEEP_EVENTS', 7)
+    limit = now - datetime.timedelta(days=keep)
+    # Never delete events that haven't been rolled up yet.
+    done = watermark()
+    if done is not None:
+        deleted['events'] = _delete_before(
+            VoteEvent.objects.all(), 'created', min(limit, done), batch_size)
+    keep_rollups = getattr(settings, 'POLLS_HISTORY_KEEP_ROLLUPS', {})
+    for name, seconds in sorted(PERIODS.items()):
+        days = keep_rollups.get(name)
+        if days is None:
+            continue
+        # compact() adds up the hour (day) the watermark is in again from its
+        # minutes (hours), those have to stay.
+        limit = now - datetime.timedelta(days=days)
+        if seconds in FEEDS and done is not None:
+            limit = min(limit, floor(done, FEEDS[seconds]))
+        deleted[name] = _delete_before(
+            VoteRollup.objects.filter(period=seconds), 'start', limit,
+            batch_size)
+    return deleted
+
+
+def trend(choice_ids, period, since, until=None):
+    """The rollups of @param 'choice_ids' as a list of (start, {choice id:
+    votes}) in time order, buckets without votes left out.
+    """
+    rollups = VoteRollup.objects.filter(
+        choice_id__in=choice_ids, period=period, start__gte=since)
+    if until is not None:
+        rollups = rollups.filter(start__lt=until)
+    buckets = collections.OrderedDict()
+    for start, choice_id, votes in rollups.order_by('start').values_list(
+            'start', 'choice_id', 'votes'):
+        buckets.setdefault(start, {})[choice_id] = votes
+    return list(buckets.items())
@@ -0,0 +1,270 @@
+"""Live results pushed to browsers with server-sent events (polls:stream).
+
+Every process runs a single ResultsFeed. Browsers watching a question
+subscribe to the feed instead of polling the database themselves. A
+background thread wakes up every 1 / POLLS_LIVE_MAX_RATE seconds, checks the
+change times from polls/versions.py for all watched questions in one cache
+call (that covers votes recorded by the other processes too), loads the
+tally of each changed question once and hands the difference to all of its
+subscribers. However many people watch a question, it costs one tally per
+tick, and bursts of votes inside a tick go out as one update.
+
+The tally of a changed question is counted in the database, not taken from
+polls/results_cache.py, which may keep it for up to POLLS_RESULTS_STALENESS
+seconds after a vote.
+
+Under WSGI each open stream keeps a server thread busy waiting for the next
+update. Under ASGI (mysite/asgi_handler.py) the EventStream is read without
+blocking from the event loop instead, an open stream then costs no thread at
+all. Streams end after POLLS_LIVE_MAX_AGE seconds; EventSource in the
+browser reconnects on its own, which lets long-lived connections move
+between workers.
+"""
+
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import Question
+from . import results_cache, versions
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription(object):
+    """One watcher of a question. Updates that arrive faster than the
+    watcher reads them are merged into one.
+    """
+
+    def __init__(self, feed, question_id):
+        self.feed = feed
+        self.question_id = question_id
+        self._cond = threading.Condition()
+        self._tally = None
+        self._deltas = {}
+        # Called from the feed's thread after each push, see EventStream.
+        self.on_push = None
+
+    def push(self, tally, deltas):
+        with self._cond:
+            self._tally = tally
+            for choice_id, n in deltas.items():
+                self._deltas[choice_id] = self._deltas.get(choice_id, 0) + n
+            self._cond.notify()
+            on_push = self.on_push
+        if on_push is not None:
+            on_push()
+
+    def wait(self, timeout):
+        """Returns the next {'tally': ..., 'deltas': ...} update, or None if
+        there was none within @param 'timeout' seconds.
+        """
+        with self._cond:
+            if self._tally is None:
+                self._cond.wait(timeout)
+            return self.take()
+
+    def take(self):
+        """The update waiting, or None. Never blocks."""
+        with self._cond:
+            if self._tally is None:
+                return None
+            update = {'tally': self._tally, 'deltas': self._deltas}
+            self._tally, self._deltas = None, {}
+            return update
+
+
+class ResultsFeed(object):
+
+    def __init__(self, interval=1.0, autostart=True):
+        self.interval = interval
+        self.autostart = autostart
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._seen = {}
+        self._last_tally = {}
+        self._dirty = set()
+        self._thread = None
+
+    def subscribe(self, question_id):
+        """Adds a watcher, which right away gets the current tally."""
+        sub = Subscription(self, question_id)
+        tally = self.tally(question_id)
+        with self._lock:
+            self._subscribers.setdefault(question_id, set()).add(sub)
+            self._last_tally.setdefault(question_id, tally)
+        sub.push(tally, {})
+        if self.autostart:
+            self.start()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.question_id, set())
+            subs.discard(sub)
+            if not subs:
+                self._subscribers.pop(sub.question_id, None)
+                self._seen.pop(sub.question_id, None)
+                self._last_tally.pop(sub.question_id, None)
+
+    def watching(self):
+        with self._lock:
+            return dict((pk, len(subs))
+                        for pk, subs in self._subscribers.items())
+
+    def notify(self, question_ids):
+        """Called when this process recorded votes, so the next tick
+        doesn't depend on the cache to notice.
+        """
+        with self._lock:
+            self._dirty.update(pk for pk in question_ids
+                               if pk in self._subscribers)
+
+    def tally(self, question_id, cached=True):
+        """{choice id: votes} of @param 'question_id'. Unless @param 'cached'
+        it is counted in the database, see the module docstring.
+        """
+        question = Question(pk=question_id)
+        if cached:
+            results = results_cache.get_results(question)
+        else:
+            results = results_cache.load(question)
+        return dict((r['id'], r['votes']) for r in results)
+
+    def tick(self):
+        """Sends an update for each watched question that changed since the
+        last tick.
+        """
+        with self._lock:
+            watched = list(self._subscribers)
+            dirty, self._dirty = self._dirty, set()
+        if not watched:
+            return
+        changed_at = versions.last_changed_many(watched)
+        for question_id in watched:
+            stamp = changed_at.get(question_id)
+            if question_id not in dirty and \
+                    stamp == self._seen.get(question_id):
+                continue
+            self._seen[question_id] = stamp
+            tally = self.tally(question_id, cached=False)
+            with self._lock:
+                before = self._last_tally.get(question_id, {})
+                self._last_tally[question_id] = tally
+                subs = list(self._subscribers.get(question_id, ()))
+            deltas = dict((pk, n - before.get(pk, 0))
+                          for pk, n in tally.items()
+                          if n != before.get(pk, 0))
+            if not deltas:
+                continue
+            for sub in subs:
+                sub.push(tally, deltas)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run,
+                                            name='polls-results-feed')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            close_old_connections()
+            try:
+                self.tick()
+            except Exception:
+                logger.exception('Updating the live results failed')
+
+
+feed = ResultsFeed(
+    interval=1.0 / getattr(settings, 'POLLS_LIVE_MAX_RATE', 1.0))
+
+
+class EventStream(object):
+    """The text/event-stream of one Subscription @param 'sub', which ends
+    after @param 'max_age' seconds (POLLS_LIVE_MAX_AGE by default).
+
+    Iterating it blocks the thread until the next update. An event loop
+    calls poll() instead, which never blocks, and waits for the callback
+    given to on_ready() or for timeout() seconds before polling again.
+    Closing it unsubscribes.
+    """
+
+    def __init__(self, sub, max_age=None, heartbeat=15):
+        if max_age is None:
+            max_age = getattr(settings, 'POLLS_LIVE_MAX_AGE', 300)
+        self.sub = sub
+        self.heartbeat = heartbeat
+        self.ends = time.time() + max_age
+        self._beat = None
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        chunk = self.poll()
+        while chunk is None:
+            update = self.sub.wait(self.timeout())
+            chunk = self.poll() if update is None else self._event(update)
+        return chunk
+    next = __next__
+
+    def poll(self):
+        """The next chunk, or None when there is nothing to send yet. Raises
+        StopIteration once the stream is over.
+        """
+        now = time.time()
+        if self._closed:
+            raise StopIteration
+        if self._beat is None:
+            self._beat = now + self.heartbeat
+            # Tell EventSource to wait a few seconds before reconnecting.
+            return 'retry: 3000\n\n'
+        update = self.sub.take()
+        if update is not None:
+            return self._event(update)
+        if now >= self.ends:
+            self.close()
+            raise StopIteration
+        if now >= self._beat:
+            self._beat = now + self.heartbeat
+            # A comment line keeps proxies from closing an idle stream.
+            return ': keep-alive\n\n'
+        return None
+
+    def timeout(self):
+        """Seconds until poll() has something to send even without an
+        update.
+        """
+        return max(min(self._beat or 0, self.ends) - time.time(), 0)
+
+    def on_ready(self, callback):
+        """Has @param 'callback' called, from any thread, whenever an update
+        arrives.
+        """
+        self.sub.on_push = callback
+
+    def _event(self, update):
+        self._beat = time.time() + self.heartbeat
+        data = {
+            'question': self.sub.question_id,
+            'tally': update['tally'],
+            'deltas': update['deltas'],
+        }
+        return 'event: results\ndata: %s\n\n' % json.dumps(data)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.sub.on_push = None
+            self.sub.feed.unsubscribe(self.sub)
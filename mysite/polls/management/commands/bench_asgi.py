@@ -0,0 +1,179 @@
+"""Run with `python manage.py bench_asgi --clients 200 --slow 0.2`.
+
+Compares WSGI and ASGI (mysite/asgi_handler.py) serving the same pages to
+many slow clients, on the same machine and with the same number of threads
+(--workers) doing the Django work:
+
+    wsgi  like sync workers (gunicorn, uwsgi): a worker takes a request and
+          is busy until the client has sent it, the view ran and the client
+          has read the response.
+    asgi  the event loop waits for the clients, the threads only run the
+          views.
+
+Each of --clients clients sends requests one after another. A client takes
+--slow seconds per request for itself, half sending the request, half
+reading the response, a phone on a bad connection for example. Both sides
+call the real application in-process with every middleware, view and query
+included, only the HTTP server and the network are left out (they are
+played by sleeps). Reports requests per second and p50/p95/p99 latency as
+seen by the clients. Run bench_polls --seed first on an empty database.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from polls import bench
+from polls.models import Question
+
+
+class Command(BaseCommand):
+    help = 'Compare WSGI and ASGI throughput with slow clients.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=200,
+                            help='Clients connected at the same time.')
+        parser.add_argument('--requests', type=int, default=2000,
+                            help='Requests per run, spread over the clients.')
+        parser.add_argument('--slow', type=float, default=0.2,
+                            help='Seconds a client spends sending a request '
+                                 'and reading the response.')
+        parser.add_argument('--workers', type=int, default=10,
+                            help='WSGI workers, and ASGI threads.')
+
+    def handle(self, *args, **options):
+        from mysite.asgi_handler import ASGIHandler
+        from mysite.wsgi import application
+        self.host = (settings.ALLOWED_HOSTS or ['localhost'])[0].lstrip(
+            '.').replace('*', 'localhost')
+        self.paths = ['/polls/'] + [
+            '/polls/%d/' % pk for pk in Question.objects.published()
+            .order_by('-pub_date').values_list('pk', flat=True)[:1000]]
+        if len(self.paths) == 1:
+            raise CommandError('No published questions, try '
+                               'bench_polls --seed.')
+        self.slow = options['slow'] / 2.0
+
+        perf_logger = logging.getLogger('polls.perf')
+        was_disabled, perf_logger.disabled = perf_logger.disabled, True
+        try:
+            pool = ThreadPoolExecutor(options['workers'])
+            wsgi = self.run(options, lambda path: self.wsgi_request(
+                application, pool, path))
+            asgi_app = ASGIHandler(application, threads=options['workers'])
+            asgi = self.run(options, lambda path: self.asgi_request(
+                asgi_app, path))
+        finally:
+            perf_logger.disabled = was_disabled
+
+        self.stdout.write('%d clients, %.0f ms each per request, %d workers'
+                          % (options['clients'], options['slow'] * 1000,
+                             options['workers']))
+        for name, result in [('wsgi', wsgi), ('asgi', asgi)]:
+            self.stdout.write(
+                '%-5s %7.0f req/s  p50 %7.1f  p95 %7.1f  p99 %7.1f ms'
+                '  %d errors' % (name, result['rps'], result['p50_ms'],
+                                 result['p95_ms'], result['p99_ms'],
+                                 result['errors']))
+
+    def environ(self, path):
+        return {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': path,
+            'QUERY_STRING': '',
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'HTTP_HOST': self.host,
+            'wsgi.input': None,
+            'wsgi.errors': None,
+            'wsgi.url_scheme': 'http',
+            'wsgi.version': (1, 0),
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+
+    async def wsgi_request(self, application, pool, path):
+        def work():
+            # The worker waits for the client, in its own thread.
+            time.sleep(self.slow)
+            status = {}
+
+            def start_response(line, headers, exc_info=None):
+                status['code'] = int(line.split()[0])
+
+            response = application(self.environ(path), start_response)
+            try:
+                b''.join(response)
+            finally:
+                response.close()
+            time.sleep(self.slow)
+            return status['code']
+        return await asyncio.get_event_loop().run_in_executor(pool, work)
+
+    async def asgi_request(self, application, path):
+        status = {}
+        sent = []
+
+        async def receive():
+            if sent:
+                # Asked for again to notice a disconnect, which never comes.
+                await asyncio.sleep(3600)
+            sent.append(True)
+            await asyncio.sleep(self.slow)
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+            elif not message.get('more_body'):
+                await asyncio.sleep(self.slow)
+
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': path,
+            'query_string': b'', 'headers': [(b'host', self.host.encode())],
+        }
+        await application(scope, receive, send)
+        return status['code']
+
+    def run(self, options, request):
+        """Runs the clients against @param 'request', a coroutine function
+        taking a path and returning the status code.
+        """
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        todo = [options['requests']]
+        timings, errors = [], [0]
+
+        async def client():
+            while todo[0] > 0:
+                todo[0] -= 1
+                started = time.time()
+                try:
+                    status = await request(random.choice(self.paths))
+                except Exception:
+                    status = 500
+                timings.append((time.time() - started) * 1000)
+                if status >= 400:
+                    errors[0] += 1
+
+        started = time.time()
+        try:
+            loop.run_until_complete(asyncio.gather(
+                *[client() for _ in range(options['clients'])]))
+        finally:
+            loop.close()
+        elapsed = time.time() - started
+        timings.sort()
+        return {
+            'rps': len(timings) / elapsed if elapsed else 0,
+            'p50_ms': bench.percentile(timings, 50),
+            'p95_ms': bench.percentile(timings, 95),
+            'p99_ms': bench.percentile(timings, 99),
+            'errors': errors[0],
+        }
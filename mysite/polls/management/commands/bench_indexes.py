@@ -0,0 +1,95 @@
+"""Run with `python manage.py bench_indexes --seed`.
+
+Fills the database with a large number of questions and choices, then prints
+the query plan and timings of the queries behind the polls pages. To compare
+before and after the indexes of 0004_hot_path_indexes run it once with the
+migrations at 0003, save the --json output, migrate and run it again with
+--compare pointing at the saved file:
+
+    python manage.py migrate polls 0003
+    python manage.py bench_indexes --seed --json before.json
+    python manage.py migrate polls
+    python manage.py bench_indexes --json after.json --compare before.json
+
+Use a throw away database for this, --seed adds millions of rows.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from polls import bench
+from polls.models import Question, Choice
+
+
+class Command(BaseCommand):
+    help = 'Seed a large polls dataset and time the hot queries.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', action='store_true',
+                            help='Insert the dataset first.')
+        parser.add_argument('--questions', type=int, default=1000000)
+        parser.add_argument('--choices', type=int, default=10,
+                            help='Choices per question.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=50,
+                            help='Times each query is run.')
+        parser.add_argument('--json', dest='json_path',
+                            help='Write the timings to this file.')
+        parser.add_argument('--compare',
+                            help='Timings file of an earlier run.')
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            bench.seed(options['questions'], options['choices'],
+                       options['batch_size'], self.stdout.write)
+        results = {}
+        for name, queryset in self.queries():
+            self.stdout.write('== %s' % name)
+            for line in self.plan(queryset):
+                self.stdout.write('   %s' % line)
+            results[name] = self.time(queryset, options['repeat'])
+            self.stdout.write('   median %.3f ms, max %.3f ms' % (
+                results[name]['median_ms'], results[name]['max_ms']))
+        if options['json_path']:
+            bench.save(options['json_path'], results)
+        if options['compare']:
+            before = bench.load(options['compare'])
+            self.stdout.write('== compared to %s' % options['compare'])
+            for name in sorted(set(before) & set(results)):
+                was = before[name]['median_ms']
+                now = results[name]['median_ms']
+                self.stdout.write('   %-20s %9.3f ms -> %9.3f ms (%.1fx)' % (
+                    name, was, now, was / now if now else float('inf')))
+
+    def queries(self):
+        sample = Question.objects.published().order_by(
+            '-pub_date').values_list('pk', flat=True).first()
+        yield 'index', Question.objects.published().order_by('-pub_date')[:5]
+        yield 'detail', Question.objects.published().filter(pk=sample)
+        yield 'choices', Choice.objects.filter(question_id=sample)
+        yield 'results_by_votes', Choice.objects.filter(
+            question_id=sample).order_by('-votes')
+
+    def plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        if connection.vendor == 'sqlite':
+            sql = 'EXPLAIN QUERY PLAN ' + sql
+        else:
+            sql = 'EXPLAIN ' + sql
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [' | '.join(str(col) for col in row)
+                    for row in cursor.fetchall()]
+
+    def time(self, queryset, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.time()
+            # _clone() so every run goes to the database.
+            list(queryset._clone())
+            timings.append((time.time() - started) * 1000)
+        timings.sort()
+        return {'median_ms': timings[len(timings) // 2],
+                'max_ms': timings[-1], 'runs': repeat}
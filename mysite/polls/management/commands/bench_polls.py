@@ -0,0 +1,239 @@
+"""Run with `python manage.py bench_polls --json run.json`.
+
+Load test of the whole site: several worker threads call the real WSGI
+application from mysite/wsgi.py in-process (every middleware, URL
+resolution, view and template included, only the HTTP server is left out)
+for each scenario:
+
+    index       GET /polls/
+    detail      GET /polls/<id>/ of random questions
+    results     GET /polls/<id>/results/ of random questions
+    vote        POST /polls/<id>/vote/ for random choices
+    vote_storm  every worker voting for the same choice (a hot poll)
+
+and reports p50/p95/p99 latency, requests per second and queries per request
+(read from the Server-Timing header of polls/middleware.py, so the timing
+middleware is on for every request during the run).
+
+Save a run with --json and compare a later one against it with --compare;
+any scenario whose p95 grew or whose requests/s dropped by more than
+--threshold (10% by default) is flagged and the command exits with an error.
+--seed fills the database first, use a throw away database.
+"""
+
+import io
+import logging
+import random
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils.http import urlencode
+
+from polls import bench
+from polls.models import Question, Choice
+
+SCENARIOS = ['index', 'detail', 'results', 'vote', 'vote_storm']
+CSRF_TOKEN = 'b' * 32
+QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+class Command(BaseCommand):
+    help = 'Drive the WSGI application with concurrent clients.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', action='store_true',
+                            help='Insert a dataset first.')
+        parser.add_argument('--questions', type=int, default=10000)
+        parser.add_argument('--choices', type=int, default=5,
+                            help='Choices per question.')
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Concurrent client threads.')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests per worker per scenario.')
+        parser.add_argument('--scenario', action='append',
+                            choices=SCENARIOS,
+                            help='Only run these, may be repeated.')
+        parser.add_argument('--json', dest='json_path',
+                            help='Write the results to this file.')
+        parser.add_argument('--compare',
+                            help='Results file of an earlier run.')
+        parser.add_argument('--threshold', type=float, default=0.1,
+                            help='Allowed slowdown before flagging.')
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            bench.seed(options['questions'], options['choices'],
+                       progress=self.stdout.write)
+        from mysite.wsgi import application
+        self.application = application
+        self.targets = self.pick_targets()
+        if not self.targets:
+            raise CommandError('No published questions, try --seed.')
+
+        results = {
+            'meta': {
+                'workers': options['workers'],
+                'requests_per_worker': options['requests'],
+                'database': connection.vendor,
+                'started': time.time(),
+            },
+        }
+        # The per request log lines would drown the report.
+        perf_logger = logging.getLogger('polls.perf')
+        was_disabled, perf_logger.disabled = perf_logger.disabled, True
+        try:
+            # The workers all vote from the same address, the per voter
+            # limits (polls/throttle.py) would answer 429 instead of timing
+            # the vote.
+            with override_settings(POLLS_PERF_SAMPLE_RATE=1.0,
+                                   POLLS_VOTE_RATE=None,
+                                   POLLS_VOTE_DEDUP=False):
+                self.run_all(options, results)
+        finally:
+            perf_logger.disabled = was_disabled
+        if options['json_path']:
+            bench.save(options['json_path'], results)
+        if options['compare']:
+            self.compare(bench.load(options['compare']), results,
+                         options['threshold'])
+
+    def run_all(self, options, results):
+        for name in options['scenario'] or SCENARIOS:
+            result = results[name] = self.run_scenario(
+                name, options['workers'], options['requests'])
+            self.stdout.write(
+                '%-10s %7.0f req/s  p50 %7.2f  p95 %7.2f  p99 %7.2f ms'
+                '  %.1f queries  %d errors' % (
+                    name, result['rps'], result['p50_ms'], result['p95_ms'],
+                    result['p99_ms'], result['queries_mean'],
+                    result['errors']))
+
+    def pick_targets(self):
+        """(question id, choice id) pairs of up to 1000 published
+        questions.
+        """
+        question_ids = list(Question.objects.published().order_by(
+            '-pub_date').values_list('pk', flat=True)[:1000])
+        return list(Choice.objects.filter(
+            question_id__in=question_ids).values_list('question_id', 'pk'))
+
+    def request(self, method, path, data=None):
+        """Calls the WSGI application once, returns (status, queries)."""
+        body = urlencode(data or {}).encode()
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': '',
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'HTTP_HOST': (settings.ALLOWED_HOSTS or ['localhost'])[0]
+            .lstrip('.').replace('*', 'localhost'),
+            'HTTP_COOKIE': '%s=%s' % (settings.CSRF_COOKIE_NAME, CSRF_TOKEN),
+            'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': io.StringIO(),
+            'wsgi.url_scheme': 'http',
+            'wsgi.version': (1, 0),
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split()[0])
+            response['headers'] = dict(headers)
+
+        chunks = self.application(environ, start_response)
+        try:
+            for _ in chunks:
+                pass
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+        match = QUERIES.search(response['headers'].get('Server-Timing', ''))
+        return response['status'], int(match.group(1)) if match else 0
+
+    def next_request(self, name, hot):
+        question_id, choice_id = random.choice(self.targets)
+        if name == 'index':
+            return 'GET', '/polls/', None
+        if name == 'detail':
+            return 'GET', '/polls/%d/' % question_id, None
+        if name == 'results':
+            return 'GET', '/polls/%d/results/' % question_id, None
+        if name == 'vote_storm':
+            question_id, choice_id = hot
+        return 'POST', '/polls/%d/vote/' % question_id, {
+            'choice': choice_id, 'csrfmiddlewaretoken': CSRF_TOKEN}
+
+    def run_scenario(self, name, workers, per_worker):
+        hot = self.targets[0]
+        timings, queries, errors = [], [], []
+        lock = threading.Lock()
+        gate = threading.Event()
+
+        def worker():
+            mine, my_queries, my_errors = [], [], 0
+            gate.wait()
+            try:
+                for _ in range(per_worker):
+                    method, path, data = self.next_request(name, hot)
+                    started = time.time()
+                    try:
+                        status, count = self.request(method, path, data)
+                    except Exception:
+                        status, count = 500, 0
+                    mine.append((time.time() - started) * 1000)
+                    my_queries.append(count)
+                    if status >= 400:
+                        my_errors += 1
+            finally:
+                connection.close()
+            with lock:
+                timings.extend(mine)
+                queries.extend(my_queries)
+                errors.append(my_errors)
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for t in threads:
+            t.start()
+        started = time.time()
+        gate.set()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - started
+        timings.sort()
+        return {
+            'requests': len(timings),
+            'errors': sum(errors),
+            'seconds': elapsed,
+            'rps': len(timings) / elapsed if elapsed else 0,
+            'p50_ms': bench.percentile(timings, 50),
+            'p95_ms': bench.percentile(timings, 95),
+            'p99_ms': bench.percentile(timings, 99),
+            'queries_mean': sum(queries) / float(len(queries) or 1),
+        }
+
+    def compare(self, before, after, threshold):
+        flagged = []
+        self.stdout.write('== compared to the earlier run')
+        for name in SCENARIOS:
+            if name not in before or name not in after:
+                continue
+            was, now = before[name], after[name]
+            p95 = now['p95_ms'] / was['p95_ms'] - 1 if was['p95_ms'] else 0
+            rps = 1 - now['rps'] / was['rps'] if was['rps'] else 0
+            bad = p95 > threshold or rps > threshold
+            self.stdout.write('%-10s p95 %+6.1f%%  req/s %+6.1f%%%s' % (
+                name, p95 * 100, -rps * 100, '  REGRESSION' if bad else ''))
+            if bad:
+                flagged.append(name)
+        if flagged:
+            raise CommandError('Slower than before: %s' % ', '.join(flagged))
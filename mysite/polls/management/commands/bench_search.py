@@ -0,0 +1,86 @@
+"""Run with `python manage.py bench_search --seed 10000000` once to fill the
+database, then `python manage.py bench_search` to compare again.
+
+--seed adds questions made of random words (a few common, most rare, like
+real text) with four choices each and rebuilds the search index, which takes
+a long while for ten million. Then for a rare word, a common word and two
+words together it times
+
+    like      what the admin did with search_fields, question_text LIKE
+              '%word%' for each word, counted and the first page listed
+    index     the admin search now (polls/search.py matching()), same page
+    ranked    the public search page, best matches first
+"""
+
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from polls import bench, search
+from polls.models import Question, SearchPosting
+
+VOCABULARY = 20000
+
+
+def word(rank):
+    # The x keeps LIKE '%w1x%' from also finding w12x.
+    return 'w%dx' % rank
+
+
+def random_text(words):
+    # Zipf like, low ranks come up far more often.
+    return ' '.join(word(int(VOCABULARY ** random.random()))
+                    for _ in range(words))
+
+
+class Command(BaseCommand):
+    help = 'Compare the search index with LIKE on a big database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Questions to add first.')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def queries(self):
+        return [('rare', word(VOCABULARY - 1)), ('common', word(1)),
+                ('two words', '%s %s' % (word(1), word(50)))]
+
+    def like(self, query):
+        questions = Question.objects.all()
+        for term in query.split():
+            questions = questions.filter(question_text__icontains=term)
+        return questions.count(), list(questions.order_by('-pk')[:100])
+
+    def index(self, query):
+        questions = search.matching(Question.objects.all(), query)
+        return questions.count(), list(questions.order_by('-pk')[:100])
+
+    def ranked(self, query):
+        return search.search(query)
+
+    def timed(self, func, query):
+        best = None
+        for _ in range(self.repeat):
+            started = time.time()
+            func(query)
+            elapsed = time.time() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best * 1000
+
+    def handle(self, *args, **options):
+        self.repeat = options['repeat']
+        if options['seed']:
+            bench.seed(options['seed'], 4, progress=self.stderr.write,
+                       question_text=lambda n: random_text(8),
+                       choice_text=lambda n: random_text(2))
+            search.rebuild(5000, progress=self.stderr.write)
+        self.stdout.write('%d questions, %d index rows' % (
+            Question.objects.count(), SearchPosting.objects.count()))
+        self.stdout.write('%-10s %-14s %10s %10s %10s' % (
+            'query', 'words', 'like', 'index', 'ranked'))
+        for name, query in self.queries():
+            self.stdout.write('%-10s %-14s %7.1f ms %7.1f ms %7.1f ms' % (
+                name, query, self.timed(self.like, query),
+                self.timed(self.index, query),
+                self.timed(self.ranked, query)))
@@ -0,0 +1,87 @@
+"""Run with `python manage.py bench_startup`.
+
+Starts fresh Python processes that import a WSGI module and its URLconf
+(which Django would otherwise load on the first request), the way a web
+server worker starts, and prints for each profile how long that took, the
+worker's memory (RSS) afterwards and how many modules it loaded. By default
+it compares
+
+    full      mysite.wsgi, everything in mysite/settings.py
+    slim      mysite.wsgi_public, only the public polls pages
+              (mysite/settings_public.py)
+
+Other profiles can be given as name=wsgi.module or
+name=wsgi.module:settings.module, the settings module otherwise is whatever
+the WSGI module picks.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.bench import percentile
+
+PROFILES = ['full=mysite.wsgi', 'slim=mysite.wsgi_public']
+
+CHILD = '''
+import importlib, json, resource, sys, time
+
+started = time.time()
+importlib.import_module(sys.argv[1])
+from django.core.urlresolvers import get_resolver
+get_resolver(None).url_patterns
+elapsed = time.time() - started
+try:
+    with open('/proc/self/status') as status:
+        rss_kb = int([line.split()[1] for line in status
+                      if line.startswith('VmRSS:')][0])
+except IOError:
+    # No /proc, the peak is the closest (in bytes on OS X).
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss_kb //= 1024
+print(json.dumps({'startup_ms': elapsed * 1000, 'rss_kb': rss_kb,
+                  'modules': len(sys.modules)}))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Compare worker start up time and memory of the WSGI profiles.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('profiles', nargs='*', default=PROFILES)
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Processes started per profile.')
+
+    def start_worker(self, module, settings_module):
+        env = dict(os.environ)
+        if settings_module:
+            env['DJANGO_SETTINGS_MODULE'] = settings_module
+        else:
+            env.pop('DJANGO_SETTINGS_MODULE', None)
+        try:
+            output = subprocess.check_output(
+                [sys.executable, '-c', CHILD, module],
+                cwd=settings.BASE_DIR, env=env, stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError as e:
+            raise CommandError('Importing %s failed:\n%s' %
+                               (module, e.output.decode()))
+        return json.loads(output.decode().strip().splitlines()[-1])
+
+    def handle(self, *args, **options):
+        self.stdout.write('%-8s %12s %12s %10s %8s' % (
+            'profile', 'startup p50', 'startup max', 'rss', 'modules'))
+        for profile in options['profiles']:
+            name, _, target = profile.rpartition('=')
+            module, _, settings_module = target.partition(':')
+            runs = [self.start_worker(module, settings_module)
+                    for _ in range(options['repeat'])]
+            startups = sorted(run['startup_ms'] for run in runs)
+            self.stdout.write('%-8s %9.1f ms %9.1f ms %7.1f MB %8d' % (
+                name or module, percentile(startups, 50), startups[-1],
+                max(run['rss_kb'] for run in runs) / 1024.0,
+                max(run['modules'] for run in runs)))
@@ -0,0 +1,74 @@
+"""Run with `python manage.py build_templates && python manage.py
+bench_templates`.
+
+Renders the index, detail and results templates with a real question from
+the database, the way they were rendered before the production template
+mode and with it:
+
+    plain     templates read and parsed on every render, fragment cache
+              emptied before each render (the old behaviour)
+    cached    cached loader, fragment cache warm
+    built     cached loader over the stripped copies in build/templates/,
+              fragment cache warm
+
+and prints the average render time of each.
+"""
+
+import os
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.template import Context
+from django.template.engine import Engine
+
+from polls import results_cache
+from polls.models import Question
+
+APP_LOADERS = ['django.template.loaders.app_directories.Loader']
+
+
+class Command(BaseCommand):
+    help = 'Time template rendering with and without the production mode.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=500)
+
+    def engines(self):
+        built = os.path.join(settings.BASE_DIR, 'build', 'templates')
+        yield 'plain', Engine(loaders=APP_LOADERS), True
+        yield 'cached', Engine(loaders=[
+            ('django.template.loaders.cached.Loader', APP_LOADERS)]), False
+        if os.path.isdir(built):
+            yield 'built', Engine(dirs=[built], loaders=[
+                ('django.template.loaders.cached.Loader',
+                 ['django.template.loaders.filesystem.Loader'] +
+                 APP_LOADERS)]), False
+        else:
+            self.stderr.write('No %s, run build_templates first.' % built)
+
+    def handle(self, *args, **options):
+        question = Question.objects.published().order_by('-pub_date').first()
+        if question is None:
+            raise CommandError('Needs at least one published question.')
+        contexts = {
+            'polls/index.html': {'latest_question_list': list(
+                Question.objects.published().order_by('-pub_date')[:5])},
+            'polls/detail.html': {'question': question,
+                                  'csrf_token': 'x' * 32},
+            'polls/results.html': {
+                'question': question,
+                'choice_list': results_cache.get_results(question)},
+        }
+        for mode, engine, cold in self.engines():
+            for name, context in sorted(contexts.items()):
+                timings = []
+                for _ in range(options['repeat']):
+                    if cold:
+                        cache.clear()
+                    started = time.time()
+                    engine.get_template(name).render(Context(context))
+                    timings.append(time.time() - started)
+                self.stdout.write('%-8s %-20s %8.3f ms' % (
+                    mode, name, sum(timings) / len(timings) * 1000))
@@ -0,0 +1,66 @@
+"""Run with `python manage.py bench_throttle`.
+
+Measures the vote limits of polls/throttle.py on their own, without the
+database:
+
+    dedup     fills a Bloom filter sized for --voters votes, then prints its
+              memory (per worker, the cache holds one more copy), the add and
+              check rates and how many never seen voters it wrongly takes
+              for repeats
+    rate      the sliding window rate limit against the configured cache,
+              for allowed voters (cache round trips) and blocked ones
+              (answered from the worker's LRU), its counters expire from the
+              cache after two minutes
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from polls import throttle
+
+
+class Command(BaseCommand):
+    help = 'Memory and checks per second of the vote dedup and rate limit.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--voters', type=int, default=1000000)
+        parser.add_argument('--error', type=float, default=getattr(
+            settings, 'POLLS_VOTE_DEDUP_ERROR', 0.001))
+        parser.add_argument('--checks', type=int, default=100000)
+
+    def rate(self, count, started):
+        return count / (time.time() - started)
+
+    def handle(self, *args, **options):
+        voters, checks = options['voters'], options['checks']
+        bits, hashes = throttle.bloom_size(voters, options['error'])
+        bloom = throttle.BloomFilter(bits, hashes)
+        started = time.time()
+        for i in range(voters):
+            bloom.add('ip:%d:1' % i)
+        add_rate = self.rate(voters, started)
+        started = time.time()
+        wrong = sum('ip:%d:2' % i in bloom for i in range(checks))
+        check_rate = self.rate(checks, started)
+        self.stdout.write(
+            'dedup  %d voters, %d hashes, %.2f MB (%.2f MB per million), '
+            '%.0f adds/s, %.0f checks/s, %.3f%% wrongly rejected' % (
+                voters, hashes, len(bloom.array) / 1048576.0,
+                len(bloom.array) / 1048576.0 * 1000000 / voters, add_rate,
+                check_rate, 100.0 * wrong / checks))
+
+        limiter = throttle.RateLimiter()
+        started = time.time()
+        for i in range(checks):
+            limiter.hit('bench:%d' % i, 10, 60)
+        allowed_rate = self.rate(checks, started)
+        for _ in range(11):
+            limiter.hit('bench:flood', 10, 60)
+        started = time.time()
+        for _ in range(checks):
+            limiter.hit('bench:flood', 10, 60)
+        blocked_rate = self.rate(checks, started)
+        self.stdout.write('rate   %.0f allowed checks/s, %.0f blocked checks/s'
+                          % (allowed_rate, blocked_rate))
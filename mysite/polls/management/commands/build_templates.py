@@ -0,0 +1,72 @@
+"""Run with `python manage.py build_templates` as part of a deploy.
+
+Copies the polls templates to build/templates/ with the HTML comments,
+{# #} and {% comment %} blocks and the indentation taken out. The notes in
+those comments are for people reading the templates, there is no reason to
+send them to every browser or to have the template engine walk through them.
+With DEBUG off, settings.py looks in build/templates/ before the app
+templates, so the stripped copies are the ones that get used.
+
+Templates with <pre> or <textarea> are copied unchanged, whitespace matters
+in those.
+"""
+
+import io
+import os
+import re
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+HTML_COMMENT = re.compile(r'<!--(?!\[if).*?-->', re.S)
+TEMPLATE_COMMENT = re.compile(r'{#.*?#}')
+COMMENT_BLOCK = re.compile(r'{%\s*comment\s*%}.*?{%\s*endcomment\s*%}', re.S)
+KEEPS_WHITESPACE = re.compile(r'<(pre|textarea)\b', re.I)
+
+
+def strip_template(source):
+    if KEEPS_WHITESPACE.search(source):
+        return source
+    for pattern in (HTML_COMMENT, TEMPLATE_COMMENT, COMMENT_BLOCK):
+        source = pattern.sub('', source)
+    lines = (line.strip() for line in source.splitlines())
+    return '\n'.join(line for line in lines if line) + '\n'
+
+
+class Command(BaseCommand):
+    help = 'Write comment and whitespace free copies of the templates.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--app', action='append', default=None,
+                            help='App whose templates to build (polls).')
+        parser.add_argument('--output',
+                            default=os.path.join(settings.BASE_DIR, 'build',
+                                                 'templates'))
+
+    def handle(self, *args, **options):
+        before = after = 0
+        for label in options['app'] or ['polls']:
+            source_dir = os.path.join(apps.get_app_config(label).path,
+                                      'templates')
+            for root, dirs, files in os.walk(source_dir):
+                for name in files:
+                    if not name.endswith('.html'):
+                        continue
+                    path = os.path.join(root, name)
+                    target = os.path.join(
+                        options['output'], os.path.relpath(path, source_dir))
+                    with io.open(path, encoding='utf-8') as f:
+                        source = f.read()
+                    built = strip_template(source)
+                    if not os.path.isdir(os.path.dirname(target)):
+                        os.makedirs(os.path.dirname(target))
+                    with io.open(target, 'w', encoding='utf-8') as f:
+                        f.write(built)
+                    before += len(source)
+                    after += len(built)
+                    self.stdout.write('%s: %d -> %d bytes' % (
+                        os.path.relpath(path, source_dir), len(source),
+                        len(built)))
+        self.stdout.write('Templates went from %d to %d bytes.' % (
+            before, after))
@@ -0,0 +1,41 @@
+"""Run with `python manage.py compact_votes` from cron, every minute or so:
+
+    * * * * * cd /path/to/mysite && python manage.py compact_votes
+
+Rolls the raw VoteEvent rows up into minute, hour and day VoteRollup rows and
+then deletes what is old enough, see polls/history.py. With the polls
+sharded it does so on each shard in turn.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from polls import history, sharding
+
+
+class Command(BaseCommand):
+    help = 'Roll up the vote history and prune old rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-prune', action='store_false',
+                            dest='prune', default=True,
+                            help='Only roll up, delete nothing.')
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Rows deleted per DELETE when pruning.')
+
+    def handle(self, *args, **options):
+        for alias in sharding.shards():
+            with sharding.use_shard(alias):
+                self.compact(alias if sharding.enabled() else None, options)
+
+    def compact(self, alias, options):
+        prefix = '%s: ' % alias if alias else ''
+        started = time.time()
+        read = history.compact()
+        self.stdout.write('%sRolled up %d events in %.2fs' % (
+            prefix, read, time.time() - started))
+        if options['prune']:
+            deleted = history.prune(batch_size=options['batch_size'])
+            self.stdout.write('%sPruned %s' % (prefix, ', '.join(
+                '%d %s' % (n, name) for name, n in sorted(deleted.items()))))
@@ -0,0 +1,70 @@
+"""Run with `python manage.py export_polls --format ndjson > polls.ndjson`.
+
+Writes every question with its choices and vote counts to stdout (or
+--output) as CSV or NDJSON, streaming a chunk at a time, see polls/export.py.
+--max-rss makes the command fail if the process grew past the given number
+of MB, which is how the constant memory use is checked on a big dataset:
+
+    python manage.py bench_indexes --seed --questions 1000000 --choices 10
+    python manage.py export_polls --output /dev/null --max-rss 150
+"""
+
+import resource
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from polls import export
+from polls.export import FORMATS, export_rows
+
+
+def parse_when(value):
+    try:
+        return export.parse_when(value)
+    except ValueError as e:
+        raise CommandError(str(e))
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class Command(BaseCommand):
+    help = 'Export questions, choices and votes as CSV or NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FORMATS),
+                            default='csv')
+        parser.add_argument('--since', help='Earliest pub_date to export.')
+        parser.add_argument('--until', help='Latest pub_date to export.')
+        parser.add_argument('--output', help='File to write, default stdout.')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Questions loaded per query.')
+        parser.add_argument('--max-rss', type=float,
+                            help='Fail if peak RSS went over this many MB.')
+
+    def handle(self, *args, **options):
+        since = options['since'] and parse_when(options['since'])
+        until = options['until'] and parse_when(options['until'])
+        render = FORMATS[options['format']][0]
+        out = sys.stdout
+        if options['output']:
+            out = open(options['output'], 'w')
+        started = time.time()
+        count = 0
+        try:
+            rows = export_rows(since, until, options['chunk_size'])
+            for line in render(rows):
+                out.write(line)
+                count += 1
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        rss = peak_rss_mb()
+        self.stderr.write('%d lines in %.1fs, peak RSS %.1f MB' % (
+            count, time.time() - started, rss))
+        if options['max_rss'] and rss > options['max_rss']:
+            raise CommandError('Peak RSS %.1f MB is over the %.1f MB limit'
+                               % (rss, options['max_rss']))
@@ -0,0 +1,171 @@
+"""Run with `python manage.py import_polls polls.csv` (or polls.ndjson, or
+`-` for stdin).
+
+Loads questions and choices in the layout written by export_polls, one line
+at a time, so files far bigger than memory can be imported. Rows are saved
+with bulk_create in batches of --batch-size, one transaction per batch.
+
+Rows sharing a question_id become choices of the same new Question, the ids
+in the file are not kept. Only the question of the previous row is
+remembered, so the rows of a question have to follow each other, the way
+export_polls writes them. A row without choice_text only creates the
+question. The new questions are added to the search index at the end
+(polls/search.py) and the index page's list is rebuilt (polls/schedule.py).
+New ids are handed out by the command itself (bulk_create can't report them
+back on MySQL), so don't run two imports into the same database at once.
+
+--defer-indexes drops the secondary polls indexes for the duration of the
+load and builds them once at the end, which is much quicker than updating
+them for every row on a big import. The pages that rely on them are slow
+until the import finishes. This is meant for MySQL, SQLite rebuilds the
+whole table to change its indexes.
+
+With the polls sharded (polls/sharding.py) the ids would have to come from
+the shard sequence and the rows be split up by shard, so the command refuses.
+Import with POLLS_SHARDS unset, then set it and run rebalance_shards.
+"""
+
+import csv
+import io
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+
+from polls import schedule, search, sharding
+from polls.export import parse_when
+from polls.models import Question, Choice
+
+
+def read_rows(f, format):
+    if format == 'csv':
+        for row in csv.DictReader(f):
+            yield row
+        return
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+class Command(BaseCommand):
+    help = 'Bulk load questions and choices from CSV or NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to read, - for stdin.')
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help='Default from the file extension.')
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Rows saved per INSERT and transaction.')
+        parser.add_argument('--defer-indexes', action='store_true',
+                            help='Drop the polls indexes during the load.')
+
+    def handle(self, *args, **options):
+        if sharding.enabled():
+            raise CommandError('import_polls does not support POLLS_SHARDS. '
+                               'Import with it unset, then set it and run '
+                               'rebalance_shards.')
+        path = options['path']
+        format = options['format'] or (
+            'ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        if path == '-':
+            f = sys.stdin
+        else:
+            f = io.open(path, encoding='utf-8', newline='')
+        deferred = []
+        if options['defer_indexes']:
+            deferred = self.drop_indexes()
+        try:
+            self.load(read_rows(f, format), options['batch_size'])
+        finally:
+            if f is not sys.stdin:
+                f.close()
+            if deferred:
+                self.restore_indexes(deferred)
+
+    def load(self, rows, batch_size):
+        started = time.time()
+        self.next_question = (Question.objects.aggregate(
+            m=Max('pk'))['m'] or 0) + 1
+        self.next_choice = (Choice.objects.aggregate(
+            m=Max('pk'))['m'] or 0) + 1
+        first_question = self.next_question
+        # The key of the previous row's question and its new id. Remembering
+        # every question of the file would not fit in memory for the
+        # biggest ones.
+        current_key, current_id = None, None
+        questions, choices = [], []
+        saved = 0
+        for n, row in enumerate(rows, 1):
+            key = row.get('question_id') or (row['question_text'],
+                                             row['pub_date'])
+            if key != current_key:
+                try:
+                    pub_date = parse_when(row['pub_date'])
+                except (KeyError, ValueError) as e:
+                    raise CommandError('Row %d: bad pub_date (%s)' % (n, e))
+                current_key, current_id = key, self.next_question
+                questions.append(Question(
+                    pk=self.next_question, question_text=row['question_text'],
+                    pub_date=pub_date))
+                self.next_question += 1
+            if row.get('choice_text'):
+                choices.append(Choice(
+                    pk=self.next_choice, question_id=current_id,
+                    choice_text=row['choice_text'],
+                    votes=int(row.get('votes') or 0)))
+                self.next_choice += 1
+            if len(questions) + len(choices) >= batch_size:
+                saved += self.save_batch(questions, choices)
+                questions, choices = [], []
+                self.stdout.write('%d rows, %.0f rows/s' % (
+                    saved, saved / (time.time() - started)))
+        saved += self.save_batch(questions, choices)
+        # bulk_create skips the signals that keep has_choices up to date,
+        # so set it for everything imported in one go.
+        imported = Question.objects.filter(pk__gte=first_question)
+        imported.filter(
+            pk__in=Choice.objects.filter(
+                question_id__gte=first_question).values('question_id')
+        ).update(has_choices=True)
+        search.rebuild(batch_size, after=first_question - 1)
+        schedule.reschedule()
+        elapsed = time.time() - started
+        self.stdout.write('Imported %d questions and %d choices in %.1fs '
+                          '(%.0f rows/s)' % (
+                              self.next_question - first_question,
+                              Choice.objects.filter(
+                                  question_id__gte=first_question).count(),
+                              elapsed, saved / elapsed if elapsed else 0))
+
+    def save_batch(self, questions, choices):
+        with transaction.atomic():
+            Question.objects.bulk_create(questions)
+            Choice.objects.bulk_create(choices)
+        return len(questions) + len(choices)
+
+    def drop_indexes(self):
+        """Drops the index_together indexes of the polls models and returns
+        what restore_indexes() needs to put them back.
+        """
+        dropped = []
+        with connection.schema_editor() as editor:
+            for model in (Question, Choice):
+                together = set(tuple(f)
+                               for f in model._meta.index_together)
+                if together:
+                    editor.alter_index_together(model, together, set())
+                    dropped.append((model, together))
+        self.stdout.write('Dropped the polls indexes for the load.')
+        return dropped
+
+    def restore_indexes(self, dropped):
+        started = time.time()
+        with connection.schema_editor() as editor:
+            for model, together in dropped:
+                editor.alter_index_together(model, set(), together)
+        self.stdout.write('Rebuilt the polls indexes in %.1fs.' % (
+            time.time() - started))
@@ -0,0 +1,90 @@
+"""Run with `python manage.py loadtest_votes --clients 50 --votes 200`.
+
+Creates a throw away Question with one Choice, has many threads call the real
+polls.views.vote view at the same time and then checks that every single
+vote made it into the database.
+"""
+
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from polls.models import Question, Choice
+from polls import views, votes
+
+
+class Command(BaseCommand):
+    help = 'Hammer one Choice with concurrent votes and check none are lost.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=20,
+                            help='Number of concurrent voting threads.')
+        parser.add_argument('--votes', type=int, default=100,
+                            help='Votes cast by each client.')
+        parser.add_argument('--shards', type=int, default=None,
+                            help='Override POLLS_VOTE_SHARDS for this run.')
+        parser.add_argument('--keep', action='store_true',
+                            help="Don't delete the test question afterwards.")
+
+    def handle(self, *args, **options):
+        clients = options['clients']
+        per_client = options['votes']
+        # Every client votes from the same address, the per voter limits
+        # (polls/throttle.py) would turn most of them away.
+        limits = dict(POLLS_VOTE_RATE=None, POLLS_VOTE_DEDUP=False)
+        if options['shards'] is not None:
+            limits['POLLS_VOTE_SHARDS'] = options['shards']
+        with override_settings(**limits):
+            return self.run(clients, per_client, options['keep'])
+
+    def run(self, clients, per_client, keep):
+        question = Question.objects.create(
+            question_text='loadtest_votes', pub_date=timezone.now())
+        choice = Choice.objects.create(question=question,
+                                       choice_text='hot choice')
+        factory = RequestFactory()
+        errors = []
+        start_gate = threading.Event()
+
+        def client():
+            start_gate.wait()
+            try:
+                for _ in range(per_client):
+                    request = factory.post('/', {'choice': choice.pk})
+                    views.vote(request, question.pk)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                # Each thread gets its own connection, give it back.
+                connection.close()
+
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        for t in threads:
+            t.start()
+        started = time.time()
+        start_gate.set()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - started
+        # With POLLS_VOTE_BUFFER on, the last votes are still in memory.
+        votes.vote_buffer.flush()
+
+        expected = clients * per_client
+        counted = votes.tally([Choice.objects.get(pk=choice.pk)])[0].votes
+        if not keep:
+            question.delete()
+
+        self.stdout.write('%d clients x %d votes in %.2fs (%.0f votes/s)' % (
+            clients, per_client, elapsed, expected / elapsed))
+        self.stdout.write('expected %d, counted %d' % (expected, counted))
+        if errors:
+            raise CommandError('%d clients failed, first error: %r' % (
+                len(errors), errors[0]))
+        if counted != expected:
+            raise CommandError('%d votes were lost' % (expected - counted))
+        self.stdout.write('No votes lost.')
@@ -0,0 +1,33 @@
+"""Run with `python manage.py publish_scheduled`, next to the web workers
+(supervisord, systemd, ...). It keeps the list of visible questions that the
+index page reads up to date and switches it over the moment a scheduled
+question's pub_date comes, see polls/schedule.py. One copy is enough.
+
+`python manage.py publish_scheduled --once` only rebuilds the list, after
+changing questions directly in the database for example.
+"""
+
+from django.core.management.base import BaseCommand
+
+from polls import schedule
+
+
+class Command(BaseCommand):
+    help = 'Publish scheduled questions on time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds between checks.')
+        parser.add_argument('--once', action='store_true', default=False,
+                            help='Rebuild the list once and exit.')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            live = schedule.build()
+            self.stdout.write('%d questions visible, next one due %s' % (
+                len(live['questions']), live['until'] or 'never'))
+            return
+        try:
+            schedule.run(options['interval'])
+        except KeyboardInterrupt:
+            pass
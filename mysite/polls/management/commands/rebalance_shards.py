@@ -0,0 +1,118 @@
+"""Run with `python manage.py rebalance_shards` after changing POLLS_SHARDS.
+
+Moves every question that is not stored on the shard sharding.shard_for()
+gives it (polls/sharding.py) there, together with its choices, their vote
+shard rows and vote history, and its search index rows. Ids are kept. Each
+question is copied in one transaction on its new shard and then deleted in
+one transaction on the old one, so a question is never lost. Stopped half
+way the command can simply be run again, a question that is on its new
+shard already is only deleted from the old one.
+
+The databases looked through are the shards and every --from alias: the
+shard being removed, or 'default' when turning sharding on for a site that
+kept everything there (unless 'default' is one of the shards).
+
+Until a question has been moved its pages are not found, on a big site run
+it in a quiet hour. --dry-run only counts what would move.
+"""
+
+import collections
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from polls import sharding
+from polls.models import (Question, Choice, ChoiceVoteShard, VoteEvent,
+                          VoteRollup, SearchPosting)
+
+
+def _belonging_to(question_id, using):
+    """The rows that move with a question, parents first."""
+    return [
+        Question.objects.using(using).filter(pk=question_id),
+        Choice.objects.using(using).filter(question_id=question_id),
+        ChoiceVoteShard.objects.using(using).filter(
+            choice__question_id=question_id),
+        VoteRollup.objects.using(using).filter(
+            choice__question_id=question_id),
+        VoteEvent.objects.using(using).filter(
+            choice__question_id=question_id),
+        SearchPosting.objects.using(using).filter(question_id=question_id),
+    ]
+
+
+def move(question_id, source, target):
+    """Copies question @param 'question_id' and what belongs to it from the
+    database @param 'source' to @param 'target', then deletes it from
+    source.
+    """
+    with transaction.atomic(using=target):
+        if not Question.objects.using(target).filter(
+                pk=question_id).exists():
+            for queryset in _belonging_to(question_id, source):
+                rows = list(queryset)
+                if queryset.model not in (Question, Choice):
+                    # Only question and choice ids are unique over all the
+                    # shards, the target hands out new ones for the rest.
+                    for row in rows:
+                        row.pk = None
+                # No signals, the caches and the search index don't
+                # depend on where a question is.
+                queryset.model.objects.using(target).bulk_create(
+                    rows, batch_size=500)
+    with transaction.atomic(using=source):
+        # Children first, and without the cascade and the receivers of
+        # delete(), which would run for every choice.
+        for queryset in reversed(_belonging_to(question_id, source)):
+            queryset._raw_delete(source)
+
+
+class Command(BaseCommand):
+    help = 'Move questions to the shard their id belongs on.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', action='append', default=[],
+                            dest='sources', metavar='ALIAS',
+                            help='Also move everything out of this database '
+                                 '(may be repeated).')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Question ids read at a time.')
+        parser.add_argument('--dry-run', action='store_true', default=False,
+                            help='Only count the questions to move.')
+
+    def handle(self, *args, **options):
+        if not sharding.enabled():
+            raise CommandError('POLLS_SHARDS is not set.')
+        sources = sharding.shards() + [
+            alias for alias in options['sources']
+            if alias not in sharding.shards()]
+        unknown = [alias for alias in sources
+                   if alias not in connections.databases]
+        if unknown:
+            raise CommandError('Not in DATABASES: %s' % ', '.join(unknown))
+        moved = collections.Counter()
+        for source in sources:
+            for question_id in self.misplaced(source, options['batch_size']):
+                target = sharding.shard_for(question_id)
+                if not options['dry_run']:
+                    move(question_id, source, target)
+                moved[source, target] += 1
+        for (source, target), count in sorted(moved.items()):
+            self.stdout.write('%s -> %s: %d questions' % (source, target,
+                                                          count))
+        self.stdout.write('%d questions %s' % (
+            sum(moved.values()), 'to move' if options['dry_run'] else 'moved'))
+
+    def misplaced(self, source, batch_size):
+        """Ids of the questions in @param 'source' that belong elsewhere."""
+        last = 0
+        while True:
+            ids = list(Question.objects.using(source).filter(
+                pk__gt=last).order_by('pk').values_list(
+                    'pk', flat=True)[:batch_size])
+            if not ids:
+                return
+            last = ids[-1]
+            for question_id in ids:
+                if sharding.shard_for(question_id) != source:
+                    yield question_id
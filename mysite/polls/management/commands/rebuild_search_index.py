@@ -0,0 +1,22 @@
+"""Run with `python manage.py rebuild_search_index`.
+
+Indexes every question and its choices again, see polls/search.py. Needed
+after rows were added without the model signals, like import_polls does.
+"""
+
+from django.core.management.base import BaseCommand
+
+from polls import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the question search index.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Questions indexed per transaction.')
+
+    def handle(self, *args, **options):
+        done = search.rebuild(options['batch_size'],
+                              progress=self.stderr.write)
+        self.stdout.write('Indexed %d questions' % done)
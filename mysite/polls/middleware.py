@@ -0,0 +1,94 @@
+"""Request timing for the polls site.
+
+PerformanceMiddleware measures, for a sample of the requests
+(POLLS_PERF_SAMPLE_RATE in settings.py), the wall time of the view, the
+number of database queries and the time spent in them, the template
+rendering time and the size of the response. The numbers are
+
+* sent back in a Server-Timing header, so the browser's developer tools show
+  them,
+* logged as one JSON line on the 'polls.perf' logger,
+* added to the per view histograms in polls/perf.py, which staff can read at
+  polls:perf.
+
+It should come first in MIDDLEWARE_CLASSES so the time of the other
+middleware is counted, and so its process_template_response() runs right
+before a TemplateResponse gets rendered. Templates rendered inside a view
+with render() count as view time.
+"""
+
+import json
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from . import perf
+
+logger = logging.getLogger('polls.perf')
+
+
+class PerformanceMiddleware(object):
+
+    def process_request(self, request):
+        rate = getattr(settings, 'POLLS_PERF_SAMPLE_RATE', 0.01)
+        if rate < 1 and random.random() >= rate:
+            return None
+        # The debug cursor is what fills connection.queries with every query
+        # and its time. It is only switched on for the sampled requests, on
+        # every database (replicas, shards).
+        request._perf = {
+            'start': time.time(),
+            'template': 0.0,
+            'connections': dict(
+                (connection.alias, (connection.force_debug_cursor,
+                                    len(connection.queries_log)))
+                for connection in connections.all()),
+        }
+        for connection in connections.all():
+            connection.force_debug_cursor = True
+        return None
+
+    def process_template_response(self, request, response):
+        state = getattr(request, '_perf', None)
+        if state is not None:
+            started = time.time()
+
+            def rendered(response):
+                state['template'] += time.time() - started
+            response.add_post_render_callback(rendered)
+        return response
+
+    def process_response(self, request, response):
+        state = getattr(request, '_perf', None)
+        if state is None:
+            return response
+        total_ms = (time.time() - state['start']) * 1000
+        # Django empties queries_log when a request starts, so this is only
+        # what this request ran (up to the 9000 entries the log holds).
+        queries = []
+        for connection in connections.all():
+            debug_cursor, before = state['connections'][connection.alias]
+            connection.force_debug_cursor = debug_cursor
+            queries.extend(list(connection.queries_log)[before:])
+        db_ms = sum(float(q['time']) for q in queries) * 1000
+        size = 0 if response.streaming else len(response.content)
+        match = getattr(request, 'resolver_match', None)
+        view_name = (match and match.view_name) or 'unresolved'
+        sample = {
+            'total_ms': total_ms,
+            'db_ms': db_ms,
+            'template_ms': state['template'] * 1000,
+            'queries': len(queries),
+            'bytes': size,
+        }
+        perf.record(view_name, sample)
+        response['Server-Timing'] = (
+            'total;dur=%.2f, db;dur=%.2f;desc="%d queries", tpl;dur=%.2f' % (
+                total_ms, db_ms, len(queries), sample['template_ms']))
+        sample.update(view=view_name, path=request.path,
+                      status=response.status_code)
+        logger.info(json.dumps(sample, sort_keys=True))
+        return response
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def fill_has_choices(apps, schema_editor):
+    """Backfill the new column with a single semijoin UPDATE, on the
+    database being migrated (one of the shards, polls/sharding.py).
+    """
+    db = schema_editor.connection.alias
+    Question = apps.get_model('polls', 'Question')
+    Choice = apps.get_model('polls', 'Choice')
+    Question.objects.using(db).filter(
+        pk__in=Choice.objects.values('question_id')
+    ).update(has_choices=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='has_choices',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(fill_has_choices, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='choice',
+            name='question',
+            field=models.ForeignKey(related_name='choice_set', to='polls.Question'),
+        ),
+        migrations.AlterIndexTogether(
+            name='question',
+            index_together=set([('pub_date', 'has_choices')]),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0003_choicevoteshard'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='choice',
+            index_together=set([('question', 'votes')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='question',
+            index_together=set([('pub_date', 'has_choices'), ('has_choices', 'pub_date', 'question_text')]),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+import polls.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0005_archive_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoteEvent',
+            fields=[
+                ('id', polls.models.BigAutoField(primary_key=True, serialize=False)),
+                ('created', models.DateTimeField(db_index=True)),
+                ('count', models.PositiveIntegerField(default=1)),
+                ('choice', models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.DO_NOTHING, to='polls.Choice', db_index=False, db_constraint=False)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VoteRollup',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('period', models.PositiveIntegerField(choices=[(60, 'minute'), (3600, 'hour'), (86400, 'day')])),
+                ('start', models.DateTimeField()),
+                ('votes', models.IntegerField(default=0)),
+                ('choice', models.ForeignKey(related_name='rollups', to='polls.Choice')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='voterollup',
+            unique_together=set([('choice', 'period', 'start')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='voterollup',
+            index_together=set([('period', 'start')]),
+        ),
+    ]
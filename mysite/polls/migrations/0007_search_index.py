@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0006_vote_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchPosting',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('term', models.CharField(max_length=40)),
+                ('weight', models.PositiveIntegerField()),
+                ('question', models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.DO_NOTHING, to='polls.Question', db_constraint=False)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='searchposting',
+            index_together=set([('term', 'weight', 'question')]),
+        ),
+    ]
@@ -2,6 +2,8 @@ import datetime
 
 from django.db import models
 from django.utils import timezone
+
+from . import routers, sharding, versions
 """Each model is being represented by a class which is a subclass of
 models.Model. The variables of these classes are to become database field.
 Each field is an instance of the some class Field which can be CharField,
@@ -9,15 +11,125 @@ EmailField, DateTimeField, and so on. Some can have required parameters.
 """
 
 
+class ShardedQuerySet(models.QuerySet):
+    """Picks the database for the polls tables when they are spread over
+    several (POLLS_SHARDS, see polls/sharding.py). Without sharding it
+    behaves like a plain QuerySet.
+    """
+
+    def for_question(self, question_id):
+        """This queryset on the shard of @param 'question_id'."""
+        if not sharding.enabled():
+            return self
+        return self.using(sharding.shard_for(question_id))
+
+    def create(self, **kwargs):
+        if not sharding.enabled() or self._db is not None:
+            return super(ShardedQuerySet, self).create(**kwargs)
+        # QuerySet.create() saves to self.db, which asks the router without
+        # the new object. save() asks with it, so it goes to its shard.
+        obj = self.model(**kwargs)
+        obj.save(force_insert=True)
+        return obj
+
+    def on_each_shard(self):
+        """One copy of this queryset per shard, to run on all of them and
+        put the results together (sharding.merge() for example).
+        """
+        if not sharding.enabled():
+            return [self]
+        return [self.using(alias) for alias in sharding.shards()]
+
+
+def _allocate_id(instance, kwargs):
+    # The shard is picked by question id, so the id has to be known before
+    # the INSERT. Choices take theirs from the same kind of sequence so they
+    # can be moved along with their question, see polls/sharding.py.
+    if instance.pk is None and sharding.enabled():
+        instance.pk = sharding.allocate_ids(type(instance))
+        kwargs['force_insert'] = True
+
+
+class QuestionQuerySet(ShardedQuerySet):
+    """Shared query layer for the polls views. Every public page only ever
+    shows questions that are already published and that have at least one
+    choice, so that filter lives here once instead of in each view.
+    """
+
+    def published(self, until=None):
+        """Questions whose pub_date has passed and that have choices. With
+        @param 'until' only those published at or before it.
+
+        This is answered from the denormalized has_choices column which is
+        covered by the (pub_date, has_choices) index, so the cost does not
+        grow with the size of the Choice table.
+        """
+        # A single upper bound on pub_date, the database only uses one of
+        # them to decide where to start reading the index.
+        bound = timezone.now()
+        if until is not None and until < bound:
+            bound = until
+        return self.filter(pub_date__lte=bound, has_choices=True)
+
+
 class Question(models.Model):
 
     # These become the attributes of the class.
     question_text = models.CharField(max_length=200)
     pub_date = models.DateTimeField('date published')
+    # Denormalized flag kept in sync by the Choice signals in
+    # polls/signals.py. NOTE 13.
+    has_choices = models.BooleanField(default=False)
+
+    objects = QuestionQuerySet.as_manager()
+
+    class Meta:
+        # (pub_date, has_choices) answers the pub_date__lte filters and is
+        # read backwards for order_by('-pub_date'). The second one holds
+        # everything the index page shows, so the page can be built from the
+        # index alone, and its (pub_date, id) order is what the archive pages
+        # walk through. NOTE 15 and NOTE 16.
+        index_together = [
+            ['pub_date', 'has_choices'],
+            ['has_choices', 'pub_date', 'id', 'question_text'],
+        ]
 
     def __str__(self):
         return self.question_text
 
+    def save(self, *args, **kwargs):
+        _allocate_id(self, kwargs)
+        super(Question, self).save(*args, **kwargs)
+
+    @property
+    def cache_version(self):
+        """Changes whenever the question, its choices or its votes change.
+        The templates put it in their {% cache %} keys, see
+        polls/versions.py. An edit made in a transaction changes it once
+        more after the request, so a fragment rendered from the old rows
+        before the commit is not used.
+
+        Fragments rendered from a read replica are kept apart, a voter
+        pinned to the primary never gets one (polls/routers.py).
+        """
+        version = versions.last_changed(self.pk)
+        if routers.reads_from_replica():
+            return '%r-replica' % version
+        return version
+
+    @property
+    def fragment_timeout(self):
+        """Seconds the templates keep their {% cache %} fragments, shorter
+        for the ones rendered from a replica.
+        """
+        return routers.cache_timeout(600)
+
+    def is_published(self):
+        """The test of QuestionQuerySet.published() for a question that is
+        already loaded (from polls/object_cache.py for example).
+        """
+        return self.has_choices and self.pub_date <= timezone.now()
+
     def was_published_recently(self):
         """ Returns true if the pub_date is within a day"""
         now = timezone.now()
@@ -43,5 +155,149 @@ class Choice(models.Model):
     choice_text = models.CharField(max_length=200)
     votes = models.IntegerField(default=0)
 
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        # Lets the results of a question be listed by number of votes
+        # without sorting all of its choices.
+        index_together = [['question', 'votes']]
+
     def __str__(self):
         return self.choice_text
+
+    def save(self, *args, **kwargs):
+        _allocate_id(self, kwargs)
+        super(Choice, self).save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Remember which question this row was loaded with so the post_save
+        # receiver in polls/signals.py can tell when a choice was moved.
+        instance = super(Choice, cls).from_db(db, field_names, values)
+        instance._loaded_question_id = instance.__dict__.get('question_id')
+        return instance
+
+
+class ChoiceVoteShard(models.Model):
+    """One of several counter rows for a hot Choice. When vote sharding is
+    turned on (POLLS_VOTE_SHARDS in settings.py) each vote increments a random
+    shard instead of the single Choice.votes column so concurrent voters do
+    not all queue up on the same row lock. The total for a choice is
+    Choice.votes plus the sum of its shards, see polls/votes.py.
+    """
+
+    choice = models.ForeignKey(Choice, related_name='vote_shards')
+    shard = models.PositiveSmallIntegerField()
+    votes = models.IntegerField(default=0)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        unique_together = [['choice', 'shard']]
+
+    def __str__(self):
+        return '%s #%d' % (self.choice, self.shard)
+
+
+class BigAutoField(models.AutoField):
+    """An AutoField stored as a 64 bit integer, which Django 1.8 doesn't
+    have. A plain AutoField runs out after about two billion rows in MySQL.
+    """
+
+    def db_type(self, connection):
+        if connection.vendor == 'mysql':
+            return 'bigint AUTO_INCREMENT'
+        if connection.vendor == 'postgresql':
+            return 'bigserial'
+        return super(BigAutoField, self).db_type(connection)
+
+
+class VoteEvent(models.Model):
+    """One row per recorded vote (or per choice of a flushed batch, with its
+    size in count), only ever added to. polls/history.py rolls them up into
+    VoteRollup rows and deletes them once they are old enough.
+
+    Only the created column is indexed, each index is one more thing every
+    vote has to write. There is no foreign key constraint either, so deleting
+    a choice leaves its events alone instead of hunting for them through the
+    whole table, they go when they are pruned.
+    """
+
+    id = BigAutoField(primary_key=True)
+    choice = models.ForeignKey(Choice, related_name='+', db_index=False,
+                               db_constraint=False,
+                               on_delete=models.DO_NOTHING)
+    created = models.DateTimeField(db_index=True)
+    count = models.PositiveIntegerField(default=1)
+
+    objects = ShardedQuerySet.as_manager()
+
+    def __str__(self):
+        return '%s +%d at %s' % (self.choice_id, self.count, self.created)
+
+
+class VoteRollup(models.Model):
+    """Votes of a choice during one minute, hour or day starting at start.
+    The trend API only ever reads these, see polls/history.py.
+    """
+
+    MINUTE = 60
+    HOUR = 3600
+    DAY = 86400
+    PERIOD_CHOICES = [(MINUTE, 'minute'), (HOUR, 'hour'), (DAY, 'day')]
+
+    choice = models.ForeignKey(Choice, related_name='rollups')
+    period = models.PositiveIntegerField(choices=PERIOD_CHOICES)
+    start = models.DateTimeField()
+    votes = models.IntegerField(default=0)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        # Also the index for "the hours of these choices since then".
+        unique_together = [['choice', 'period', 'start']]
+        index_together = [['period', 'start']]
+
+    def __str__(self):
+        return '%s %s %s' % (self.choice, self.get_period_display(),
+                             self.start)
+
+
+class SearchPosting(models.Model):
+    """One word of the search index: term appears in the question's text or
+    in one of its choices, weight says how much (more for the question text).
+    Kept up to date by polls/signals.py, see polls/search.py.
+    """
+
+    term = models.CharField(max_length=40)
+    # Deleting a question deletes its choices first, and their post_delete
+    # receivers index the question again just before it goes. So the rows
+    # are removed by hand after the question (polls/signals.py) instead of
+    # by the cascade.
+    question = models.ForeignKey(Question, related_name='+',
+                                 db_constraint=False,
+                                 on_delete=models.DO_NOTHING)
+    weight = models.PositiveIntegerField()
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        # A word's questions, best first, straight from the index. Looking
+        # up the words of given questions goes through the question index.
+        index_together = [['term', 'weight', 'question']]
+
+    def __str__(self):
+        return '%s: %s' % (self.term, self.question_id)
+
+
+class ShardSequence(models.Model):
+    """Where the next id of a sharded model (named by its model_name) comes
+    from while the polls are sharded, always in 'default'. See
+    sharding.allocate_ids().
+    """
+
+    name = models.CharField(max_length=40, primary_key=True)
+    next_id = models.BigIntegerField()
+
+    def __str__(self):
+        return '%s: %d' % (self.name, self.next_id)
@@ -0,0 +1,294 @@
+"""Read-through cache of questions and their choices, for the views that
+look one question up by primary key (detail, results, vote).
+
+A question and the id and text of its choices hardly ever change, so they
+are kept in two layers:
+
+    local   a small LRU dict in each process, no network round trip at all.
+            Entries are trusted for POLLS_OBJECT_CACHE_LOCAL_TTL seconds.
+    shared  Django's cache (CACHES in settings.py), shared by all processes.
+
+The vote counts are left out, they change all the time and come from
+polls/results_cache.py.
+
+Shared entries are stored under a versioned key,
+polls:object:<part>:<question id>:<version>, where part is the question row
+or the list of its choices. The receivers in polls/signals.py call
+invalidate() whenever a question or one of its choices is saved or deleted
+(the admin included), which bumps the version and so makes the old entry
+unreachable. That is safer than deleting it: a request that read the old
+row just before the edit stores it under the old version, where nobody will
+look. The process that made the edit also drops its local entry. The other
+processes may go on using theirs for at most POLLS_OBJECT_CACHE_LOCAL_TTL
+seconds.
+
+When a hot question's entry is missing (it expired, or was just edited),
+only one request loads it from the database. Threads of a process queue up
+on a lock, and between processes a lock key added to the shared cache makes
+the others wait a moment for the entry instead of all querying at once.
+"""
+
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from .models import Question, Choice
+from . import sharding
+
+KEY = 'polls:object:%s:%s:%s'
+VERSION_KEY = 'polls:object-version:%s'
+LOCK_KEY = 'polls:object-lock:%s:%s'
+# How long the one loading an entry may take before the others give up
+# waiting and query themselves.
+LOCK_TIMEOUT = 2
+
+
+class LocalCache(object):
+    """Per-process LRU of @param 'size' entries that expire after @param
+    'ttl' seconds.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.bytes = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and item[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        # The pickled size is what the entry would take in the shared cache,
+        # close enough to tell how much memory the LRU holds.
+        size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time() + self.ttl, value, size)
+            self.bytes += size
+            while len(self._entries) > self.size:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.bytes = 0
+
+    def _remove(self, key):
+        self.bytes -= self._entries.pop(key)[2]
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hit_ratio': _ratio(self.hits, self.misses),
+                    'entries': len(self._entries), 'bytes': self.bytes}
+
+
+def _ratio(hits, misses):
+    return hits / float(hits + misses) if hits + misses else None
+
+
+local = LocalCache(
+    size=getattr(settings, 'POLLS_OBJECT_CACHE_LOCAL_SIZE', 1000),
+    ttl=getattr(settings, 'POLLS_OBJECT_CACHE_LOCAL_TTL', 5))
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'bytes_written': 0, 'loads': 0,
+          'waits': 0}
+_pending = threading.local()
+# Threads loading the same question line up on the same lock. A fixed set of
+# locks picked by question id, so nothing has to be cleaned up.
+_load_locks = [threading.Lock() for _ in range(64)]
+
+
+def _count(name, n=1):
+    with _stats_lock:
+        _stats[name] += n
+
+
+def stats():
+    """Hit ratio and memory use of both layers in this process. For the
+    shared layer that is what this process wrote to it.
+    """
+    with _stats_lock:
+        shared = dict(_stats)
+    shared['hit_ratio'] = _ratio(shared['hits'], shared['misses'])
+    return {'local': local.stats(), 'shared': shared}
+
+
+def _version(question_id):
+    version = cache.get(VERSION_KEY % question_id)
+    if version is None:
+        # A version the old entries can't have, in case the version key
+        # was evicted but they were not.
+        cache.add(VERSION_KEY % question_id, int(time.time() * 1000), None)
+        version = cache.get(VERSION_KEY % question_id)
+    return version
+
+
+def invalidate(*question_ids):
+    """Makes the cached entries of the given questions unreachable.
+
+    Inside a transaction (the admin saves in one) another request can still
+    read the old rows until the commit and store them under the new
+    version, so the questions are invalidated once more by
+    invalidate_pending() when the request is over. Django 1.8 has no
+    transaction.on_commit().
+    """
+    if connection.in_atomic_block:
+        pending = getattr(_pending, 'ids', None)
+        if pending is None:
+            pending = _pending.ids = set()
+        pending.update(question_ids)
+    _bump(question_ids)
+
+
+def _bump(question_ids):
+    for pk in question_ids:
+        try:
+            cache.incr(VERSION_KEY % pk)
+        except ValueError:
+            cache.set(VERSION_KEY % pk, int(time.time() * 1000), None)
+        for part in LOADERS:
+            local.delete((part, pk))
+
+
+def invalidate_pending(**kwargs):
+    """Receiver of request_finished, see invalidate()."""
+    pending = getattr(_pending, 'ids', None)
+    if pending:
+        _pending.ids = None
+        _bump(pending)
+
+
+def _load_question(question_id):
+    return Question.objects.for_question(question_id).filter(
+        pk=question_id).values_list(
+            'question_text', 'pub_date', 'has_choices').first()
+
+
+def _load_choices(question_id):
+    return list(Choice.objects.for_question(question_id).filter(
+        question_id=question_id).order_by('pk').values_list(
+            'pk', 'choice_text'))
+
+
+# The two parts kept per question, the results page for example only needs
+# the first.
+LOADERS = {'question': _load_question, 'choices': _load_choices}
+
+
+def _load_once(part, question_id, key):
+    with _load_locks[question_id % len(_load_locks)]:
+        # The thread before this one in line may have just stored it.
+        value = cache.get(key)
+        if value is not None:
+            return value
+        lock = LOCK_KEY % (part, question_id)
+        if cache.add(lock, 1, LOCK_TIMEOUT):
+            try:
+                _count('loads')
+                value = LOADERS[part](question_id)
+                if value is not None:
+                    cache.set(key, value, getattr(
+                        settings, 'POLLS_OBJECT_CACHE_TIMEOUT', 3600))
+                    _count('bytes_written', len(
+                        pickle.dumps(value, pickle.HIGHEST_PROTOCOL)))
+            finally:
+                cache.delete(lock)
+            return value
+        # Another process is loading it.
+        _count('waits')
+        deadline = time.time() + LOCK_TIMEOUT
+        while time.time() < deadline:
+            time.sleep(0.01)
+            value = cache.get(key)
+            if value is not None:
+                return value
+            if cache.get(lock) is None:
+                break
+        _count('loads')
+        return LOADERS[part](question_id)
+
+
+def _get(part, question_id):
+    local_key = (part, question_id)
+    value = local.get(local_key)
+    if value is not None:
+        return value
+    key = KEY % (part, question_id, _version(question_id))
+    value = cache.get(key)
+    if value is None:
+        _count('misses')
+        value = _load_once(part, question_id, key)
+        if value is None:
+            # Unknown questions are not cached, a new one would then have
+            # to bump the version before anyone could see it.
+            return None
+    else:
+        _count('hits')
+    local.set(local_key, value)
+    return value
+
+
+def get_question(question_id, with_choices=False):
+    """The Question with pk @param 'question_id', or None. With @param
+    'with_choices' its choices come along as if prefetched, so
+    question.choice_set.all() (in detail.html) costs no query. Their votes
+    are not cached and left as None.
+    """
+    question_id = int(question_id)
+    row = _get('question', question_id)
+    if row is None:
+        return None
+    # As if loaded from its shard, queries through it (choice_set) go there.
+    question = Question.from_db(sharding.shard_for(question_id), None,
+                                (question_id,) + tuple(row))
+    if with_choices:
+        # What prefetch_related() would have stored.
+        choices = question.choice_set.all()
+        choices._result_cache = _choices(question)
+        choices._prefetch_done = True
+        question._prefetched_objects_cache = {'choice_set': choices}
+    return question
+
+
+def _choices(question):
+    return [Choice(id=pk, question_id=question.pk, choice_text=choice_text,
+                   votes=None)
+            for pk, choice_text in _get('choices', question.pk)]
+
+
+def get_choice(question, choice_id):
+    """The choice of @param 'question' with pk @param 'choice_id', like
+    question.choice_set.get(pk=choice_id). Raises Choice.DoesNotExist. Its
+    votes are not cached and left as None, don't save() it.
+    """
+    try:
+        choice_id = int(choice_id)
+    except (TypeError, ValueError):
+        raise Choice.DoesNotExist(choice_id)
+    for choice in _choices(question):
+        if choice.pk == choice_id:
+            return choice
+    raise Choice.DoesNotExist(choice_id)
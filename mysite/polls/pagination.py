@@ -0,0 +1,171 @@
+"""Keyset (cursor) pagination for the poll archive.
+
+OFFSET pagination makes the database walk past every row of the earlier
+pages, so page 10,000 costs 10,000 times as much as page 1. Here each page
+instead remembers the (pub_date, id) of its last question and the next page
+asks for the questions that come right after it, which the
+(has_choices, pub_date, id, ...) index on Question answers with one seek no
+matter how deep the page is.
+
+The position is handed to the browser as an opaque cursor string so the URL
+does not expose (or invite editing of) the raw values.
+
+The admin changelist still pages with OFFSET but its paginator,
+EstimatedCountPaginator, at least skips the COUNT(*) over the whole table
+that Django runs for the page links on every visit.
+"""
+
+import datetime
+
+from django.conf import settings
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.encoding import force_bytes, force_text
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+from . import sharding
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(question):
+    """Cursor pointing just past @param 'question'."""
+    delta = question.pub_date - EPOCH
+    micros = (delta.days * 86400 + delta.seconds) * 10 ** 6 + \
+        delta.microseconds
+    return force_text(urlsafe_base64_encode(
+        force_bytes('%d.%d' % (micros, question.pk))))
+
+
+def decode_cursor(cursor):
+    """Returns the (pub_date, id) a cursor points at, raises InvalidCursor
+    for anything that isn't one of ours.
+    """
+    try:
+        micros, pk = force_text(urlsafe_base64_decode(cursor)).split('.')
+        pub_date = EPOCH + datetime.timedelta(microseconds=int(micros))
+        return pub_date, int(pk)
+    except (TypeError, ValueError, OverflowError, UnicodeDecodeError):
+        raise InvalidCursor(cursor)
+
+
+def keyset_page(queryset, position=None, size=20):
+    """Returns (questions, next_cursor) for the page of @param 'queryset'
+    that starts after @param 'position', a (pub_date, id) pair from
+    decode_cursor(). next_cursor is None on the last page.
+
+    @param 'queryset' should not carry its own upper bound on pub_date, give
+    it the position's pub_date as bound instead (Question.objects.published()
+    takes it as 'until'). With two bounds the database may seek to the
+    wrong one and read through all the earlier pages.
+
+    With the polls sharded each shard gives its part of the page and they
+    are merged, the cursor works the same on all of them.
+    """
+    queryset = queryset.order_by('-pub_date', '-id')
+    if position is not None:
+        pub_date, pk = position
+        # The pub_date__lte part is what lets the database seek straight to
+        # the position in the index, the Q() then skips the rows with the
+        # same pub_date that were already shown.
+        queryset = queryset.filter(pub_date__lte=pub_date).filter(
+            Q(pub_date__lt=pub_date) | Q(id__lt=pk))
+    # One extra row tells us whether there is a next page.
+    questions = sharding.merge(
+        [questions[:size + 1] for questions in queryset.on_each_shard()],
+        key=lambda q: (q.pub_date, q.pk), limit=size + 1)
+    next_cursor = None
+    if len(questions) > size:
+        questions = questions[:size]
+        next_cursor = encode_cursor(questions[-1])
+    return questions, next_cursor
+
+
+def table_rows_estimate(model, using='default'):
+    """The number of rows the database thinks the table of @param 'model'
+    has, from the statistics it keeps for the query planner. None when the
+    database does not keep such a number.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            # Off by up to 40-50% for InnoDB, good enough for page links.
+            cursor.execute(
+                "SELECT table_rows FROM information_schema.tables"
+                " WHERE table_schema = DATABASE() AND table_name = %s",
+                [table])
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                "SELECT reltuples FROM pg_class WHERE relname = %s", [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    # reltuples is -1 for a table that was never analyzed.
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that takes the database's estimate of the number of rows
+    instead of counting them, if the queryset is not filtered and the
+    estimate is at least POLLS_ADMIN_ESTIMATE_COUNT_OVER (None to always
+    count). Filtered querysets are still counted, those are usually narrowed
+    down by an index.
+
+    With an estimate the page links can be a little off. When it is too low
+    the pages after the last link still load (?p= in the admin), a page is
+    only missing when its slice of the queryset comes back empty. When it is
+    too high the last links lead to empty pages.
+    """
+    # Whether count is the database's estimate.
+    estimated = False
+
+    def estimate(self):
+        queryset = self.object_list
+        return table_rows_estimate(queryset.model, queryset.db)
+
+    def _get_count(self):
+        if self._count is None:
+            threshold = getattr(
+                settings, 'POLLS_ADMIN_ESTIMATE_COUNT_OVER', None)
+            if threshold is not None and not self.object_list.query.where:
+                estimate = self.estimate()
+                if estimate is not None and estimate >= threshold:
+                    self._count = estimate
+                    self.estimated = True
+        return super(EstimatedCountPaginator, self)._get_count()
+    count = property(_get_count)
+
+    def validate_number(self, number):
+        # Django turns away page numbers past count, which may be too low.
+        # Reading count first tells whether it is an estimate.
+        if not self.count or not self.estimated:
+            return super(EstimatedCountPaginator, self).validate_number(
+                number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if not self.estimated:
+            return super(EstimatedCountPaginator, self).page(number)
+        # Not cut off at count like Django does, the rows past the estimate
+        # are real.
+        bottom = (number - 1) * self.per_page
+        object_list = list(self.object_list[bottom:bottom + self.per_page])
+        if not object_list and number > 1:
+            raise EmptyPage('That page contains no results')
+        return self._get_page(object_list, number, self)
@@ -0,0 +1,104 @@
+"""In-process histograms filled by polls.middleware.PerformanceMiddleware.
+
+Each worker keeps its own numbers, polls:perf shows the ones of the worker
+that answers the request. They start over when the worker restarts.
+"""
+
+import bisect
+import threading
+
+INF = float('inf')
+
+# Upper bounds of the buckets, the last one catches the rest.
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, INF]
+BUCKETS_QUERIES = [0, 1, 2, 3, 5, 10, 20, 50, 100, INF]
+BUCKETS_BYTES = [1024, 4096, 16384, 65536, 262144, 1048576, INF]
+
+
+class Histogram(object):
+
+    def __init__(self, bounds=BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the @param 'p' percentile,
+        never more than the largest value seen.
+        """
+        if not self.count:
+            return None
+        wanted = self.count * p / 100.0
+        seen = 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= wanted:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'buckets': dict(
+                ('le_%s' % ('inf' if b == INF else b), n)
+                for b, n in zip(self.bounds, self.counts)),
+        }
+
+
+class ViewStats(object):
+    """Everything recorded for one view."""
+
+    METRICS = {
+        'total_ms': BUCKETS_MS,
+        'db_ms': BUCKETS_MS,
+        'template_ms': BUCKETS_MS,
+        'queries': BUCKETS_QUERIES,
+        'bytes': BUCKETS_BYTES,
+    }
+
+    def __init__(self):
+        self.histograms = dict((m, Histogram(bounds))
+                               for m, bounds in self.METRICS.items())
+
+    def add(self, sample):
+        for metric, histogram in self.histograms.items():
+            histogram.add(sample[metric])
+
+    def as_dict(self):
+        return dict((m, h.as_dict()) for m, h in self.histograms.items())
+
+
+_lock = threading.Lock()
+_views = {}
+
+
+def record(view_name, sample):
+    """Adds a dict holding the ViewStats.METRICS of one request."""
+    with _lock:
+        stats = _views.get(view_name)
+        if stats is None:
+            stats = _views[view_name] = ViewStats()
+        stats.add(sample)
+
+
+def snapshot():
+    with _lock:
+        return dict((name, stats.as_dict()) for name, stats in _views.items())
+
+
+def reset():
+    with _lock:
+        _views.clear()
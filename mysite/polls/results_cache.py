@@ -0,0 +1,103 @@
+"""Cache of the vote tallies shown by the results page.
+
+Results get read far more often than anyone votes, so the list of choices and
+their counts for a question is kept in Django's cache framework (CACHES in
+settings.py) instead of being queried and summed up on every hit.
+
+POLLS_RESULTS_STALENESS decides how fresh the numbers have to be. With the
+default of 0 every recorded vote drops the cached tally so the next page view
+rebuilds it. With a value of N seconds votes leave the cache alone and a
+tally can be up to N seconds old, which keeps a poll getting many votes a
+second from rebuilding its results on nearly every view. Editing choices (the
+ChoiceInline in the admin for example) always drops the tally, see
+polls/signals.py.
+"""
+
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from . import routers, sharding, votes
+
+KEY = 'polls:results:%s'
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+_pending = threading.local()
+
+
+def staleness():
+    return getattr(settings, 'POLLS_RESULTS_STALENESS', 0)
+
+
+def timeout():
+    """How long a tally stays in the cache."""
+    return staleness() or getattr(settings, 'POLLS_RESULTS_CACHE_TIMEOUT',
+                                  300)
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def stats():
+    """Hit and miss counts of this process."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def get_results(question):
+    """Return the choices of @param 'question' as a list of dicts with id,
+    choice_text and votes, from the cache when possible.
+    """
+    if routers.pinned_with_replicas():
+        # Somebody who just voted. The cached tally may have been read from
+        # a replica that hasn't seen the vote, see polls/routers.py.
+        return load(question)
+    results = cache.get(KEY % question.pk)
+    if results is not None:
+        _count('hits')
+        return results
+    _count('misses')
+    return load(question)
+
+
+def load(question):
+    """Like get_results() but always counts the votes in the database, and
+    stores them for get_results().
+    """
+    # The vote shard rows are read from the question's database.
+    with sharding.question_shard(question.pk):
+        results = [
+            {'id': c.pk, 'choice_text': c.choice_text, 'votes': c.votes}
+            for c in votes.tally(question.choice_set.all())
+        ]
+    cache.set(KEY % question.pk, results, routers.cache_timeout(timeout()))
+    return results
+
+
+def invalidate(*question_ids):
+    """Drops the cached tallies of the given questions.
+
+    Inside a transaction (the admin's ChoiceInline saves in one) a request
+    can still count the old rows until the commit and store them again, so
+    they are dropped once more by invalidate_pending() when the request is
+    over, like object_cache.invalidate().
+    """
+    if connection.in_atomic_block:
+        pending = getattr(_pending, 'ids', None)
+        if pending is None:
+            pending = _pending.ids = set()
+        pending.update(question_ids)
+    cache.delete_many([KEY % pk for pk in question_ids])
+
+
+def invalidate_pending(**kwargs):
+    """Receiver of request_finished, see invalidate()."""
+    pending = getattr(_pending, 'ids', None)
+    if pending:
+        _pending.ids = None
+        cache.delete_many([KEY % pk for pk in pending])
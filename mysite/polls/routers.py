@@ -0,0 +1,161 @@
+"""Database routing for the polls site.
+
+PrimaryReplicaRouter sends the reads of the polls app to one of the
+databases listed in POLLS_READ_REPLICAS and every write to 'default', the
+primary. Reads of the other apps (auth, sessions, admin log) stay on the
+primary, a login for example has to find the session it just wrote. Replicas
+lag a little behind the primary, so somebody who just voted would not always
+see their own vote on the results page they get redirected to. To avoid that
+ReadYourWritesMiddleware pins a browser to the primary for
+POLLS_REPLICA_PIN_SECONDS after any POST (a vote, an admin save) using a
+cookie, and every read done while handling a POST goes to the primary too.
+
+The caches in front of the database (polls/results_cache.py, the {% cache %}
+fragments) are shared by everybody. So that a page read from a lagging
+replica can't be served to a pinned voter, a pinned request does not take
+the tally from the cache, and renders its fragments under a key of its own
+(Question.cache_version). What is read from a replica is only cached for
+POLLS_REPLICA_PIN_SECONDS, about as long as a replica is allowed to lag.
+
+mysite/settings_replicas.py sets this up with two SQLite files to try it out
+locally.
+
+ShardRouter spreads the polls tables over the databases in POLLS_SHARDS, see
+polls/sharding.py. It goes first in DATABASE_ROUTERS and leaves everything
+it doesn't handle to the router after it.
+"""
+
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from . import sharding
+
+PIN_COOKIE = 'polls_primary_until'
+
+_state = threading.local()
+
+
+def pin_to_primary(pinned=True):
+    """Send this thread's reads to the primary until unpinned."""
+    _state.pinned = pinned
+
+
+def pinned_to_primary():
+    return getattr(_state, 'pinned', False)
+
+
+def read_replicas():
+    """The configured replicas that actually exist in DATABASES."""
+    return [alias for alias in getattr(settings, 'POLLS_READ_REPLICAS', [])
+            if alias in connections.databases]
+
+
+def reads_from_replica():
+    """Whether this thread's reads of the polls tables go to a replica."""
+    return not pinned_to_primary() and bool(read_replicas())
+
+
+def pinned_with_replicas():
+    """Whether this thread is pinned away from replicas that exist, and so
+    must not trust what the others cached.
+    """
+    return pinned_to_primary() and bool(read_replicas())
+
+
+def cache_timeout(timeout):
+    """@param 'timeout' for caching what this thread read, cut down to
+    POLLS_REPLICA_PIN_SECONDS when that came from a replica.
+    """
+    if reads_from_replica():
+        return min(timeout, getattr(settings, 'POLLS_REPLICA_PIN_SECONDS', 5))
+    return timeout
+
+
+class PrimaryReplicaRouter(object):
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != 'polls':
+            return None
+        if pinned_to_primary():
+            return DEFAULT_DB_ALIAS
+        replicas = read_replicas()
+        if not replicas:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold copies of the same rows as the primary.
+        return True
+
+
+class ShardRouter(object):
+    """Sends the sharded polls tables to their shard. Returns None, which
+    asks the next router, for every other table and when POLLS_SHARDS is
+    not set.
+    """
+
+    def _db_for(self, model, **hints):
+        if not sharding.enabled() or not sharding.is_sharded(model):
+            return None
+        instance = hints.get('instance')
+        if instance is not None:
+            # question.choice_set, choice.question and saving an object stay
+            # on the database the object came from.
+            if instance._state.db is not None:
+                return instance._state.db
+            question_id = sharding.question_id_of(instance)
+            if question_id is not None:
+                return sharding.shard_for(question_id)
+        return sharding.current()
+
+    db_for_read = _db_for
+    db_for_write = _db_for
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if sharding.enabled() and sharding.is_sharded(type(obj1)) and \
+                sharding.is_sharded(type(obj2)):
+            # No foreign keys from one shard to another.
+            return obj1._state.db == obj2._state.db
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if not sharding.enabled() or app_label != 'polls':
+            return None
+        if model_name is not None and model_name not in \
+                sharding.SHARDED_MODELS:
+            return db == DEFAULT_DB_ALIAS
+        # The data migrations (no model_name) work on the sharded tables.
+        return db in sharding.shards()
+
+
+class ReadYourWritesMiddleware(object):
+    """Pins requests to the primary, see the module docstring. Goes near the
+    top of MIDDLEWARE_CLASSES so every later middleware's reads are routed
+    the same way.
+    """
+
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+    def process_request(self, request):
+        try:
+            until = float(request.COOKIES.get(PIN_COOKIE, 0))
+        except ValueError:
+            until = 0
+        pin_to_primary(request.method not in self.SAFE_METHODS or
+                       until > time.time())
+
+    def process_response(self, request, response):
+        pin_to_primary(False)
+        if request.method not in self.SAFE_METHODS and \
+                response.status_code < 400:
+            seconds = getattr(settings, 'POLLS_REPLICA_PIN_SECONDS', 5)
+            response.set_cookie(PIN_COOKIE, '%.3f' % (time.time() + seconds),
+                                max_age=seconds, httponly=True)
+        return response
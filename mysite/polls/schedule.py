@@ -0,0 +1,126 @@
+"""Scheduled publishing.
+
+Which questions are visible only changes at a few known moments: when a
+question's pub_date passes, and when a question or its choices are edited.
+Instead of asking the database with pub_date__lte=now on every request, the
+newest visible questions are kept in the cache (CACHES in settings.py) as a
+ready made list together with the pub_date of the next question waiting to
+be published. The list stays good until that moment, the index page is then
+served from it without touching the Question table.
+
+`python manage.py publish_scheduled` runs a worker that rebuilds the list
+right when the next question is due, so no visitor has to. Without it the
+first request after that moment rebuilds the list instead, so the index is
+never wrong, only slower for that one request.
+
+Saving or deleting a question, or a question gaining or losing its last
+choice, calls reschedule() from the receivers in polls/signals.py. A pub_date
+changed in the admin therefore shows up on the next request. The admin saves
+in a transaction, and a request that builds the list before the commit still
+sees the old rows, so an edit made inside one throws the list away again
+when its request is over (reschedule_pending()).
+
+With the polls sharded (polls/sharding.py) each shard gives its newest
+questions and the list is merged from them by pub_date.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+
+from .models import Question
+from . import sharding
+
+KEY = 'polls:schedule'
+
+_pending = threading.local()
+
+
+def size():
+    """How many of the newest visible questions the list holds."""
+    return getattr(settings, 'POLLS_SCHEDULE_LIST_SIZE', 50)
+
+
+def build(now=None):
+    """Reads the newest visible questions and the next pub_date to come and
+    stores them in the cache. Returns what was stored, a dict with
+    'questions', a list of (id, question_text, pub_date), and 'until', the
+    next pub_date or None when nothing is scheduled.
+    """
+    if now is None:
+        now = timezone.now()
+    published = Question.objects.published(until=now).order_by(
+        '-pub_date', '-id')
+    scheduled = Question.objects.filter(
+        pub_date__gt=now, has_choices=True).order_by('pub_date')
+    due = [questions.values_list('pub_date', flat=True).first()
+           for questions in scheduled.on_each_shard()]
+    live = {
+        'questions': sharding.merge(
+            [questions.values_list('id', 'question_text', 'pub_date')[
+                :size()] for questions in published.on_each_shard()],
+            key=lambda row: (row[2], row[0]), limit=size()),
+        'until': min((when for when in due if when is not None),
+                     default=None),
+    }
+    # The timeout is only a safety net for a missed reschedule().
+    cache.set(KEY, live, getattr(settings, 'POLLS_SCHEDULE_TIMEOUT', 3600))
+    return live
+
+
+def current(now=None):
+    """The stored list, rebuilt when it is missing or its 'until' passed."""
+    if now is None:
+        now = timezone.now()
+    live = cache.get(KEY)
+    if live is None or (live['until'] is not None and live['until'] <= now):
+        live = build(now)
+    return live
+
+
+def latest(count):
+    """The @param 'count' newest visible questions, newest first. They are
+    Question objects made from the list, not loaded from the database, so
+    only their id, question_text and pub_date are filled in.
+    """
+    return [Question(id=pk, question_text=text, pub_date=pub_date,
+                     has_choices=True)
+            for pk, text, pub_date in current()['questions'][:count]]
+
+
+def reschedule():
+    """Throws the list away, the next request or the worker builds it
+    again. Call after changing questions without sending signals
+    (queryset.update(), bulk_create()).
+
+    Inside a transaction it is thrown away once more by
+    reschedule_pending(), like object_cache.invalidate().
+    """
+    if connection.in_atomic_block:
+        _pending.due = True
+    cache.delete(KEY)
+
+
+def reschedule_pending(**kwargs):
+    """Receiver of request_finished, see reschedule()."""
+    if getattr(_pending, 'due', False):
+        _pending.due = False
+        cache.delete(KEY)
+
+
+def run(interval=1.0, stop=None):
+    """Worker loop of publish_scheduled. Every @param 'interval' seconds it
+    checks whether the list is missing or due and rebuilds it. One cache read
+    a tick, the database is only asked when something changed. Runs until
+    @param 'stop' (a threading.Event) is set.
+    """
+    while stop is None or not stop.is_set():
+        current()
+        if stop is None:
+            time.sleep(interval)
+        else:
+            stop.wait(interval)
@@ -0,0 +1,247 @@
+"""Searching the questions and their choices.
+
+A LIKE '%word%' filter (what the admin's search_fields does) has to read
+every row of the table. Instead the words of each question and of its
+choices are kept in SearchPosting, one row per (word, question), so a search
+only reads the rows of the words it asks for, through the (term, question)
+index. That works on any database. MySQL's FULLTEXT indexes can't cover the
+question and choice texts together since they are in two tables.
+
+The index is updated by the signals in polls/signals.py whenever a question
+or a choice is saved or deleted. Rows added with bulk_create skip the
+signals, import_polls indexes what it loaded itself, after anything else
+(the benchmark seeding for one) `python manage.py rebuild_search_index`
+indexes everything again.
+
+A question matches when all the words of the search are in it. Results are
+ranked by the sum over the words of weight * idf, weight counting the
+occurrences (a word in the question text counts QUESTION_WEIGHT times, in a
+choice once) and idf being higher for rare words. See search() for how the
+work per search is kept bounded.
+
+With the polls sharded (polls/sharding.py) a question's rows are on its
+shard. A search asks each shard for its best matches and ranks them
+together.
+"""
+
+import collections
+import math
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router, transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .models import Question, Choice, SearchPosting
+from . import sharding
+
+QUESTION_WEIGHT = 3
+FREQUENCY_KEY = 'polls:search:df:%s'
+MAX_TERMS = 8
+MAX_TERM_LENGTH = SearchPosting._meta.get_field('term').max_length
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+STOPWORDS = frozenset("""
+    a an and are as at be but by do does for from has have how i if in is it
+    its of on or so than that the their there this to was what when where
+    which who why will with you your
+""".split())
+
+
+def terms(text):
+    """The words of @param 'text' that go into the index, lower case."""
+    return [word[:MAX_TERM_LENGTH] for word in WORD_RE.findall(text.lower())
+            if word not in STOPWORDS]
+
+
+def weights(question_text, choice_texts):
+    counts = collections.Counter()
+    for term in terms(question_text):
+        counts[term] += QUESTION_WEIGHT
+    for text in choice_texts:
+        for term in terms(text):
+            counts[term] += 1
+    return counts
+
+
+def index_question(question_id):
+    """Replaces the index rows of one question, or removes them when it is
+    gone.
+    """
+    with sharding.question_shard(question_id), transaction.atomic(
+            using=router.db_for_write(SearchPosting)):
+        SearchPosting.objects.filter(question_id=question_id).delete()
+        text = Question.objects.filter(pk=question_id).values_list(
+            'question_text', flat=True).first()
+        if text is None:
+            return
+        choice_texts = Choice.objects.filter(
+            question_id=question_id).values_list('choice_text', flat=True)
+        SearchPosting.objects.bulk_create(
+            SearchPosting(term=term, question_id=question_id, weight=weight)
+            for term, weight in weights(text, choice_texts).items())
+
+
+def rebuild(batch_size=1000, progress=None, after=0):
+    """Indexes every question with an id above @param 'after' again,
+    @param 'batch_size' questions per transaction, one shard after the
+    other. Returns the number of questions.
+    """
+    done = 0
+    for alias in sharding.shards():
+        with sharding.use_shard(alias):
+            done = _rebuild(batch_size, progress, after, done)
+    return done
+
+
+def _rebuild(batch_size, progress, after, done):
+    SearchPosting.objects.filter(question_id__gt=after).delete()
+    last = after
+    while True:
+        questions = list(Question.objects.filter(pk__gt=last).order_by(
+            'pk').values_list('pk', 'question_text')[:batch_size])
+        if not questions:
+            return done
+        choice_texts = collections.defaultdict(list)
+        for question_id, text in Choice.objects.filter(
+                question_id__in=[pk for pk, _ in questions]
+        ).values_list('question_id', 'choice_text'):
+            choice_texts[question_id].append(text)
+        with transaction.atomic(using=router.db_for_write(SearchPosting)):
+            SearchPosting.objects.bulk_create(
+                (SearchPosting(term=term, question_id=pk, weight=weight)
+                 for pk, text in questions
+                 for term, weight in weights(
+                     text, choice_texts[pk]).items()),
+                batch_size=500)
+        last = questions[-1][0]
+        done += len(questions)
+        if progress is not None:
+            progress('indexed %d questions' % done)
+
+
+def query_terms(query):
+    """The distinct index words of a search, at most MAX_TERMS of them."""
+    seen = []
+    for term in terms(query):
+        if term not in seen:
+            seen.append(term)
+    return seen[:MAX_TERMS]
+
+
+def matching(queryset, query):
+    """@param 'queryset' narrowed down to questions holding every word of
+    @param 'query', unranked. Used by the admin search.
+    """
+    for term in query_terms(query):
+        queryset = queryset.filter(pk__in=SearchPosting.objects.filter(
+            term=term).values('question_id'))
+    return queryset
+
+
+def term_frequencies(words):
+    """How many questions each of @param 'words' is in, words in none left
+    out. Counting a common word reads a long stretch of the index and the
+    numbers hardly move, so they are cached for an hour (only the ones above
+    0, a new word should be found straight away).
+    """
+    keys = dict((FREQUENCY_KEY % term, term) for term in words)
+    cached = cache.get_many(list(keys))
+    frequencies = dict((keys[key], n) for key, n in cached.items())
+    missing = [term for term in words if term not in frequencies]
+    if missing:
+        counted = collections.Counter()
+        for postings in SearchPosting.objects.filter(
+                term__in=missing).on_each_shard():
+            counted.update(dict(postings.values_list('term').annotate(
+                Count('id'))))
+        cache.set_many(dict((FREQUENCY_KEY % term, n)
+                            for term, n in counted.items()), 3600)
+        frequencies.update(counted)
+    return frequencies
+
+
+def _chunks(ids, size=500):
+    # SQLite takes at most 999 parameters per query.
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def search(query, page=1, size=20):
+    """Published questions matching @param 'query', best first. Returns the
+    questions of @param 'page' and whether there is a next page.
+
+    The work is bounded however common the words are: the candidates are the
+    POLLS_SEARCH_MAX_CANDIDATES questions where the rarest word of the search
+    weighs most (read in order from the (term, weight, question) index), and
+    only those are checked for the other words and ranked. For a search made
+    only of very common words that means a great match can be missed, which
+    beats reading half the index.
+    """
+    words = query_terms(query)
+    if not words:
+        return [], False
+    frequencies = term_frequencies(words)
+    if len(frequencies) < len(words):
+        # A word nobody used, nothing can have all of them.
+        return [], False
+    # The highest id is a cheap stand-in for the number of questions.
+    total = max(questions.aggregate(Max('pk'))['pk__max'] or 0
+                for questions in Question.objects.on_each_shard()) or 1
+    idf = dict((term, math.log(1 + float(total) / n))
+               for term, n in frequencies.items())
+    scores = {}
+    for alias in sharding.shards():
+        with sharding.use_shard(alias):
+            scores.update(_published_scores(words, frequencies, idf))
+    ranked = sorted(scores, key=lambda pk: (scores[pk], pk), reverse=True)
+    offset = (page - 1) * size
+    ids = ranked[offset:offset + size]
+    questions = {}
+    for chunk in sharding.by_shard(ids).values():
+        questions.update(Question.objects.for_question(chunk[0]).in_bulk(
+            chunk))
+    # Left out if deleted since it was scored.
+    return ([questions[pk] for pk in ids if pk in questions],
+            len(ranked) > offset + size)
+
+
+def _published_scores(words, frequencies, idf):
+    """The score of each published question holding all @param 'words',
+    among the candidates of one shard (they are bounded per shard).
+    """
+    rarest = min(words, key=frequencies.get)
+    limit = getattr(settings, 'POLLS_SEARCH_MAX_CANDIDATES', 2000)
+    scores = dict(
+        (question_id, weight * idf[rarest])
+        for question_id, weight in SearchPosting.objects.filter(
+            term=rarest).order_by('-weight', '-question').values_list(
+                'question_id', 'weight')[:limit])
+    others = [term for term in words if term != rarest]
+    if others:
+        # All the words of each candidate, through the question index. With
+        # the terms in the WHERE too the database may pick the term index
+        # and read every posting of a common word instead.
+        matched = collections.Counter()
+        for chunk in _chunks(scores):
+            for question_id, term, weight in SearchPosting.objects.filter(
+                    question_id__in=chunk).values_list(
+                        'question_id', 'term', 'weight'):
+                if term in others:
+                    matched[question_id] += 1
+                    scores[question_id] += weight * idf[term]
+        scores = dict((pk, score) for pk, score in scores.items()
+                      if matched[pk] == len(others))
+    # Checked here rather than with published(), given a pub_date bound the
+    # database likes to walk the pub_date index instead of fetching the few
+    # ids by primary key.
+    now = timezone.now()
+    published = set()
+    for chunk in _chunks(scores):
+        published.update(
+            pk for pk, pub_date, has_choices in Question.objects.filter(
+                pk__in=chunk).values_list('pk', 'pub_date', 'has_choices')
+            if has_choices and pub_date <= now)
+    return dict((pk, scores[pk]) for pk in published)
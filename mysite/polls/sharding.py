@@ -0,0 +1,178 @@
+"""Optional sharding of the polls tables over several databases.
+
+With one database every vote of the site is written to the same machine.
+Setting POLLS_SHARDS in settings.py to a list of aliases from DATABASES
+spreads the polls over them by question id:
+
+    shard_for(question_id) == POLLS_SHARDS[question_id % len(POLLS_SHARDS)]
+
+A question, its choices and everything about their votes (ChoiceVoteShard,
+VoteEvent, VoteRollup, SearchPosting) are stored on the same shard. A page
+about one question, or a vote on it, then only ever talks to that one
+database and the joins between those tables keep working. The few places
+that list questions from all of them (the index, the archive, the API list,
+search) ask every shard and merge the answers, see merge().
+
+How a query finds its shard
+    ShardRouter in polls/routers.py. A saved object goes back to the database
+    it was loaded from and a new one to the shard of its question. Any other
+    query on a sharded table goes to the shard the thread is pinned to with
+    use_shard() or question_shard(), or is sent somewhere explicitly with
+    for_question() and on_each_shard() (ShardedQuerySet in polls/models.py).
+    Queries that do neither fall through to the next router, so 'default'.
+
+Ids
+    Every database would hand out the same auto increment ids, so while
+    sharding is on the ids of new questions and choices come from a
+    ShardSequence row in 'default' instead (allocate_ids()). They stay unique
+    over all the shards, which is what lets rebalance_shards move a question
+    without renumbering it or its choices. The other sharded tables keep
+    their own ids, nothing points at them.
+
+Changing POLLS_SHARDS
+    Adding or removing a shard changes where most questions belong.
+    `python manage.py rebalance_shards` moves them, until it has run those
+    questions are not found. See the command.
+
+mysite/settings_shards.py sets this up with three SQLite files to try it
+out locally. Sharding and POLLS_READ_REPLICAS don't mix, the replica router
+is never asked about the sharded tables.
+"""
+
+import itertools
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import F, Max
+
+# Model names of the tables that are spread over the shards. Everything else
+# of the polls app (ShardSequence) stays in 'default'.
+SHARDED_MODELS = frozenset(['question', 'choice', 'choicevoteshard',
+                            'voteevent', 'voterollup', 'searchposting'])
+
+_state = threading.local()
+
+
+def enabled():
+    return bool(getattr(settings, 'POLLS_SHARDS', None))
+
+
+def shards():
+    """The aliases the polls tables are spread over, in order. Just
+    'default' when sharding is off.
+    """
+    return list(getattr(settings, 'POLLS_SHARDS', None) or
+                [DEFAULT_DB_ALIAS])
+
+
+def shard_for(question_id):
+    """The alias of the shard holding the question with id @param
+    'question_id'.
+    """
+    aliases = shards()
+    return aliases[int(question_id) % len(aliases)]
+
+
+def by_shard(question_ids):
+    """@param 'question_ids' grouped by shard, as a dict of alias to a list
+    of ids.
+    """
+    grouped = {}
+    for question_id in question_ids:
+        grouped.setdefault(shard_for(question_id), []).append(question_id)
+    return grouped
+
+
+def is_sharded(model):
+    return (model._meta.app_label == 'polls' and
+            model._meta.model_name in SHARDED_MODELS)
+
+
+def question_id_of(instance):
+    """The id of the question @param 'instance', a row of a sharded table,
+    belongs to. None when that can't be told without a query (the vote
+    tables only know their choice), those go by the pinned shard.
+    """
+    if instance._meta.model_name == 'question':
+        return instance.pk
+    return getattr(instance, 'question_id', None)
+
+
+def current():
+    """The alias this thread is pinned to, or None."""
+    return getattr(_state, 'alias', None)
+
+
+@contextmanager
+def use_shard(alias):
+    """Sends this thread's queries on the sharded tables that don't say
+    otherwise to @param 'alias' until the block ends. None unpins.
+    """
+    previous = current()
+    _state.alias = alias
+    try:
+        yield alias
+    finally:
+        _state.alias = previous
+
+
+def question_shard(question_id):
+    """use_shard() with the shard of @param 'question_id'."""
+    return use_shard(shard_for(question_id))
+
+
+def merge(results, key, limit=None):
+    """One list, largest @param 'key' first, from the per shard @param
+    'results' that are each sorted that way already. Only the first @param
+    'limit' are kept. Python's sort finds the sorted runs, so this is a
+    merge and not a full sort.
+
+    A single list is handed back as it is, so without sharding the order is
+    exactly the database's.
+    """
+    results = [list(result) for result in results]
+    if len(results) == 1:
+        merged = results[0]
+    else:
+        merged = sorted(itertools.chain.from_iterable(results), key=key,
+                        reverse=True)
+    return merged if limit is None else merged[:limit]
+
+
+def max_id(model, aliases=None):
+    """The highest id of @param 'model' over all the shards, or 0."""
+    return max([model._base_manager.using(alias).aggregate(
+        Max('pk'))['pk__max'] or 0 for alias in aliases or shards()])
+
+
+def allocate_ids(model, count=1):
+    """Reserves @param 'count' ids for new rows of @param 'model' (Question
+    or Choice) that no shard has used. Returns the first one, the others
+    follow it.
+    """
+    from .models import ShardSequence
+    name = model._meta.model_name
+    sequences = ShardSequence.objects.using(DEFAULT_DB_ALIAS)
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        # The UPDATE locks the row, other processes wait here until this
+        # transaction is over and then read their own block.
+        if not sequences.filter(name=name).update(
+                next_id=F('next_id') + count):
+            _start_sequence(model, name)
+            sequences.filter(name=name).update(next_id=F('next_id') + count)
+        return sequences.get(name=name).next_id - count
+
+
+def _start_sequence(model, name):
+    from .models import ShardSequence
+    try:
+        # Savepoint, so losing the race below doesn't end the transaction.
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            # Carries on after the rows from before sharding was turned on.
+            ShardSequence.objects.using(DEFAULT_DB_ALIAS).create(
+                name=name, next_id=max_id(model) + 1)
+    except IntegrityError:
+        # Another process started it first.
+        pass
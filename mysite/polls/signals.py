@@ -0,0 +1,136 @@
+"""Signal receivers for the polls app. These keep the denormalized data on
+Question, the cached questions and results, the change times used by the
+JSON API, the search index and the list of visible questions in sync with
+the Question and Choice rows. They get connected in PollsConfig.ready()
+(polls/apps.py).
+"""
+
+import threading
+
+from django.core.signals import request_finished
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import Question, Choice
+from .votes import votes_recorded
+from . import (history, live, object_cache, results_cache, schedule, search,
+               versions)
+
+# Ids of the questions being deleted by this thread, see question_deleting().
+_deleting = threading.local()
+
+
+def deleting():
+    ids = getattr(_deleting, 'ids', None)
+    if ids is None:
+        ids = _deleting.ids = set()
+    return ids
+
+
+@receiver(post_save, sender=Choice)
+def choice_saved(sender, instance, **kwargs):
+    # Only write when the flag actually flips so that saving a Choice does
+    # not also rewrite the Question row.
+    if Question.objects.for_question(instance.question_id).filter(
+            pk=instance.question_id, has_choices=False
+    ).update(has_choices=True):
+        # Its first choice makes a question visible.
+        schedule.reschedule()
+    # A Choice can be moved to another Question through the admin, in which
+    # case the question it was loaded with may have lost its last choice.
+    question_ids = set([instance.question_id])
+    old_id = getattr(instance, '_loaded_question_id', None)
+    if old_id is not None and old_id != instance.question_id:
+        refresh_has_choices(old_id)
+        question_ids.add(old_id)
+    instance._loaded_question_id = instance.question_id
+    # Covers choices added or renamed through the admin ChoiceInline.
+    object_cache.invalidate(*question_ids)
+    results_cache.invalidate(*question_ids)
+    versions.touch(*question_ids)
+    for question_id in question_ids:
+        search.index_question(question_id)
+
+
+@receiver(post_delete, sender=Choice)
+def choice_deleted(sender, instance, **kwargs):
+    if instance.question_id in deleting():
+        return
+    choices_changed(instance.question_id)
+
+
+@receiver(pre_delete, sender=Question)
+def question_deleting(sender, instance, **kwargs):
+    # Deleting a question deletes its choices first. Each of them would redo
+    # the whole question in choice_deleted(), the question's own receivers
+    # below do it once instead.
+    deleting().add(instance.pk)
+
+
+@receiver(post_delete, sender=Question)
+def question_deleted(sender, instance, **kwargs):
+    deleting().discard(instance.pk)
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def question_changed(sender, instance, **kwargs):
+    versions.touch(instance.pk)
+    object_cache.invalidate(instance.pk)
+    # A new pub_date (in the admin for example) or question_text has to show
+    # up on the index straight away. polls/schedule.py.
+    schedule.reschedule()
+
+
+# Edits made in a transaction are invalidated again after it, see
+# object_cache.invalidate(), results_cache.invalidate(),
+# schedule.reschedule() and versions.touch().
+request_finished.connect(object_cache.invalidate_pending)
+request_finished.connect(results_cache.invalidate_pending)
+request_finished.connect(schedule.reschedule_pending)
+request_finished.connect(versions.touch_pending)
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def question_indexed(sender, instance, **kwargs):
+    # After a delete this removes the index rows.
+    search.index_question(instance.pk)
+
+
+@receiver(votes_recorded)
+def vote_recorded(sender, increments, question_ids, **kwargs):
+    if question_ids is None:
+        # A buffer flush only knows the choices. It sends one signal per
+        # shard, pinned to it, so this and history.record() below go there.
+        question_ids = set(Choice.objects.filter(
+            pk__in=list(increments)).values_list('question_id', flat=True))
+    versions.touch(*question_ids)
+    live.feed.notify(question_ids)
+    # Within the staleness window votes are allowed to not show up yet.
+    if not results_cache.staleness():
+        results_cache.invalidate(*question_ids)
+    if history.enabled():
+        history.record(increments)
+
+
+def refresh_has_choices(question_id):
+    """Recompute has_choices for one Question from its Choice rows."""
+    exists = Choice.objects.for_question(question_id).filter(
+        question_id=question_id).exists()
+    question = Question.objects.for_question(question_id).filter(
+        pk=question_id)
+    if question.exclude(has_choices=exists).update(has_choices=exists):
+        schedule.reschedule()
+
+
+def choices_changed(question_id):
+    """Does what the Choice signals do, once, for choices of @param
+    'question_id' that were written without sending them (queryset.update(),
+    bulk_create()). polls/admin.py saves the ChoiceInline that way.
+    """
+    refresh_has_choices(question_id)
+    object_cache.invalidate(question_id)
+    results_cache.invalidate(question_id)
+    versions.touch(question_id)
+    search.index_question(question_id)
@@ -1,10 +1,38 @@
+import asyncio
 import datetime
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
 
+from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.utils import timezone
-from django.test import TestCase
+from django.utils.six import StringIO
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.management import call_command
+from django.core.paginator import EmptyPage
+from django.core.signals import request_finished
+from django.db import connection, connections, transaction
+from django.test import Client, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
 
-from .models import Question, Choice
+from mysite.asgi_handler import ASGIHandler
+from mysite.db import pool
+
+from .management.commands import build_templates
+from .models import (Question, Choice, SearchPosting, ShardSequence,
+                     VoteEvent, VoteRollup)
+from . import (export, history, live, object_cache, pagination, perf,
+               results_cache, routers, schedule, search, sharding, throttle,
+               versions, votes)
 
 # I run in the terminal `python manage.py test polls`, it look for a subclass
 # of the django.test.TestCase class, creates a special testing database.
@@ -48,7 +76,35 @@ def create_choice_for_question(question, choice_text):
     return Choice.objects.create(question=question, choice_text=choice_text)
 
 
-class QuestionIndexViewsTest(TestCase):
+@override_settings(POLLS_PERF_SAMPLE_RATE=0, POLLS_VOTE_RATE=None,
+                   POLLS_VOTE_DEDUP=False)
+class PollsTestCase(TestCase):
+    """The cached results outlive the test database rollback, and the ids of
+    rolled back rows get handed out again, so every test starts with an
+    empty cache. Request timing and the vote limits are off unless a test
+    turns them on.
+    """
+
+    def setUp(self):
+        cache.clear()
+        object_cache.local.clear()
+        throttle.seen_votes.clear()
+        throttle.rate_limiter.clear()
+
+    def assertMaxQueries(self, num, func, *args, **kwargs):
+        """Like assertNumQueries() but allows fewer queries than @param
+        'num'. Returns what @param 'func' returned.
+        """
+        with CaptureQueriesContext(connection) as captured:
+            result = func(*args, **kwargs)
+        self.assertLessEqual(
+            len(captured), num, "%d queries executed, at most %d allowed:\n%s"
+            % (len(captured), num,
+               "\n".join(q['sql'] for q in captured.captured_queries)))
+        return result
+
+
+class QuestionIndexViewsTest(PollsTestCase):
     # NOTE 10  #######
 
     def test_index_view_with_no_question(self):
@@ -116,7 +172,7 @@ class QuestionIndexViewsTest(TestCase):
                                  )
 
 
-class QuestionDetailViewTest(TestCase):
+class QuestionDetailViewTest(PollsTestCase):
 
     def test_detail_view_with_a_future_question(self):
         """The Detail view that points to a question published in the future
@@ -153,7 +209,7 @@ class QuestionDetailViewTest(TestCase):
         self.assertContains(response, c.choice_text)
 
 
-class QuestionResultsViewTest(TestCase):
+class QuestionResultsViewTest(PollsTestCase):
 
     def test_results_view_with_a_future_question(self):
         """The results view that points to a question published in the future
@@ -205,3 +261,1825 @@ class QuestionResultsViewTest(TestCase):
                             status_code=200)
         self.assertContains(response, c1.choice_text)
         self.assertContains(response, c2.choice_text)
+
+
+class QuestionHasChoicesTest(PollsTestCase):
+
+    def test_has_choices_set_when_choice_created(self):
+        q = create_question(question_text="Past", days=-1)
+        self.assertEqual(Question.objects.get(pk=q.pk).has_choices, False)
+        create_choice_for_question(question=q, choice_text="Choice P1")
+        self.assertEqual(Question.objects.get(pk=q.pk).has_choices, True)
+
+    def test_has_choices_cleared_when_last_choice_deleted(self):
+        q = create_question(question_text="Past", days=-1)
+        c1 = create_choice_for_question(question=q, choice_text="Choice P1")
+        c2 = create_choice_for_question(question=q, choice_text="Choice P2")
+        c1.delete()
+        self.assertEqual(Question.objects.get(pk=q.pk).has_choices, True)
+        c2.delete()
+        self.assertEqual(Question.objects.get(pk=q.pk).has_choices, False)
+        response = self.client.get(reverse('polls:detail',
+                                           kwargs={'pk': q.id, }))
+        self.assertEqual(response.status_code, 404)
+
+    def test_has_choices_follows_moved_choice(self):
+        q1 = create_question(question_text="Past 1", days=-1)
+        q2 = create_question(question_text="Past 2", days=-1)
+        create_choice_for_question(question=q1, choice_text="Choice P1")
+        c = Choice.objects.get(question=q1)
+        c.question = q2
+        c.save()
+        self.assertEqual(Question.objects.get(pk=q1.pk).has_choices, False)
+        self.assertEqual(Question.objects.get(pk=q2.pk).has_choices, True)
+
+    def test_index_view_runs_fixed_number_of_queries(self):
+        """The index page must not load Choice rows to decide what to show."""
+        for i in range(20):
+            q = create_question(question_text="Past %d" % i, days=-1)
+            create_choice_for_question(question=q, choice_text="Choice")
+        schedule.reschedule_pending()
+        # Building the list of visible questions, then served from the cache.
+        with self.assertNumQueries(2):
+            self.client.get(reverse('polls:index'))
+        with self.assertNumQueries(0):
+            self.client.get(reverse('polls:index'))
+
+
+class VoteRecordingTest(PollsTestCase):
+
+    def test_vote_from_stale_choice_is_not_lost(self):
+        """Two requests holding the same stale Choice must both count."""
+        q = create_question(question_text="Past", days=-1)
+        c = create_choice_for_question(question=q, choice_text="Choice P1")
+        first = Choice.objects.get(pk=c.pk)
+        second = Choice.objects.get(pk=c.pk)
+        votes.record_vote(first)
+        votes.record_vote(second)
+        self.assertEqual(Choice.objects.get(pk=c.pk).votes, 2)
+
+    def test_vote_view_counts_vote(self):
+        q = create_question(question_text="Past", days=-1)
+        c = create_choice_for_question(question=q, choice_text="Choice P1")
+        response = self.client.post(reverse('polls:vote', args=(q.id,)),
+                                    {'choice': c.id})
+        self.assertRedirects(response, reverse('polls:results',
+                                               args=(q.id,)))
+        self.assertEqual(Choice.objects.get(pk=c.pk).votes, 1)
+
+    @override_settings(POLLS_VOTE_SHARDS=4)
+    def test_sharded_votes_are_summed_on_results(self):
+        q = create_question(question_text="Past", days=-1)
+        c = create_choice_for_question(question=q, choice_text="Choice P1")
+        for _ in range(25):
+            votes.record_vote(c)
+        self.assertEqual(Choice.objects.get(pk=c.pk).votes, 0)
+        self.assertEqual(votes.tally([c])[0].votes, 25)
+        response = self.client.get(reverse('polls:results', args=(q.id,)))
+        self.assertContains(response, "25 votes")
+
+
+class VoteBufferTest(PollsTestCase):
+
+    def test_buffered_votes_written_in_one_flush(self):
+        q = create_question(question_text="Past", days=-1)
+        c1 = create_choice_for_question(question=q, choice_text="Choice P1")
+        c2 = create_choice_for_question(question=q, choice_text="Choice P2")
+        buf = votes.VoteBuffer()
+        for _ in range(3):
+            buf.add(c1.pk)
+        buf.add(c2.pk)
+        self.assertEqual(buf.pending(), {c1.pk: 3, c2.pk: 1})
+        self.assertEqual(Choice.objects.get(pk=c1.pk).votes, 0)
+        # One UPDATE for all the votes, looking up the questions whose cached
+        # results have to go and one INSERT for the vote history.
+        with self.assertNumQueries(3):
+            self.assertEqual(buf.flush(), 4)
+        self.assertEqual(buf.pending(), {})
+        self.assertEqual(Choice.objects.get(pk=c1.pk).votes, 3)
+        self.assertEqual(Choice.objects.get(pk=c2.pk).votes, 1)
+
+    def test_stop_flushes_pending_votes(self):
+        q = create_question(question_text="Past", days=-1)
+        c = create_choice_for_question(question=q, choice_text="Choice P1")
+        buf = votes.VoteBuffer()
+        buf.add(c.pk, 5)
+        buf.stop()
+        self.assertEqual(Choice.objects.get(pk=c.pk).votes, 5)
+
+    def test_signal_stop_does_not_deadlock_inside_add(self):
+        flushed = []
+
+        class Buffer(votes.VoteBuffer):
+            def flush(self):
+                with self._lock:
+                    pending, self._pending = self._pending, {}
+                if pending:
+                    flushed.append((pending, threading.current_thread()))
+
+        buf = Buffer(interval=0.01)
+        buf.add(1, 5)
+        # SIGTERM arriving while add() holds the lock on this thread.
+        with buf._lock:
+            buf.stop_from_signal()
+        buf._thread.join(1)
+        self.assertEqual(len(flushed), 1)
+        self.assertEqual(flushed[0][0], {1: 5})
+        self.assertIsNot(flushed[0][1], threading.current_thread())
+
+
+class ResultsCacheTest(PollsTestCase):
+
+    def results(self, q):
+        return self.client.get(reverse('polls:results', args=(q.id,)))
+
+    def test_second_view_is_served_from_cache(self):
+        q = create_question(question_text="Past", days=-1)
+        create_choice_for_question(question=q, choice_text="Choice P1")
+        # Not the test transaction's edits, those would drop the tally again
+        # after the first request.
+        results_cache.invalidate_pending()
+        before = results_cache.stats()
+        self.results(q)
+        self.results(q)
+        after = results_cache.stats()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 1)
+
+    def test_vote_invalidates_results(self):
+        q = create_question(question_text="Past", days=-1)
+        c = create_choice_for_question(question=q, choice_text="Choice P1")
+        self.assertContains(self.results(q), "0 votes")
+        self.client.post(reverse('polls:vote', args=(q.id,)),
+                         {'choice': c.id})
+        self.assertContains(self.results(q), "1 vote")
+
+    @override_settings(POLLS_RESULTS_STALENESS=60)
+    def test_votes_within_staleness_window_keep_cached_results(self):
+        q = create_question(question_text="Past", days=-1)
+        c = create_choice_for_question(question=q, choice_text="Choice P1")
+        results_cache.invalidate_pending()
+        self.assertContains(self.results(q), "0 votes")
+        self.client.post(reverse('polls:vote', args=(q.id,)),
+                         {'choice': c.id})
+        self.assertContains(self.results(q), "0 votes")
+
+    def test_editing_choice_invalidates_results(self):
+        q = create_question(question_text="Past", days=-1)
+        c = create_choice_for_question(question=q, choice_text="Choice P1")
+        self.assertContains(self.results(q), "Choice P1")
+        c.choice_text = "Renamed"
+        c.save()
+        self.assertContains(self.results(q), "Renamed")
+
+    def test_tally_cached_during_the_transaction_is_dropped(self):
+        q = create_question(question_text="Past", days=-1)
+        c = create_choice_for_question(question=q, choice_text="Choice P1")
+        with transaction.atomic():
+            stale = results_cache.get_results(q)
+            c.choice_text = "Renamed"
+            c.save()
+            # Another request, before the admin's transaction commits.
+            cache.set(results_cache.KEY % q.pk, stale)
+        request_finished.send(sender=self.__class__)
+        response = self.results(q)
+        self.assertContains(response, "Renamed")
+        self.assertNotContains(response, "Choice P1")
+
+    def test_buffer_flush_invalidates_results(self):
+        q = create_question(question_text="Past", days=-1)
+        c = create_choice_for_question(question=q, choice_text="Choice P1")
+        self.assertContains(self.results(q), "0 votes")
+        buf = votes.VoteBuffer()
+        buf.add(c.pk, 2)
+        buf.flush()
+        self.assertContains(self.results(q), "2 votes")
+
+
+def create_many_choices(question, count):
+    """Creates @param 'count' choices for a question with bulk_create, which
+    skips the signals, so has_choices is set by hand.
+    """
+    Choice.objects.bulk_create(
+        Choice(question=question, choice_text="Choice %d" % i)
+        for i in range(count))
+    Question.objects.filter(pk=question.pk).update(has_choices=True)
+
+
+class QueryBudgetTest(PollsTestCase):
+    """Each view has to run in a fixed number of queries, however many
+    choices a question has.
+    """
+
+    BUDGET = {'index': 2, 'detail': 2, 'results': 3, 'vote': 4}
+
+    def check_budget(self, choice_count):
+        q = create_question(question_text="Past", days=-1)
+        create_many_choices(q, choice_count)
+        choice = Choice.objects.filter(question=q).first()
+
+        response = self.assertMaxQueries(
+            self.BUDGET['index'], self.client.get, reverse('polls:index'))
+        self.assertContains(response, "Past")
+
+        response = self.assertMaxQueries(
+            self.BUDGET['detail'], self.client.get,
+            reverse('polls:detail', args=(q.id,)))
+        self.assertContains(response, 'value="%d"' % choice.id)
+
+        response = self.assertMaxQueries(
+            self.BUDGET['vote'], self.client.post,
+            reverse('polls:vote', args=(q.id,)), {'choice': choice.id})
+        self.assertEqual(response.status_code, 302)
+
+        response = self.assertMaxQueries(
+            self.BUDGET['results'], self.client.get,
+            reverse('polls:results', args=(q.id,)))
+        self.assertContains(response, "1 vote")
+
+        # Re-displaying the form after a bad vote.
+        response = self.assertMaxQueries(
+            self.BUDGET['vote'], self.client.post,
+            reverse('polls:vote', args=(q.id,)), {})
+        self.assertContains(response, "You didn&#39;t select a choice.")
+
+    def test_query_budget_with_one_choice(self):
+        self.check_budget(1)
+
+    def test_query_budget_with_100_choices(self):
+        self.check_budget(100)
+
+    def test_query_budget_with_10000_choices(self):
+        self.check_budget(10000)
+
+
+class ArchiveViewTest(PollsTestCase):
+
+    def create_published(self, count):
+        """bulk_create a lot of published questions, all with choices."""
+        now = timezone.now()
+        Question.objects.bulk_create(
+            Question(question_text="Q%d" % i, has_choices=True,
+                     pub_date=now - datetime.timedelta(minutes=i))
+            for i in range(count))
+
+    def walk(self, url):
+        """Follows the next links and returns every question shown."""
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(q.question_text
+                        for q in response.context['question_list'])
+            cursor = response.context['next_cursor']
+            url = cursor and reverse('polls:archive', args=(cursor,))
+        return seen
+
+    @override_settings(POLLS_ARCHIVE_PAGE_SIZE=3)
+    def test_archive_walks_every_question_once(self):
+        self.create_published(10)
+        create_question(question_text="Future", days=30)
+        self.assertEqual(self.walk(reverse('polls:archive')),
+                         ["Q%d" % i for i in range(10)])
+
+    @override_settings(POLLS_ARCHIVE_PAGE_SIZE=2)
+    def test_archive_handles_equal_pub_dates(self):
+        time = timezone.now() - datetime.timedelta(days=1)
+        Question.objects.bulk_create(
+            Question(question_text="Same %d" % i, has_choices=True,
+                     pub_date=time)
+            for i in range(5))
+        self.assertEqual(sorted(self.walk(reverse('polls:archive'))),
+                         ["Same %d" % i for i in range(5)])
+
+    def test_archive_with_bad_cursor(self):
+        response = self.client.get(reverse('polls:archive',
+                                           args=('not-a-cursor',)))
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(POLLS_ARCHIVE_PAGE_SIZE=5)
+    def test_deep_page_is_as_fast_as_first_page(self):
+        """Page 10,000 (of 5 questions each) must cost about the same as
+        page 1, which OFFSET pagination can't do.
+        """
+        size = 5
+        self.create_published(size * 10000)
+        deep = Question.objects.published().order_by('-pub_date', '-id')[
+            size * 9999 - 1:size * 9999].get()
+        deep_url = reverse('polls:archive',
+                           args=(pagination.encode_cursor(deep),))
+
+        def best_of(url):
+            timings = []
+            for _ in range(5):
+                started = time.time()
+                response = self.client.get(url)
+                timings.append(time.time() - started)
+            return min(timings), response
+
+        first, _ = best_of(reverse('polls:archive'))
+        last, response = best_of(deep_url)
+        self.assertEqual([q.question_text
+                          for q in response.context['question_list']],
+                         ["Q%d" % i
+                          for i in range(size * 9999, size * 10000)])
+        self.assertLess(last, first * 3 + 0.005)
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get(deep_url)
+        self.assertNotIn('OFFSET', captured.captured_queries[0]['sql'])
+
+
+class ExportTest(PollsTestCase):
+
+    def setUp(self):
+        super(ExportTest, self).setUp()
+        self.q1 = create_question(question_text="Old", days=-30)
+        self.c1 = create_choice_for_question(self.q1, "Choice P1")
+        self.c2 = create_choice_for_question(self.q1, "Choice P2")
+        self.q2 = create_question(question_text="New", days=-1)
+        User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+
+    def test_export_rows_include_every_choice(self):
+        votes.record_vote(self.c2)
+        rows = list(export.export_rows(chunk_size=1))
+        self.assertEqual([(r['question_text'], r['choice_text'], r['votes'])
+                          for r in rows],
+                         [("Old", "Choice P1", 0), ("Old", "Choice P2", 1),
+                          ("New", None, None)])
+
+    def test_export_rows_filtered_by_pub_date(self):
+        since = timezone.now() - datetime.timedelta(days=7)
+        rows = list(export.export_rows(since=since))
+        self.assertEqual([r['question_text'] for r in rows], ["New"])
+
+    def test_export_view_streams_csv(self):
+        self.client.login(username='admin', password='pw')
+        response = self.client.get(reverse('polls:export', args=('csv',)))
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], ','.join(export.FIELDS))
+        self.assertEqual(len(lines), 4)
+
+    def test_export_view_ndjson_with_bad_date(self):
+        self.client.login(username='admin', password='pw')
+        response = self.client.get(reverse('polls:export', args=('ndjson',)),
+                                   {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_view_is_staff_only(self):
+        response = self.client.get(reverse('polls:export', args=('csv',)))
+        self.assertNotEqual(response.status_code, 200)
+
+
+class ImportTest(PollsTestCase):
+
+    def import_lines(self, name, lines, **options):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        call_command('import_polls', path, stdout=StringIO(), **options)
+
+    def setUp(self):
+        super(ImportTest, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def test_import_csv(self):
+        self.import_lines('polls.csv', [
+            ','.join(export.FIELDS),
+            '7,Pick one,2015-07-01T10:00:00+00:00,1,Red,3',
+            '7,Pick one,2015-07-01T10:00:00+00:00,2,Blue,4',
+            '8,Empty,2015-07-02,,,',
+        ], batch_size=2)
+        q = Question.objects.get(question_text="Pick one")
+        self.assertTrue(q.has_choices)
+        self.assertEqual(sorted((c.choice_text, c.votes)
+                                for c in q.choice_set.all()),
+                         [("Blue", 4), ("Red", 3)])
+        self.assertFalse(Question.objects.get(question_text="Empty")
+                         .has_choices)
+
+    def test_export_then_import_round_trips(self):
+        q = create_question(question_text="Past", days=-1)
+        c = create_choice_for_question(q, "Choice P1")
+        votes.record_vote(c)
+        lines = [line.rstrip('\n') for line in
+                 export.as_ndjson(export.export_rows())]
+        self.import_lines('polls.ndjson', lines)
+        copies = Question.objects.filter(question_text="Past")
+        self.assertEqual(copies.count(), 2)
+        copy = copies.exclude(pk=q.pk).get()
+        self.assertEqual(copy.pub_date, q.pub_date)
+        self.assertEqual([(c.choice_text, c.votes)
+                          for c in copy.choice_set.all()],
+                         [("Choice P1", 1)])
+
+
+class JsonApiTest(PollsTestCase):
+
+    def setUp(self):
+        super(JsonApiTest, self).setUp()
+        self.q = create_question(question_text="Past", days=-1)
+        self.c = create_choice_for_question(self.q, "Choice P1")
+        # Not the test transaction's edits, those would get a new ETag after
+        # the first request.
+        versions.touch_pending()
+
+    def test_question_list(self):
+        create_question(question_text="Future", days=30)
+        response = self.client.get(reverse('polls:api_questions'))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content.decode())
+        self.assertEqual([q['question_text'] for q in data['questions']],
+                         ["Past"])
+        response = self.client.get(reverse('polls:api_questions'),
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_question_detail_and_results(self):
+        response = self.client.get(reverse('polls:api_question',
+                                           args=(self.q.id,)))
+        data = json.loads(response.content.decode())
+        self.assertEqual(data['choices'],
+                         [{'id': self.c.id, 'choice_text': "Choice P1"}])
+        response = self.client.get(reverse('polls:api_results',
+                                           args=(self.q.id,)))
+        data = json.loads(response.content.decode())
+        self.assertEqual(data['choices'][0]['votes'], 0)
+
+    def age(self, seconds):
+        cache.set(versions.KEY % self.q.pk, time.time() - seconds, None)
+
+    def test_unchanged_results_are_304_without_queries(self):
+        self.age(5)
+        url = reverse('polls:api_results', args=(self.q.id,))
+        response = self.client.get(url)
+        self.assertTrue(response.has_header('Last-Modified'))
+        with self.assertNumQueries(0):
+            response = self.client.get(url,
+                                       HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_no_last_modified_in_the_second_of_a_change(self):
+        # Another vote could still come in this second, If-Modified-Since
+        # would not tell them apart.
+        self.age(0)
+        url = reverse('polls:api_results', args=(self.q.id,))
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertTrue(response.has_header('ETag'))
+
+    def test_edit_in_a_transaction_is_touched_again(self):
+        with transaction.atomic():
+            self.q.save()
+            # Another request, before the admin's transaction commits.
+            etag = versions.etag(self.q.pk)
+        time.sleep(0.01)
+        request_finished.send(sender=self.__class__)
+        self.assertNotEqual(versions.etag(self.q.pk), etag)
+
+    def test_vote_changes_results_etag(self):
+        url = reverse('polls:api_results', args=(self.q.id,))
+        etag = self.client.get(url)['ETag']
+        time.sleep(0.01)
+        self.client.post(reverse('polls:vote', args=(self.q.id,)),
+                         {'choice': self.c.id})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content.decode())
+        self.assertEqual(data['choices'][0]['votes'], 1)
+
+    def test_future_question_is_404(self):
+        q = create_question(question_text="Future", days=30)
+        create_choice_for_question(q, "Choice F1")
+        response = self.client.get(reverse('polls:api_question',
+                                           args=(q.id,)))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(POLLS_PERF_SAMPLE_RATE=1.0)
+class PerformanceMiddlewareTest(PollsTestCase):
+
+    def setUp(self):
+        super(PerformanceMiddlewareTest, self).setUp()
+        perf.reset()
+        # Keep the log lines out of the test output.
+        self.logger = logging.getLogger('polls.perf')
+        self.logger.disabled = True
+        self.addCleanup(setattr, self.logger, 'disabled', False)
+        self.q = create_question(question_text="Past", days=-1)
+        create_choice_for_question(self.q, "Choice P1")
+        # Not the test transaction's edits, those would drop the list of
+        # visible questions again after the first request.
+        schedule.reschedule_pending()
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('polls:detail', args=(self.q.id,)))
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
+        self.assertIn('tpl;dur=', response['Server-Timing'])
+
+    def test_structured_log_line(self):
+        self.logger.disabled = False
+        with self.assertLogs('polls.perf', 'INFO') as logs:
+            self.client.get(reverse('polls:index'))
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['view'], 'polls:index')
+        self.assertEqual(line['queries'], 2)
+
+    def test_histograms_per_view(self):
+        for _ in range(3):
+            self.client.get(reverse('polls:index'))
+        self.client.get(reverse('polls:results', args=(self.q.id,)))
+        stats = perf.snapshot()
+        self.assertEqual(stats['polls:index']['total_ms']['count'], 3)
+        # Only the first one builds the list of visible questions.
+        self.assertEqual(stats['polls:index']['queries']['max'], 2)
+        self.assertEqual(stats['polls:index']['queries']['p50'], 0)
+        self.assertGreater(stats['polls:results']['bytes']['max'], 0)
+
+    @override_settings(POLLS_PERF_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_timed(self):
+        response = self.client.get(reverse('polls:index'))
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(perf.snapshot(), {})
+
+    def test_perf_endpoint_is_staff_only(self):
+        response = self.client.get(reverse('polls:perf'))
+        self.assertNotEqual(response.status_code, 200)
+        User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+        response = self.client.get(reverse('polls:perf'))
+        self.assertIn('polls:perf', json.loads(response.content.decode()))
+
+
+class LiveResultsTest(PollsTestCase):
+
+    def setUp(self):
+        super(LiveResultsTest, self).setUp()
+        self.q = create_question(question_text="Past", days=-1)
+        self.c1 = create_choice_for_question(self.q, "Choice P1")
+        self.c2 = create_choice_for_question(self.q, "Choice P2")
+        # No background thread, the tests call tick() themselves.
+        self.feed = live.ResultsFeed(autostart=False)
+        self.addCleanup(setattr, live, 'feed', live.feed)
+        live.feed = self.feed
+
+    def test_many_watchers_share_one_tally(self):
+        subs = [self.feed.subscribe(self.q.pk) for _ in range(50)]
+        for sub in subs:
+            self.assertEqual(sub.wait(0)['tally'],
+                             {self.c1.pk: 0, self.c2.pk: 0})
+        votes.record_vote(self.c1)
+        votes.record_vote(self.c1)
+        votes.record_vote(self.c2)
+        with self.assertNumQueries(2):
+            self.feed.tick()
+        for sub in subs:
+            update = sub.wait(0)
+            self.assertEqual(update['deltas'], {self.c1.pk: 2, self.c2.pk: 1})
+        self.assertIsNone(subs[0].wait(0))
+
+    def test_updates_are_coalesced_for_slow_readers(self):
+        sub = self.feed.subscribe(self.q.pk)
+        sub.wait(0)
+        for _ in range(3):
+            votes.record_vote(self.c2)
+            self.feed.tick()
+        update = sub.wait(0)
+        self.assertEqual(update['deltas'], {self.c2.pk: 3})
+        self.assertEqual(update['tally'][self.c2.pk], 3)
+
+    @override_settings(POLLS_RESULTS_STALENESS=60)
+    def test_votes_pushed_while_the_results_cache_is_stale(self):
+        sub = self.feed.subscribe(self.q.pk)
+        sub.wait(0)
+        self.feed.tick()
+        votes.record_vote(self.c1)
+        self.feed.tick()
+        self.assertEqual(sub.wait(0)['deltas'], {self.c1.pk: 1})
+
+    def test_unchanged_question_costs_no_queries(self):
+        self.feed.subscribe(self.q.pk)
+        self.feed.tick()
+        with self.assertNumQueries(0):
+            self.feed.tick()
+
+    def test_stream_view(self):
+        response = self.client.get(reverse('polls:stream', args=(self.q.id,)))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = iter(response.streaming_content)
+        self.assertEqual(next(stream), b'retry: 3000\n\n')
+        event = next(stream).decode()
+        self.assertTrue(event.startswith('event: results\n'))
+        self.assertEqual(self.feed.watching(), {self.q.pk: 1})
+        response.close()
+        self.assertEqual(self.feed.watching(), {})
+
+
+class TemplateCachingTest(PollsTestCase):
+
+    def test_detail_fragment_cached_until_choice_changes(self):
+        q = create_question(question_text="Past", days=-1)
+        c = create_choice_for_question(q, "Choice P1")
+        url = reverse('polls:detail', args=(q.id,))
+        self.client.get(url)
+        # The question was saved inside the test's transaction, so the end of
+        # the first request invalidates it once more, see
+        # object_cache.invalidate().
+        self.client.get(url)
+        # The question and its choices come from the object cache and the
+        # page from the fragment cache.
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, "Choice P1")
+        c.choice_text = "Renamed"
+        c.save()
+        self.assertContains(self.client.get(url), "Renamed")
+
+    def test_fragment_rendered_during_the_transaction_is_dropped(self):
+        q = create_question(question_text="Past", days=-1)
+        create_choice_for_question(q, "Choice P1")
+        # Like the admin, which loads the question before saving it.
+        q = Question.objects.get(pk=q.pk)
+        with transaction.atomic():
+            q.save()
+            # Another request renders the old rows under the new version
+            # before the admin's transaction commits.
+            cache.set(make_template_fragment_key(
+                'poll_header', [q.id, q.cache_version]), 'Stale header')
+        time.sleep(0.01)
+        request_finished.send(sender=self.__class__)
+        response = self.client.get(reverse('polls:detail', args=(q.id,)))
+        self.assertNotContains(response, 'Stale header')
+        self.assertContains(response, 'Past')
+
+    def test_build_strips_comments_and_indentation(self):
+        source = ('<p>\n    {# note #}<!-- about this -->Hi\n</p>\n'
+                  '{% comment %}\nlong note\n{% endcomment %}\n')
+        self.assertEqual(build_templates.strip_template(source),
+                         '<p>\nHi\n</p>\n')
+        self.assertEqual(build_templates.strip_template('<pre>  a</pre>'),
+                         '<pre>  a</pre>')
+
+
+class ReplicaRoutingTest(PollsTestCase):
+
+    def tearDown(self):
+        routers.pin_to_primary(False)
+
+    @override_settings(POLLS_READ_REPLICAS=['default', 'missing'])
+    def test_reads_skip_unknown_replicas(self):
+        self.assertEqual(routers.read_replicas(), ['default'])
+
+    def test_pinned_reads_use_primary(self):
+        router = routers.PrimaryReplicaRouter()
+        # The router only looks the alias up, it never connects here.
+        connections.databases['replica_stub'] = {}
+        try:
+            with override_settings(POLLS_READ_REPLICAS=['replica_stub']):
+                self.assertEqual(router.db_for_read(Question), 'replica_stub')
+                # Other apps read from the primary.
+                self.assertIsNone(router.db_for_read(User))
+                routers.pin_to_primary()
+                self.assertEqual(router.db_for_read(Question), 'default')
+                self.assertEqual(router.db_for_write(Question), 'default')
+        finally:
+            del connections.databases['replica_stub']
+
+    def test_vote_sets_pin_cookie(self):
+        q = create_question(question_text="Past", days=-1)
+        c = create_choice_for_question(q, "Choice P1")
+        response = self.client.post(reverse('polls:vote', args=(q.id,)),
+                                    {'choice': c.id})
+        until = float(response.cookies[routers.PIN_COOKIE].value)
+        self.assertGreater(until, time.time())
+        # Reads are no longer pinned once the response is on its way.
+        self.assertFalse(routers.pinned_to_primary())
+
+    def test_get_does_not_set_pin_cookie(self):
+        response = self.client.get(reverse('polls:index'))
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+
+
+@unittest.skipUnless('replica' in settings.DATABASES,
+                     "run with --settings=mysite.settings_replicas")
+class ReplicaReadYourWritesTest(PollsTestCase):
+    """Nothing replicates between the two test databases, so a page shows
+    the vote only when it was read from the primary.
+    """
+    multi_db = True
+
+    def setUp(self):
+        super(ReplicaReadYourWritesTest, self).setUp()
+        for alias in ('default', 'replica'):
+            q = Question.objects.using(alias).create(
+                id=1, question_text="Past", has_choices=True,
+                pub_date=timezone.now() - datetime.timedelta(days=1))
+            Choice.objects.using(alias).create(id=1, question=q,
+                                               choice_text="Choice P1")
+
+    def test_voter_reads_own_vote_from_primary(self):
+        self.client.post(reverse('polls:vote', args=(1,)), {'choice': 1})
+        self.assertContains(self.client.get(reverse('polls:results',
+                                                    args=(1,))),
+                            "1 vote")
+        # Once the pin has expired the results come from the lagging replica.
+        self.client.cookies[routers.PIN_COOKIE] = '0'
+        cache.clear()
+        self.assertContains(self.client.get(reverse('polls:results',
+                                                    args=(1,))),
+                            "0 votes")
+
+    def test_other_visitor_does_not_cache_the_lagging_tally(self):
+        voter, other = Client(), Client()
+        url = reverse('polls:results', args=(1,))
+        voter.post(reverse('polls:vote', args=(1,)), {'choice': 1})
+        # Read from the replica, which hasn't seen the vote yet.
+        self.assertContains(other.get(url), "0 votes")
+        self.assertContains(voter.get(url), "1 vote")
+
+
+class ConnectionPoolTest(PollsTestCase):
+    """Uses plain sqlite3 connections to a scratch file."""
+
+    def setUp(self):
+        super(ConnectionPoolTest, self).setUp()
+        handle, self.path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def make_pool(self, **options):
+        new_pool = pool.ConnectionPool(lambda: sqlite3.connect(
+            self.path, check_same_thread=False), **options)
+        self.addCleanup(new_pool.close_all)
+        return new_pool
+
+    def test_connection_reused(self):
+        p = self.make_pool()
+        conn = p.checkout()
+        p.checkin(conn)
+        self.assertIs(p.checkout(), conn)
+        stats = p.stats()
+        self.assertEqual((stats['opened'], stats['checkouts']), (1, 2))
+
+    def test_size_limit_times_out(self):
+        p = self.make_pool(SIZE=1, TIMEOUT=0.05)
+        p.checkout()
+        self.assertRaises(pool.PoolTimeout, p.checkout)
+        self.assertEqual(p.stats()['timeouts'], 1)
+
+    def test_waiting_thread_gets_returned_connection(self):
+        p = self.make_pool(SIZE=1)
+        conn = p.checkout()
+        got = []
+        waiter = threading.Thread(target=lambda: got.append(p.checkout()))
+        waiter.start()
+        time.sleep(0.05)
+        p.checkin(conn)
+        waiter.join()
+        self.assertEqual(got, [conn])
+        stats = p.stats()
+        self.assertEqual((stats['waits'], stats['opened']), (1, 1))
+        self.assertGreater(stats['wait_ms_max'], 0)
+
+    def test_old_connection_recycled(self):
+        p = self.make_pool(MAX_LIFETIME=0)
+        conn = p.checkout()
+        p.checkin(conn)
+        self.assertIsNot(p.checkout(), conn)
+        self.assertEqual(p.stats()['recycled'], 1)
+
+    def test_failed_health_check_opens_new_connection(self):
+        def ping(conn):
+            conn.execute('SELECT 1')
+        p = self.make_pool(ping=ping, HEALTH_CHECK_AFTER=0)
+        conn = p.checkout()
+        p.checkin(conn)
+        conn.close()
+        self.assertIsNot(p.checkout(), conn)
+        stats = p.stats()
+        self.assertEqual((stats['failed_health_checks'], stats['open']),
+                         (1, 1))
+
+    def test_connection_that_cannot_reset_is_discarded(self):
+        p = self.make_pool(reset=lambda conn: conn.rollback())
+        conn = p.checkout()
+        conn.close()
+        p.checkin(conn)
+        stats = p.stats()
+        self.assertEqual((stats['errors'], stats['open']), (1, 0))
+
+    def test_pool_stats_view_is_staff_only(self):
+        url = reverse('polls:perf_pools')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+        self.assertEqual(self.client.get(url)['Content-Type'],
+                         'application/json')
+
+
+@unittest.skipUnless(
+    settings.DATABASES['default']['ENGINE'] == 'mysite.db.mysql',
+    "needs the pooled MySQL backend")
+class PooledBackendTest(TransactionTestCase):
+
+    def test_connection_goes_back_to_pool(self):
+        Question.objects.count()
+        connection.close()
+        stats = connection.pool.stats()
+        Question.objects.count()
+        self.assertEqual(connection.pool.stats()['opened'], stats['opened'])
+        self.assertEqual(connection.pool.stats()['checkouts'],
+                         stats['checkouts'] + 1)
+
+
+@override_settings(ROOT_URLCONF='mysite.urls_public')
+class PublicProfileTest(PollsTestCase):
+    """The URLs of the slim settings, mysite/settings_public.py."""
+
+    def test_public_pages_served(self):
+        q = create_question(question_text="Past", days=-1)
+        create_choice_for_question(q, "Choice P1")
+        self.assertEqual(self.client.get(reverse('polls:index')).status_code,
+                         200)
+        self.assertContains(self.client.get(reverse('polls:detail',
+                                                    args=(q.id,))),
+                            "Choice P1")
+
+    def test_staff_pages_not_served(self):
+        self.assertEqual(self.client.get('/polls/export.csv').status_code,
+                         404)
+        self.assertEqual(self.client.get('/admin/').status_code, 404)
+
+
+class VoteThrottleTest(PollsTestCase):
+
+    def setUp(self):
+        super(VoteThrottleTest, self).setUp()
+        self.q = create_question(question_text="Past", days=-1)
+        self.c = create_choice_for_question(self.q, "Choice P1")
+        self.url = reverse('polls:vote', args=(self.q.id,))
+
+    def vote(self):
+        return self.client.post(self.url, {'choice': self.c.id})
+
+    @override_settings(POLLS_VOTE_DEDUP=True)
+    def test_second_vote_not_counted(self):
+        self.vote()
+        # Sent to the results without a single query.
+        with self.assertNumQueries(0):
+            response = self.vote()
+        self.assertRedirects(response, reverse('polls:results',
+                                               args=(self.q.id,)))
+        self.assertEqual(Choice.objects.get(pk=self.c.pk).votes, 1)
+
+    @override_settings(POLLS_VOTE_DEDUP=True)
+    def test_leading_zeros_are_the_same_question(self):
+        self.vote()
+        for url in ('/polls/0%d/vote/' % self.q.pk,
+                    '/polls/00%d/vote/' % self.q.pk):
+            response = self.client.post(url, {'choice': self.c.id})
+            self.assertEqual(response.status_code, 302)
+        self.assertEqual(Choice.objects.get(pk=self.c.pk).votes, 1)
+
+    @override_settings(POLLS_VOTE_DEDUP=True)
+    def test_other_question_still_open(self):
+        self.vote()
+        other = create_question(question_text="Other", days=-1)
+        choice = create_choice_for_question(other, "Choice O1")
+        self.client.post(reverse('polls:vote', args=(other.id,)),
+                         {'choice': choice.id})
+        self.assertEqual(Choice.objects.get(pk=choice.pk).votes, 1)
+
+    @override_settings(POLLS_VOTE_RATE=2, POLLS_VOTE_RATE_WINDOW=60)
+    def test_flood_gets_429(self):
+        self.vote()
+        self.vote()
+        with self.assertNumQueries(0):
+            response = self.vote()
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(0 < int(response['Retry-After']) <= 60)
+        self.assertEqual(Choice.objects.get(pk=self.c.pk).votes, 2)
+
+    def test_sliding_window_counts_previous_window(self):
+        limiter = throttle.RateLimiter()
+        # 4 hits at the end of one window, then a quarter into the next
+        # three quarters of those still count.
+        for _ in range(4):
+            self.assertEqual(limiter.hit('ip', 5, 60, now=119.0), 0)
+        self.assertEqual(limiter.hit('ip', 5, 60, now=135.0), 0)
+        self.assertEqual(limiter.hit('ip', 5, 60, now=135.0), 0)
+        self.assertEqual(limiter.hit('ip', 5, 60, now=135.0), 45)
+        # Blocked without asking the cache again.
+        cache.clear()
+        self.assertEqual(limiter.hit('ip', 5, 60, now=150.0), 30)
+
+    def test_filters_shared_through_cache(self):
+        worker1 = throttle.RotatingBloomFilter(1000, 0.01, 60, 0)
+        worker2 = throttle.RotatingBloomFilter(1000, 0.01, 60, 0)
+        worker1.add('ip:1.2.3.4:1')
+        self.assertIn('ip:1.2.3.4:1', worker2)
+        self.assertNotIn('ip:1.2.3.4:2', worker2)
+
+    def test_sync_fetches_only_changed_blocks(self):
+        # 19 blocks per filter.
+        worker1 = throttle.RotatingBloomFilter(1000000, 0.01, 60, 0)
+        worker2 = throttle.RotatingBloomFilter(1000000, 0.01, 60, 0)
+        worker1.add('ip:1.2.3.4:1')
+        self.assertIn('ip:1.2.3.4:1', worker2)
+        merged = []
+        for f in worker2.filters.values():
+            def merge(start, data, original=f.merge):
+                merged.append(start)
+                return original(start, data)
+            f.merge = merge
+        self.assertNotIn('ip:1.2.3.4:2', worker2)
+        self.assertEqual(merged, [])
+        worker1.add('ip:5.6.7.8:1')
+        self.assertIn('ip:5.6.7.8:1', worker2)
+        self.assertTrue(0 < len(merged) <= worker1.hashes)
+
+    def test_bloom_filter_error_rate(self):
+        bits, hashes = throttle.bloom_size(10000, 0.01)
+        f = throttle.BloomFilter(bits, hashes)
+        for i in range(10000):
+            f.add('seen:%d' % i)
+        self.assertTrue(all('seen:%d' % i in f for i in range(10000)))
+        wrong = sum('new:%d' % i in f for i in range(10000))
+        self.assertLess(wrong, 200)
+
+
+class VoteHistoryTest(PollsTestCase):
+
+    def setUp(self):
+        super(VoteHistoryTest, self).setUp()
+        self.q = create_question(question_text="Past", days=-1)
+        self.c1 = create_choice_for_question(self.q, "Choice P1")
+        self.c2 = create_choice_for_question(self.q, "Choice P2")
+        # Not the test transaction's edits, see ResultsCacheTest.
+        results_cache.invalidate_pending()
+        self.t0 = history.floor(timezone.now(), VoteRollup.DAY) - \
+            datetime.timedelta(days=1)
+
+    def at(self, minutes, seconds=0):
+        return self.t0 + datetime.timedelta(minutes=minutes, seconds=seconds)
+
+    def rollups(self, period):
+        return sorted(VoteRollup.objects.filter(period=period).values_list(
+            'choice_id', 'start', 'votes'))
+
+    def test_vote_adds_event(self):
+        self.client.post(reverse('polls:vote', args=(self.q.id,)),
+                         {'choice': self.c1.id})
+        self.assertEqual(
+            list(VoteEvent.objects.values_list('choice_id', 'count')),
+            [(self.c1.id, 1)])
+
+    def test_compact_rolls_up_every_period(self):
+        history.record({self.c1.pk: 1, self.c2.pk: 2}, when=self.at(0, 5))
+        history.record({self.c1.pk: 3}, when=self.at(0, 50))
+        history.record({self.c1.pk: 1}, when=self.at(61))
+        self.assertEqual(history.compact(now=self.at(70)), 4)
+        self.assertEqual(self.rollups(VoteRollup.MINUTE), [
+            (self.c1.pk, self.at(0), 4), (self.c1.pk, self.at(61), 1),
+            (self.c2.pk, self.at(0), 2)])
+        self.assertEqual(self.rollups(VoteRollup.HOUR), [
+            (self.c1.pk, self.at(0), 4), (self.c1.pk, self.at(60), 1),
+            (self.c2.pk, self.at(0), 2)])
+        self.assertEqual(self.rollups(VoteRollup.DAY), [
+            (self.c1.pk, self.t0, 5), (self.c2.pk, self.t0, 2)])
+
+    def test_compact_is_repeatable(self):
+        history.record({self.c1.pk: 1}, when=self.at(0))
+        history.compact(now=self.at(10))
+        # A late vote in the last rolled up minute and a new one.
+        history.record({self.c1.pk: 1}, when=self.at(8, 30))
+        history.record({self.c1.pk: 1}, when=self.at(9))
+        history.compact(now=self.at(20))
+        history.compact(now=self.at(20))
+        self.assertEqual(self.rollups(VoteRollup.DAY),
+                         [(self.c1.pk, self.t0, 3)])
+
+    def test_lag_leaves_recent_votes(self):
+        history.record({self.c1.pk: 1}, when=self.at(0))
+        history.record({self.c1.pk: 1}, when=self.at(10, 30))
+        history.compact(now=self.at(11))
+        self.assertEqual(self.rollups(VoteRollup.DAY),
+                         [(self.c1.pk, self.t0, 1)])
+
+    def test_deleted_choice_skipped(self):
+        history.record({self.c1.pk: 1, self.c2.pk: 1}, when=self.at(0))
+        c2_pk = self.c2.pk
+        self.c2.delete()
+        history.compact(now=self.at(10))
+        self.assertEqual(self.rollups(VoteRollup.DAY),
+                         [(self.c1.pk, self.t0, 1)])
+        self.assertTrue(VoteEvent.objects.filter(choice_id=c2_pk).exists())
+
+    @override_settings(POLLS_HISTORY_KEEP_EVENTS=0,
+                       POLLS_HISTORY_KEEP_ROLLUPS={'minute': 0})
+    def test_prune_keeps_what_compact_needs(self):
+        for minute in (0, 1, 61, 65):
+            history.record({self.c1.pk: 1}, when=self.at(minute))
+        history.compact(now=self.at(63))
+        deleted = history.prune(now=self.at(70), batch_size=1)
+        # The minute the next run starts from keeps its events, and the
+        # minutes of its hour are still needed to add that hour up again.
+        self.assertEqual(deleted, {'events': 2, 'minute': 2})
+        history.compact(now=self.at(70))
+        self.assertEqual(self.rollups(VoteRollup.HOUR), [
+            (self.c1.pk, self.at(0), 2), (self.c1.pk, self.at(60), 2)])
+        self.assertEqual(self.rollups(VoteRollup.DAY),
+                         [(self.c1.pk, self.t0, 4)])
+
+    def test_trend_api_reads_rollups(self):
+        history.record({self.c1.pk: 2}, when=self.at(0))
+        history.record({self.c2.pk: 1}, when=self.at(61))
+        history.compact(now=self.at(70))
+        url = reverse('polls:api_trend', args=(self.q.id,))
+        self.client.get(url)
+        # The question and the rollups, the choices come from the cache.
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'since': self.t0.isoformat()})
+        data = json.loads(response.content.decode())
+        self.assertEqual(data['period'], 'hour')
+        self.assertEqual(data['buckets'], [
+            {'start': self.at(0).isoformat(), 'votes': {str(self.c1.pk): 2}},
+            {'start': self.at(60).isoformat(),
+             'votes': {str(self.c2.pk): 1}}])
+        self.assertEqual(self.client.get(url, {'period': 'week'}).status_code,
+                         400)
+
+
+class SearchTest(PollsTestCase):
+
+    def setUp(self):
+        super(SearchTest, self).setUp()
+        self.colour = create_question("What is your favourite colour?", -1)
+        create_choice_for_question(self.colour, "Blue")
+        create_choice_for_question(self.colour, "Green")
+        self.food = create_question("Favourite food?", -1)
+        create_choice_for_question(self.food, "Blue cheese")
+
+    def search(self, query, **kwargs):
+        return search.search(query, **kwargs)[0]
+
+    def test_index_follows_saves_and_deletes(self):
+        self.assertEqual(self.search('green'), [self.colour])
+        choice = self.colour.choice_set.get(choice_text="Green")
+        choice.choice_text = "Red"
+        choice.save()
+        self.assertEqual(self.search('green'), [])
+        self.assertEqual(self.search('red'), [self.colour])
+        self.colour.delete()
+        self.assertEqual(self.search('red'), [])
+        self.assertFalse(SearchPosting.objects.filter(
+            question_id=self.colour.pk).exists())
+
+    def test_delete_indexes_once_not_per_choice(self):
+        def delete_queries(choices):
+            question = create_question("Many choices", -1)
+            for n in range(choices):
+                create_choice_for_question(question, "Choice %d" % n)
+            with CaptureQueriesContext(connection) as captured:
+                question.delete()
+            return len(captured)
+        self.assertEqual(delete_queries(2), delete_queries(20))
+
+    def test_all_words_must_match(self):
+        self.assertEqual(self.search('blue cheese'), [self.food])
+        self.assertEqual(self.search('blue nothing'), [])
+        # Stop words are left out of the index and the search.
+        self.assertEqual(self.search('the colour'), [self.colour])
+
+    def test_question_deleted_while_searching_left_out(self):
+        published_scores = search._published_scores
+
+        def delete_after_scoring(*args):
+            scores = published_scores(*args)
+            # Another request, before the questions are fetched.
+            Question.objects.filter(pk=self.food.pk).delete()
+            return scores
+        search._published_scores = delete_after_scoring
+        try:
+            self.assertEqual(self.search('blue'), [self.colour])
+        finally:
+            search._published_scores = published_scores
+
+    def test_question_text_ranks_higher(self):
+        other = create_question("Blue or not?", -1)
+        create_choice_for_question(other, "Yes")
+        self.assertEqual(self.search('blue')[0], other)
+
+    def test_unpublished_not_found(self):
+        future = create_question("Future colour", 5)
+        create_choice_for_question(future, "Blue")
+        self.assertNotIn(future, self.search('colour'))
+
+    def test_search_view_pages(self):
+        for n in range(3):
+            q = create_question("Favourite number %d" % n, -1)
+            create_choice_for_question(q, "Seven")
+        url = reverse('polls:search')
+        with self.settings(POLLS_SEARCH_PAGE_SIZE=2):
+            response = self.client.get(url, {'q': 'favourite'})
+            self.assertEqual(len(response.context['question_list']), 2)
+            self.assertEqual(response.context['next_page'], 2)
+            response = self.client.get(url, {'q': 'favourite', 'page': 3})
+            self.assertEqual(len(response.context['question_list']), 1)
+            self.assertIsNone(response.context['next_page'])
+        self.assertContains(self.client.get(url, {'q': 'zebra'}),
+                            'No polls match')
+        self.assertEqual(self.client.get(url, {'page': 'x'}).status_code,
+                         404)
+
+    def test_admin_search_uses_index(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+        response = self.client.get(
+            reverse('admin:polls_question_changelist'), {'q': 'cheese'})
+        self.assertEqual(list(response.context['cl'].result_list),
+                         [self.food])
+
+
+class LargeAdminTest(PollsTestCase):
+
+    def setUp(self):
+        super(LargeAdminTest, self).setUp()
+        User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+        self.question = create_question("Pick one", -0.5)
+        for n in range(7):
+            create_choice_for_question(self.question, "Choice %d" % n)
+
+    def test_estimated_count(self):
+        class Estimated(pagination.EstimatedCountPaginator):
+            def estimate(self):
+                return 10 ** 6
+        questions = Question.objects.all()
+        with self.settings(POLLS_ADMIN_ESTIMATE_COUNT_OVER=1000):
+            self.assertEqual(Estimated(questions, 10).count, 10 ** 6)
+            # Filtered lists are counted.
+            self.assertEqual(
+                Estimated(questions.filter(pk=self.question.pk), 10).count, 1)
+            # SQLite keeps no estimate.
+            paginator = pagination.EstimatedCountPaginator(questions, 10)
+            self.assertEqual(paginator.count, 1)
+        with self.settings(POLLS_ADMIN_ESTIMATE_COUNT_OVER=None):
+            self.assertEqual(Estimated(questions, 10).count, 1)
+
+    def test_pages_past_a_low_estimate(self):
+        class Estimated(pagination.EstimatedCountPaginator):
+            def estimate(self):
+                return 12
+        for n in range(24):
+            create_question("Question %d" % n, -1)
+        questions = Question.objects.order_by('pk')
+        with self.settings(POLLS_ADMIN_ESTIMATE_COUNT_OVER=10):
+            paginator = Estimated(questions, 10)
+            self.assertEqual(paginator.num_pages, 2)
+            # Not cut off at the estimate.
+            self.assertEqual(len(paginator.page(2)), 10)
+            self.assertEqual(list(paginator.page(3)), list(questions[20:]))
+            self.assertRaises(EmptyPage, paginator.page, 4)
+            self.assertRaises(EmptyPage, paginator.page, 0)
+
+    def test_published_filter(self):
+        future = create_question("Later", 5)
+        old = create_question("Long ago", -60)
+        url = reverse('admin:polls_question_changelist')
+        for value, expected in [('recently', [self.question]),
+                                ('scheduled', [future]), ('older', [old])]:
+            response = self.client.get(url, {'published': value})
+            self.assertEqual(list(response.context['cl'].result_list),
+                             expected)
+
+    def test_choice_inline_pages(self):
+        url = reverse('admin:polls_question_change', args=(self.question.pk,))
+        with self.settings(POLLS_ADMIN_CHOICES_PER_PAGE=3):
+            response = self.client.get(url)
+            formset = response.context['inline_admin_formsets'][0].formset
+            self.assertEqual(formset.initial_form_count(), 3)
+            self.assertContains(response, '?choices_page=2')
+            response = self.client.get(url, {'choices_page': 9})
+            formset = response.context['inline_admin_formsets'][0].formset
+            self.assertEqual(formset.page, 3)
+            self.assertEqual([form.instance.choice_text
+                              for form in formset.initial_forms],
+                             ["Choice 6"])
+
+    def test_choice_edits_saved_in_one_update(self):
+        url = reverse('admin:polls_question_change', args=(self.question.pk,))
+        choices = list(self.question.choice_set.order_by('pk')[:3])
+        data = {
+            'question_text': self.question.question_text,
+            'pub_date_0': self.question.pub_date.strftime('%Y-%m-%d'),
+            'pub_date_1': self.question.pub_date.strftime('%H:%M:%S'),
+            'has_choices': 'on',
+            'choice_set-TOTAL_FORMS': 4,
+            'choice_set-INITIAL_FORMS': 3,
+            'choice_set-MIN_NUM_FORMS': 0,
+            'choice_set-MAX_NUM_FORMS': 1000,
+            'choice_set-3-question': self.question.pk,
+            'choice_set-3-choice_text': "Brand new",
+            'choice_set-3-votes': 0,
+        }
+        for n, choice in enumerate(choices):
+            data.update({
+                'choice_set-%d-id' % n: choice.pk,
+                'choice_set-%d-question' % n: self.question.pk,
+                'choice_set-%d-choice_text' % n: "Edited %d" % n,
+                'choice_set-%d-votes' % n: n,
+            })
+        with self.settings(POLLS_ADMIN_CHOICES_PER_PAGE=3):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        choice_writes = [q['sql'] for q in queries.captured_queries
+                         if 'UPDATE "polls_choice"' in q['sql']
+                         or 'INSERT INTO "polls_choice"' in q['sql']]
+        self.assertEqual(len(choice_writes), 2)
+        self.assertEqual(
+            [(c.choice_text, c.votes)
+             for c in Choice.objects.filter(pk__in=[c.pk for c in choices])
+             .order_by('pk')],
+            [("Edited 0", 0), ("Edited 1", 1), ("Edited 2", 2)])
+        self.assertTrue(self.question.choice_set.filter(
+            choice_text="Brand new").exists())
+        self.assertEqual(search.search('brand')[0], [self.question])
+
+
+class ScheduleTest(PollsTestCase):
+
+    def setUp(self):
+        super(ScheduleTest, self).setUp()
+        self.past = create_question("Past", -1)
+        create_choice_for_question(self.past, "Yes")
+        self.future = create_question("Future", 1)
+        create_choice_for_question(self.future, "Yes")
+
+    def index(self):
+        response = self.client.get(reverse('polls:index'))
+        return [q.question_text
+                for q in response.context['latest_question_list']]
+
+    def test_list_switches_over_at_pub_date(self):
+        self.assertEqual(self.index(), ["Past"])
+        self.assertEqual(schedule.current()['until'], self.future.pub_date)
+        # Time passing is played by moving pub_date without any signal.
+        Question.objects.filter(pk=self.future.pk).update(
+            pub_date=timezone.now() - datetime.timedelta(minutes=1))
+        self.assertEqual(self.index(), ["Past"])
+        live = schedule.current(
+            now=self.future.pub_date + datetime.timedelta(seconds=1))
+        self.assertEqual([q[1] for q in live['questions']],
+                         ["Future", "Past"])
+        self.assertIsNone(live['until'])
+        self.assertEqual(self.index(), ["Future", "Past"])
+
+    def test_edits_reschedule(self):
+        self.assertEqual(self.index(), ["Past"])
+        # Like the admin, which loads the question before saving it.
+        self.future = Question.objects.get(pk=self.future.pk)
+        self.future.pub_date = timezone.now() - datetime.timedelta(hours=1)
+        self.future.save()
+        self.assertEqual(self.index(), ["Future", "Past"])
+        self.future.choice_set.all().delete()
+        self.assertEqual(self.index(), ["Past"])
+        self.past = Question.objects.get(pk=self.past.pk)
+        self.past.question_text = "Renamed"
+        self.past.save()
+        self.assertEqual(self.index(), ["Renamed"])
+
+    def test_list_built_during_the_transaction_is_dropped(self):
+        with transaction.atomic():
+            schedule.reschedule()
+            # Another request, before the admin's transaction commits.
+            schedule.build()
+        self.assertIsNotNone(cache.get(schedule.KEY))
+        request_finished.send(sender=self.__class__)
+        self.assertIsNone(cache.get(schedule.KEY))
+
+    def test_publish_scheduled_once(self):
+        out = StringIO()
+        call_command('publish_scheduled', once=True, stdout=out)
+        self.assertIn('1 questions visible', out.getvalue())
+        with self.assertNumQueries(0):
+            self.client.get(reverse('polls:index'))
+
+
+class AsgiHandlerTest(PollsTestCase):
+    """The views need the test database, which the handler's threads can't
+    see, so most of these call a small WSGI application instead.
+    """
+
+    def call(self, application, scope, messages):
+        sent = []
+        messages = list(messages)
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            # Like a server, nothing more until the client disconnects.
+            await asyncio.Future()
+
+        async def send(message):
+            sent.append(message)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(application(scope, receive, send))
+        finally:
+            loop.close()
+        return sent
+
+    def http(self, application, method='GET', path='/', body=b'',
+             headers=()):
+        scope = {'type': 'http', 'method': method, 'path': path,
+                 'query_string': b'a=1', 'headers': list(headers)}
+        # The body arrives in two parts.
+        return self.call(application, scope, [
+            {'type': 'http.request', 'body': body[:1], 'more_body': True},
+            {'type': 'http.request', 'body': body[1:]},
+        ])
+
+    def test_request_and_response(self):
+        seen = {}
+
+        def app(environ, start_response):
+            seen.update(environ)
+            seen['body'] = environ['wsgi.input'].read()
+            start_response('201 Created', [('X-Test', 'yes')])
+            return [b'hello ', b'world']
+
+        sent = self.http(ASGIHandler(app, threads=1), 'POST', '/polls/1/vote/',
+                         b'choice=3', [(b'content-type', b'text/plain'),
+                                       (b'cookie', b'a=1'),
+                                       (b'cookie', b'b=2')])
+        self.assertEqual(seen['REQUEST_METHOD'], 'POST')
+        self.assertEqual(seen['PATH_INFO'], '/polls/1/vote/')
+        self.assertEqual(seen['QUERY_STRING'], 'a=1')
+        self.assertEqual(seen['CONTENT_TYPE'], 'text/plain')
+        self.assertEqual(seen['CONTENT_LENGTH'], '8')
+        self.assertEqual(seen['HTTP_COOKIE'], 'a=1,b=2')
+        self.assertEqual(seen['body'], b'choice=3')
+        self.assertEqual(sent[0], {'type': 'http.response.start',
+                                   'status': 201,
+                                   'headers': [(b'x-test', b'yes')]})
+        self.assertEqual(sent[1]['body'], b'hello world')
+
+    def test_streaming_response(self):
+        from django.http import StreamingHttpResponse
+
+        def app(environ, start_response):
+            response = StreamingHttpResponse(iter([b'a', b'b']))
+            start_response('200 OK', list(response.items()))
+            return response
+
+        sent = self.http(ASGIHandler(app, threads=1))
+        self.assertEqual([m.get('body') for m in sent[1:]],
+                         [b'a', b'b', b''])
+        self.assertFalse(sent[-1].get('more_body', False))
+
+    def test_streaming_response_runs_in_its_request_thread(self):
+        from django.http import StreamingHttpResponse
+        threads = []
+
+        def chunks():
+            try:
+                for chunk in [b'a', b'b']:
+                    threads.append(threading.current_thread())
+                    yield chunk
+            finally:
+                threads.append(threading.current_thread())
+
+        def app(environ, start_response):
+            threads.append(threading.current_thread())
+            response = StreamingHttpResponse(chunks())
+            start_response('200 OK', list(response.items()))
+            return response
+
+        sent = self.http(ASGIHandler(app, threads=3))
+        self.assertEqual([m.get('body') for m in sent[1:]],
+                         [b'a', b'b', b''])
+        self.assertEqual(len(threads), 4)
+        self.assertEqual(len(set(threads)), 1)
+
+    def test_disconnect_stops_streams(self):
+        from django.http import StreamingHttpResponse
+        q = create_question(question_text="Watched", days=-1)
+        feed = live.ResultsFeed(autostart=False)
+        sub = feed.subscribe(q.pk)
+        closed = []
+
+        def forever():
+            try:
+                while True:
+                    time.sleep(0.01)
+                    yield b'.'
+            finally:
+                closed.append(True)
+
+        def app(environ, start_response):
+            if environ['PATH_INFO'] == '/live/':
+                stream = live.EventStream(sub, max_age=60)
+                response = StreamingHttpResponse(stream)
+                response.pollable_content = stream
+            else:
+                response = StreamingHttpResponse(forever())
+            start_response('200 OK', list(response.items()))
+            return response
+
+        handler = ASGIHandler(app, threads=2)
+
+        async def both():
+            return await asyncio.gather(
+                self.stream(handler, '/live/', disconnect=0.2),
+                self.stream(handler, '/forever/', disconnect=0.2))
+        loop = asyncio.new_event_loop()
+        started = time.time()
+        try:
+            loop.run_until_complete(both())
+        finally:
+            loop.close()
+        self.assertLess(time.time() - started, 5)
+        self.assertEqual(feed.watching(), {})
+        self.assertEqual(closed, [True])
+
+    def test_pollable_streams_need_no_thread(self):
+        from django.http import StreamingHttpResponse
+        q = create_question(question_text="Watched", days=-1)
+        c = create_choice_for_question(q, "Choice")
+        feed = live.ResultsFeed(autostart=False)
+        # Subscribing queries, the handler's threads can't do that here.
+        subs = [feed.subscribe(q.pk) for _ in range(20)]
+        waiting = list(subs)
+
+        def app(environ, start_response):
+            stream = live.EventStream(waiting.pop(), max_age=1)
+            response = StreamingHttpResponse(stream)
+            response.pollable_content = stream
+            start_response('200 OK', list(response.items()))
+            return response
+
+        # More open streams than threads, each waiting for the update.
+        handler = ASGIHandler(app, threads=1)
+        timer = threading.Timer(0.2, lambda: [
+            sub.push({c.pk: 1}, {c.pk: 1}) for sub in subs])
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        async def watch():
+            return await asyncio.gather(
+                *[self.stream(handler) for _ in range(20)])
+        loop = asyncio.new_event_loop()
+        started = time.time()
+        try:
+            results = loop.run_until_complete(watch())
+        finally:
+            loop.close()
+        self.assertLess(time.time() - started, 5)
+        for sent in results:
+            bodies = b''.join(m.get('body', b'') for m in sent[1:])
+            self.assertEqual(bodies.count(b'event: results'), 2)
+            self.assertFalse(sent[-1].get('more_body', False))
+        self.assertEqual(feed.watching(), {})
+
+    async def stream(self, handler, path='/', disconnect=None):
+        """Sends a GET to @param 'handler', the client disconnects after
+        @param 'disconnect' seconds. Returns the messages sent back.
+        """
+        sent = []
+        messages = [{'type': 'http.request'}]
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            if disconnect is None:
+                await asyncio.Future()
+            await asyncio.sleep(disconnect)
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        await handler({'type': 'http', 'method': 'GET', 'path': path},
+                      receive, send)
+        return sent
+
+    def test_lifespan_runs_shutdown(self):
+        stopped = []
+        handler = ASGIHandler(lambda e, s: [], threads=1,
+                              on_shutdown=lambda: stopped.append(True))
+        sent = self.call(handler, {'type': 'lifespan'}, [
+            {'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+        self.assertEqual([m['type'] for m in sent],
+                         ['lifespan.startup.complete',
+                          'lifespan.shutdown.complete'])
+        self.assertEqual(stopped, [True])
+
+    def test_django_application(self):
+        sent = self.http(ASGIHandler(threads=1), path='/polls/x/nothing/',
+                         headers=[(b'host', b'localhost')])
+        self.assertEqual(sent[0]['status'], 404)
+
+
+class ObjectCacheTest(PollsTestCase):
+
+    def setUp(self):
+        super(ObjectCacheTest, self).setUp()
+        self.q = create_question("Cached?", -1)
+        self.c = create_choice_for_question(self.q, "Yes")
+        # Not the test transaction's edits, those are invalidated again after
+        # the first request.
+        object_cache.invalidate_pending()
+
+    def shared(self, name):
+        return object_cache.stats()['shared'][name]
+
+    def test_layers(self):
+        hits, misses = self.shared('hits'), self.shared('misses')
+        with self.assertNumQueries(2):
+            question = object_cache.get_question(self.q.pk, with_choices=True)
+        self.assertEqual(question.question_text, "Cached?")
+        self.assertEqual([c.choice_text for c in question.choice_set.all()],
+                         ["Yes"])
+        with self.assertNumQueries(0):
+            object_cache.get_question(self.q.pk, with_choices=True)
+        object_cache.local.clear()
+        with self.assertNumQueries(0):
+            object_cache.get_question(self.q.pk)
+        stats = object_cache.stats()
+        self.assertEqual(stats['local']['entries'], 1)
+        self.assertGreater(stats['local']['bytes'], 0)
+        self.assertEqual(self.shared('hits') - hits, 1)
+        self.assertEqual(self.shared('misses') - misses, 2)
+        self.assertGreater(self.shared('bytes_written'), 0)
+        self.assertIsNone(object_cache.get_question(self.q.pk + 100))
+
+    def test_saves_invalidate(self):
+        self.assertEqual(object_cache.get_question(self.q.pk).question_text,
+                         "Cached?")
+        question = Question.objects.get(pk=self.q.pk)
+        question.question_text = "Edited"
+        question.save()
+        self.assertEqual(object_cache.get_question(self.q.pk).question_text,
+                         "Edited")
+        with self.assertRaises(Choice.DoesNotExist):
+            object_cache.get_choice(self.q, self.c.pk + 1)
+        other = create_choice_for_question(self.q, "No")
+        self.assertEqual(object_cache.get_choice(self.q, other.pk).choice_text,
+                         "No")
+        other.delete()
+        with self.assertRaises(Choice.DoesNotExist):
+            object_cache.get_choice(self.q, other.pk)
+
+    def test_waits_for_other_loader(self):
+        key = object_cache.KEY % (
+            'question', self.q.pk, object_cache._version(self.q.pk))
+        # Another process is loading the question right now.
+        cache.add(object_cache.LOCK_KEY % ('question', self.q.pk), 1)
+        waits = self.shared('waits')
+        row = ("From the other process", self.q.pub_date, True)
+        timer = threading.Timer(0.05, cache.set, (key, row))
+        timer.start()
+        with self.assertNumQueries(0):
+            question = object_cache.get_question(self.q.pk)
+        timer.join()
+        self.assertEqual(question.question_text, "From the other process")
+        self.assertEqual(self.shared('waits') - waits, 1)
+
+    def test_vote_uses_cache(self):
+        url = reverse('polls:vote', args=(self.q.id,))
+        self.client.post(url, {'choice': self.c.pk})
+        # The vote itself: the UPDATE and the history event.
+        with self.assertNumQueries(2):
+            response = self.client.post(url, {'choice': self.c.pk})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Choice.objects.get(pk=self.c.pk).votes, 2)
+        response = self.client.post(url, {'choice': 'x'})
+        self.assertContains(response, "You didn&#39;t select a choice.")
+        self.assertContains(response, 'value="%d"' % self.c.pk)
+
+    def test_stats_view(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+        response = self.client.get(reverse('polls:perf_objects'))
+        self.assertEqual(set(json.loads(response.content.decode())),
+                         set(['local', 'shared']))
+
+
+class ShardRoutingTest(PollsTestCase):
+
+    def setUp(self):
+        super(ShardRoutingTest, self).setUp()
+        # The router only looks the aliases up, it never connects here.
+        for alias in ('shard_a', 'shard_b'):
+            connections.databases[alias] = {}
+            self.addCleanup(connections.databases.pop, alias)
+
+    @override_settings(POLLS_SHARDS=['default', 'shard_a', 'shard_b'])
+    def test_shard_for(self):
+        self.assertEqual([sharding.shard_for(pk) for pk in (3, 4, '5')],
+                         ['default', 'shard_a', 'shard_b'])
+        self.assertEqual(sharding.by_shard([1, 2, 4]),
+                         {'shard_a': [1, 4], 'shard_b': [2]})
+
+    def test_merge(self):
+        merged = sharding.merge([[5, 3, 1], [6, 2], []], key=lambda n: n,
+                                limit=4)
+        self.assertEqual(merged, [6, 5, 3, 2])
+        # A single list keeps the database's order.
+        self.assertEqual(sharding.merge([[1, 3]], key=lambda n: n), [1, 3])
+
+    @override_settings(POLLS_SHARDS=['shard_a', 'shard_b'])
+    def test_router(self):
+        router = routers.ShardRouter()
+        self.assertEqual(router.db_for_read(Question, instance=Question(pk=3)),
+                         'shard_b')
+        self.assertEqual(router.db_for_write(
+            Choice, instance=Choice(question_id=4)), 'shard_a')
+        loaded = Question(pk=3)
+        loaded._state.db = 'shard_a'
+        self.assertEqual(router.db_for_read(Choice, instance=loaded),
+                         'shard_a')
+        self.assertIsNone(router.db_for_read(VoteEvent))
+        with sharding.question_shard(3):
+            self.assertEqual(router.db_for_write(VoteEvent), 'shard_b')
+            self.assertIsNone(router.db_for_read(User))
+        self.assertFalse(router.allow_migrate('default', 'polls', 'choice'))
+        self.assertTrue(router.allow_migrate('shard_a', 'polls', 'choice'))
+        self.assertTrue(router.allow_migrate('default', 'polls',
+                                             'shardsequence'))
+        self.assertFalse(router.allow_migrate('shard_a', 'polls',
+                                              'shardsequence'))
+        self.assertIsNone(router.allow_migrate('shard_a', 'auth', 'user'))
+
+    @override_settings(POLLS_SHARDS=[])
+    def test_router_off_without_shards(self):
+        router = routers.ShardRouter()
+        with sharding.question_shard(3):
+            self.assertIsNone(router.db_for_read(Question))
+        self.assertIsNone(router.allow_migrate('default', 'polls',
+                                               'question'))
+
+    def test_single_shard(self):
+        """One shard is the normal database with ids from the sequence."""
+        before = create_question("Before", -1)
+        with self.settings(POLLS_SHARDS=['default']):
+            q = create_question("Sharded", -1)
+            c = create_choice_for_question(q, "Yes")
+            self.assertEqual(q.pk, before.pk + 1)
+            self.assertEqual(ShardSequence.objects.get(name='question')
+                             .next_id, q.pk + 1)
+            response = self.client.post(reverse('polls:vote', args=(q.pk,)),
+                                        {'choice': c.pk})
+            self.assertEqual(response.status_code, 302)
+            self.assertContains(self.client.get(
+                reverse('polls:results', args=(q.pk,))), "1 vote")
+            self.assertEqual(list(self.client.get(reverse('polls:index'))
+                                  .context['latest_question_list']), [q])
+
+
+@unittest.skipUnless('shard2' in settings.DATABASES,
+                     "run with --settings=mysite.settings_shards")
+class ShardingTest(PollsTestCase):
+    """Three test databases, questions 3, 6, .. on 'default', 1, 4, .. on
+    'shard1' and 2, 5, .. on 'shard2'.
+    """
+    multi_db = True
+
+    def setUp(self):
+        super(ShardingTest, self).setUp()
+        self.questions = []
+        for n in range(4):
+            q = create_question("Question %d" % n, -4 + n)
+            create_choice_for_question(q, "Choice %d" % n)
+            self.questions.append(q)
+
+    def on(self, model, **lookups):
+        """The aliases of the databases holding a matching row."""
+        return [alias for alias in sharding.shards()
+                if model.objects.using(alias).filter(**lookups).exists()]
+
+    @override_settings(POLLS_PERF_SAMPLE_RATE=1.0)
+    def test_request_timing_counts_every_shard(self):
+        logger = logging.getLogger('polls.perf')
+        logger.disabled = True
+        self.addCleanup(setattr, logger, 'disabled', False)
+        captured = [CaptureQueriesContext(connections[alias])
+                    for alias in sharding.shards()]
+        for context in captured:
+            context.__enter__()
+        try:
+            response = self.client.get(reverse('polls:index'))
+        finally:
+            for context in captured:
+                context.__exit__(None, None, None)
+        queries = sum(len(context) for context in captured)
+        self.assertGreater(queries, len(captured[0]))
+        self.assertIn('desc="%d queries"' % queries,
+                      response['Server-Timing'])
+
+    def test_rows_placed_by_question(self):
+        for q in self.questions:
+            alias = sharding.shard_for(q.pk)
+            self.assertEqual(self.on(Question, pk=q.pk), [alias])
+            self.assertEqual(self.on(Choice, question_id=q.pk), [alias])
+            self.assertEqual(self.on(SearchPosting, question_id=q.pk),
+                             [alias])
+        # Choice ids don't repeat from one shard to the next.
+        choice_ids = [pk for choices in Choice.objects.on_each_shard()
+                      for pk in choices.values_list('pk', flat=True)]
+        self.assertEqual(sorted(choice_ids), [1, 2, 3, 4])
+        self.assertEqual(ShardSequence.objects.get(name='question').next_id,
+                         5)
+
+    def test_pages_merge_shards(self):
+        newest_first = list(reversed(self.questions))
+        response = self.client.get(reverse('polls:index'))
+        self.assertEqual([q.pk for q in
+                          response.context['latest_question_list']],
+                         [q.pk for q in newest_first])
+        with self.settings(POLLS_ARCHIVE_PAGE_SIZE=3):
+            response = self.client.get(reverse('polls:archive'))
+            page = [q.pk for q in response.context['question_list']]
+            response = self.client.get(reverse(
+                'polls:archive', args=(response.context['next_cursor'],)))
+            page += [q.pk for q in response.context['question_list']]
+        self.assertEqual(page, [q.pk for q in newest_first])
+        data = json.loads(self.client.get(
+            reverse('polls:api_questions')).content.decode())
+        self.assertEqual([q['id'] for q in data['questions']],
+                         [q.pk for q in newest_first])
+        self.assertEqual(search.search('choice')[0], newest_first)
+
+    def test_vote_on_shard(self):
+        q = self.questions[1]
+        choice = q.choice_set.get()
+        self.client.post(reverse('polls:vote', args=(q.pk,)),
+                         {'choice': choice.pk})
+        self.assertEqual(Choice.objects.using(sharding.shard_for(q.pk)).get(
+            pk=choice.pk).votes, 1)
+        self.assertContains(self.client.get(
+            reverse('polls:results', args=(q.pk,))), "1 vote")
+
+    def test_admin_edits_on_shard(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+        q = self.questions[2]
+        alias = sharding.shard_for(q.pk)
+        response = self.client.get(reverse('admin:polls_question_changelist'),
+                                   {'shard': alias})
+        self.assertEqual(list(response.context['cl'].result_list), [q])
+        url = reverse('admin:polls_question_change', args=(q.pk,))
+        choice = q.choice_set.get()
+        response = self.client.post(url, {
+            'question_text': "Renamed",
+            'pub_date_0': q.pub_date.strftime('%Y-%m-%d'),
+            'pub_date_1': q.pub_date.strftime('%H:%M:%S'),
+            'choice_set-TOTAL_FORMS': 2,
+            'choice_set-INITIAL_FORMS': 1,
+            'choice_set-MIN_NUM_FORMS': 0,
+            'choice_set-MAX_NUM_FORMS': 1000,
+            'choice_set-0-id': choice.pk,
+            'choice_set-0-question': q.pk,
+            'choice_set-0-choice_text': choice.choice_text,
+            'choice_set-0-votes': 0,
+            'choice_set-1-question': q.pk,
+            'choice_set-1-choice_text': "Added",
+            'choice_set-1-votes': 0,
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Question.objects.using(alias).get(pk=q.pk)
+                         .question_text, "Renamed")
+        added = Choice.objects.using(alias).get(choice_text="Added")
+        self.assertGreater(added.pk, choice.pk)
+
+    def test_rebalance(self):
+        # Question 6 belongs on 'default', left on 'shard1' as if the
+        # shards had just been changed.
+        q = Question.objects.using('shard1').create(
+            id=6, question_text="Moved", has_choices=True,
+            pub_date=timezone.now() - datetime.timedelta(hours=1))
+        c = Choice.objects.using('shard1').create(id=60, question=q,
+                                                  choice_text="Along")
+        VoteEvent.objects.using('shard1').create(choice=c,
+                                                 created=timezone.now())
+        out = StringIO()
+        call_command('rebalance_shards', stdout=out)
+        self.assertIn('shard1 -> default: 1 questions', out.getvalue())
+        self.assertEqual(self.on(Question, pk=6), ['default'])
+        self.assertEqual(self.on(Choice, pk=60), ['default'])
+        self.assertEqual(self.on(VoteEvent, choice_id=60), ['default'])
+        response = self.client.get(reverse('polls:detail', args=(6,)))
+        self.assertContains(response, "Along")
+        # Nothing left to move.
+        call_command('rebalance_shards', stdout=out)
+        self.assertIn('0 questions moved', out.getvalue())
@@ -0,0 +1,334 @@
+"""Turning away repeated votes and vote floods before they reach the
+database.
+
+Two checks run at the top of polls.views.vote(), before any query:
+
+Rate limit. Every IP address may POST at most POLLS_VOTE_RATE votes per
+POLLS_VOTE_RATE_WINDOW seconds, over all questions. The counts live in the
+cache (shared by the workers when the cache is memcached) as a sliding window
+counter: a count for the current window and one for the previous window,
+which is weighted by how much of it still overlaps the last
+POLLS_VOTE_RATE_WINDOW seconds. A worker remembers the addresses it blocked
+in a small LRU dict so a bot hammering away costs no cache round trips until
+its block runs out. Over the limit the view answers 429.
+
+One vote per voter and question. A voter is the logged in user, else the
+session, else the IP address. Keeping every (voter, question) pair ever seen
+would grow without end, instead they go into a Bloom filter: a bit array
+where each pair sets a few bits picked by hashing it. A pair whose bits are
+all set has been seen before, or, rarely, (POLLS_VOTE_DEDUP_ERROR of the time
+once POLLS_VOTE_DEDUP_CAPACITY pairs were added) it was never seen and all
+its bits happen to be set by others, in which case that voter is wrongly
+turned away. The size is fixed by the capacity and error rate, about 1.7 MB
+per million pairs at 0.1%. A new filter starts every POLLS_VOTE_DEDUP_WINDOW
+seconds and the one before it is still checked, so a vote is remembered for
+between one and two windows. Each worker keeps the filters in memory and
+every POLLS_VOTE_DEDUP_SYNC seconds ORs its bits together with the copy in
+the cache, so a double vote going to another worker is caught once they
+synced. Only the 64 KB blocks that changed since the last sync are sent
+either way, and vote checks don't wait for the cache while a sync runs. A duplicate vote is sent to the results page without being counted.
+
+`python manage.py bench_throttle` prints the memory and checks per second.
+"""
+
+import collections
+import hashlib
+import math
+import struct
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+RATE_KEY = 'polls:rate:%s:%d'
+BLOOM_KEY = 'polls:seen:%d:%d'
+BLOOM_VERSION_KEY = 'polls:seen:%d:%d:v'
+# Filters go to the cache in blocks of this many bytes, memcached refuses
+# values over 1 MB.
+BLOCK_SIZE = 64 * 1024
+
+
+def bloom_size(capacity, error):
+    """Bits and hashes for a Bloom filter holding @param 'capacity' items
+    with a false positive rate of @param 'error'.
+    """
+    bits = int(math.ceil(-capacity * math.log(error) / math.log(2) ** 2))
+    hashes = max(1, int(round(bits / float(capacity) * math.log(2))))
+    return bits, hashes
+
+
+class BloomFilter(object):
+
+    def __init__(self, bits, hashes):
+        self.bits = bits
+        self.hashes = hashes
+        self.array = bytearray((bits + 7) // 8)
+
+    def positions(self, item):
+        # Two hashes out of one digest, combined into as many as needed
+        # (Kirsch and Mitzenmacher's double hashing).
+        h1, h2 = struct.unpack(
+            '<QQ', hashlib.md5(item.encode('utf-8')).digest())
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, item):
+        """Sets the bits of @param 'item', returns the byte offsets that
+        changed.
+        """
+        changed = []
+        for pos in self.positions(item):
+            byte, bit = pos >> 3, 1 << (pos & 7)
+            if not self.array[byte] & bit:
+                self.array[byte] |= bit
+                changed.append(byte)
+        return changed
+
+    def __contains__(self, item):
+        array = self.array
+        return all(array[pos >> 3] & (1 << (pos & 7))
+                   for pos in self.positions(item))
+
+    def merge(self, start, data):
+        """ORs the bytes @param 'data' into the array from byte @param
+        'start', returns the merged bytes.
+        """
+        end = start + len(data)
+        merged = (int.from_bytes(self.array[start:end], 'little') |
+                  int.from_bytes(data, 'little'))
+        self.array[start:end] = merged.to_bytes(len(data), 'little')
+        return bytes(self.array[start:end])
+
+
+class RotatingBloomFilter(object):
+    """The vote dedup filters, see the module docstring."""
+
+    def __init__(self, capacity, error, window, sync_interval):
+        self.bits, self.hashes = bloom_size(capacity, error)
+        self.window = window
+        self.sync_interval = sync_interval
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.filters = {}
+            self.dirty = set()
+            # (generation, block) to the cached version last merged.
+            self.versions = {}
+            self.synced = 0
+
+    def memory(self):
+        """Bytes used by the filters of this worker."""
+        return sum(len(f.array) for f in self.filters.values())
+
+    def generation(self, now):
+        return int(now // self.window)
+
+    def _filter(self, generation):
+        f = self.filters.get(generation)
+        if f is None:
+            f = self.filters[generation] = BloomFilter(self.bits, self.hashes)
+            for old in [g for g in self.filters if g < generation - 1]:
+                del self.filters[old]
+                self.dirty = set(b for b in self.dirty if b[0] != old)
+                self.versions = dict((b, v) for b, v in self.versions.items()
+                                     if b[0] != old)
+        return f
+
+    def __contains__(self, item):
+        now = time.time()
+        current = self.generation(now)
+        self._maybe_sync(now, current)
+        with self.lock:
+            return any(item in f for g, f in self.filters.items()
+                       if g >= current - 1)
+
+    def add(self, item):
+        now = time.time()
+        current = self.generation(now)
+        with self.lock:
+            for byte in self._filter(current).add(item):
+                self.dirty.add((current, byte // BLOCK_SIZE))
+        self._maybe_sync(now, current)
+
+    def sync(self):
+        now = time.time()
+        with self.lock:
+            self.synced = now
+        self._sync(self.generation(now))
+
+    def _maybe_sync(self, now, current):
+        with self.lock:
+            if now - self.synced < self.sync_interval:
+                return
+            # Claimed, other threads of this worker keep checking meanwhile.
+            self.synced = now
+        self._sync(current)
+
+    def _sync(self, current):
+        """ORs the blocks of the current and previous filter that changed in
+        the cache into ours, writes back the blocks this worker changed.
+        Every block has a version counter next to it in the cache, so a sync
+        with nothing new costs one small get_many. The lock is only held
+        between the round trips.
+        """
+        with self.lock:
+            filters = {current: self._filter(current)}
+            if current - 1 in self.filters:
+                filters[current - 1] = self.filters[current - 1]
+            dirty = set(b for b in self.dirty if b[0] in filters)
+            self.dirty -= dirty
+            known = dict(self.versions)
+        try:
+            self._exchange(filters, dirty, known)
+        except Exception:
+            # Written next time.
+            with self.lock:
+                self.dirty |= set(b for b in dirty if b[0] in self.filters)
+            raise
+
+    def _exchange(self, filters, dirty, known):
+        blocks = [(generation, block) for generation, f in filters.items()
+                  for block in range((len(f.array) + BLOCK_SIZE - 1) //
+                                     BLOCK_SIZE)]
+        versions = cache.get_many([BLOOM_VERSION_KEY % b for b in blocks])
+        changed = dict((b, versions[BLOOM_VERSION_KEY % b]) for b in blocks
+                       if BLOOM_VERSION_KEY % b in versions and
+                       versions[BLOOM_VERSION_KEY % b] != known.get(b))
+        fetch = set(changed) | dirty
+        cached = cache.get_many([BLOOM_KEY % b for b in fetch]) \
+            if fetch else {}
+        updates = {}
+        with self.lock:
+            for generation, block in fetch:
+                f = filters[generation]
+                data = cached.get(BLOOM_KEY % (generation, block))
+                if data is not None:
+                    merged = f.merge(block * BLOCK_SIZE, data)
+                else:
+                    merged = bytes(f.array[block * BLOCK_SIZE:
+                                           (block + 1) * BLOCK_SIZE])
+                if (generation, block) in dirty:
+                    updates[generation, block] = merged
+                elif data is not None:
+                    self.versions[generation, block] = changed[
+                        generation, block]
+        if not updates:
+            return
+        cache.set_many(dict((BLOOM_KEY % b, data)
+                            for b, data in updates.items()), self.window * 2)
+        for b in updates:
+            key = BLOOM_VERSION_KEY % b
+            cache.add(key, 0, self.window * 2)
+            try:
+                version = cache.incr(key)
+            except ValueError:
+                continue
+            # Only skip the block next time if nobody else wrote it since
+            # the version we read.
+            if version == versions.get(key, 0) + 1:
+                with self.lock:
+                    self.versions[b] = version
+
+
+seen_votes = RotatingBloomFilter(
+    getattr(settings, 'POLLS_VOTE_DEDUP_CAPACITY', 100000),
+    getattr(settings, 'POLLS_VOTE_DEDUP_ERROR', 0.001),
+    getattr(settings, 'POLLS_VOTE_DEDUP_WINDOW', 86400),
+    getattr(settings, 'POLLS_VOTE_DEDUP_SYNC', 2))
+
+
+class RateLimiter(object):
+    """Sliding window counters in the cache, see the module docstring."""
+
+    def __init__(self, max_blocked=10000):
+        self.max_blocked = max_blocked
+        self.blocked = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.blocked.clear()
+
+    def hit(self, key, rate, window, now=None):
+        """Counts a vote by @param 'key'. Returns 0 when it is allowed, else
+        the seconds to wait.
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            until = self.blocked.get(key)
+            if until is not None:
+                if until > now:
+                    self.blocked.move_to_end(key)
+                    return until - now
+                del self.blocked[key]
+        slot = int(now // window)
+        current = RATE_KEY % (key, slot)
+        cache.add(current, 0, window * 2)
+        try:
+            count = cache.incr(current)
+        except ValueError:
+            # Evicted between add() and incr().
+            count = 1
+            cache.set(current, count, window * 2)
+        previous = cache.get(RATE_KEY % (key, slot - 1), 0)
+        overlap = 1 - (now - slot * window) / float(window)
+        if previous * overlap + count <= rate:
+            return 0
+        until = (slot + 1) * window
+        with self.lock:
+            self.blocked[key] = until
+            if len(self.blocked) > self.max_blocked:
+                self.blocked.popitem(last=False)
+        return until - now
+
+
+rate_limiter = RateLimiter()
+
+
+def client_ip(request):
+    header = getattr(settings, 'POLLS_VOTER_IP_HEADER', None)
+    if header and request.META.get(header):
+        # X-Forwarded-For holds "client, proxy1, proxy2".
+        return request.META[header].split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def voter(request):
+    """Who is voting: the user, the session or the IP address."""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated():
+        return 'u:%s' % user.pk
+    session = getattr(request, 'session', None)
+    if session is not None and session.session_key:
+        return 's:%s' % session.session_key
+    return 'ip:%s' % client_ip(request)
+
+
+def rate_limited(request):
+    """Seconds the client of @param 'request' has to wait before voting
+    again, 0 if it may vote now.
+    """
+    rate = getattr(settings, 'POLLS_VOTE_RATE', None)
+    if not rate:
+        return 0
+    return rate_limiter.hit(client_ip(request), rate,
+                            getattr(settings, 'POLLS_VOTE_RATE_WINDOW', 60))
+
+
+def dedup_enabled():
+    return getattr(settings, 'POLLS_VOTE_DEDUP', False)
+
+
+def already_voted(request, question_id):
+    """@param 'question_id' is the int pk, the key must not depend on how
+    the URL spelled it.
+    """
+    return dedup_enabled() and \
+        '%s:%d' % (voter(request), question_id) in seen_votes
+
+
+def remember_vote(request, question_id):
+    if dedup_enabled():
+        seen_votes.add('%s:%d' % (voter(request), question_id))
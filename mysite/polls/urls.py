@@ -4,7 +4,7 @@ is this file, and polls/views.
 """
 
 from django.conf.urls import url
-from . import views
+from . import api, views
 
 # url() is passed two args, one being the regular expression and the second is
 # the view. there are also optional key word arguments that can be used.
@@ -37,14 +37,49 @@ from . import views
 # name - is for url reverse calling... not sure what this means. From the docs
 # it states that if is to call refer to the url from anywhere in Django in a
 # clear manner.
-urlpatterns = [
+#
+# public_urlpatterns are the pages anybody can see, mysite/urls_public.py
+# serves only those.
+public_urlpatterns = [
     # Ex. /polls/
     url(r'^$', views.IndexView.as_view(), name='index'),
+    # Ex. /polls/archive/ and /polls/archive/MTQzODM1.../ for the next pages
+    url(r'^archive/$', views.ArchiveView.as_view(), name='archive'),
+    url(r'^archive/(?P<cursor>[0-9A-Za-z_\-]+)/$', views.ArchiveView.as_view(),
+        name='archive'),
+    # Ex. /polls/search/?q=favourite+colour&page=2
+    url(r'^search/$', views.SearchView.as_view(), name='search'),
     # Ex. /polls/5/
     url(r'^(?P<pk>[0-9]+)/$', views.DetailView.as_view(), name='detail'),
     # Ex. /polls/5/results/
     url(r'^(?P<pk>[0-9]+)/results/$', views.ResultsView.as_view(),
         name='results'),
+    # Ex. /polls/5/results/stream/ (server-sent events)
+    url(r'^(?P<pk>[0-9]+)/results/stream/$', views.results_stream,
+        name='stream'),
     # Ex. /polls/5/vote
     url(r'^(?P<question_id>[0-9]+)/vote/$', views.vote, name='vote'),
+    # The JSON API, see polls/api.py.
+    # Ex. /polls/api/questions/
+    url(r'^api/questions/$', api.question_list, name='api_questions'),
+    # Ex. /polls/api/questions/5/
+    url(r'^api/questions/(?P<pk>[0-9]+)/$', api.question_detail,
+        name='api_question'),
+    # Ex. /polls/api/questions/5/results/
+    url(r'^api/questions/(?P<pk>[0-9]+)/results/$', api.question_results,
+        name='api_results'),
+    # Ex. /polls/api/questions/5/trend/?period=minute
+    url(r'^api/questions/(?P<pk>[0-9]+)/trend/$', api.question_trend,
+        name='api_trend'),
+]
+
+urlpatterns = public_urlpatterns + [
+    # Ex. /polls/export.csv?since=2015-07-01 (staff only)
+    url(r'^export\.(?P<format>csv|ndjson)$', views.export, name='export'),
+    # Ex. /polls/perf/ (staff only)
+    url(r'^perf/$', views.perf_stats, name='perf'),
+    # Ex. /polls/perf/pools/ (staff only)
+    url(r'^perf/pools/$', views.pool_stats, name='perf_pools'),
+    # Ex. /polls/perf/objects/ (staff only)
+    url(r'^perf/objects/$', views.object_cache_stats, name='perf_objects'),
 ]
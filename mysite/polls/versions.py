@@ -0,0 +1,99 @@
+"""When each question last changed, for conditional GETs in polls/api.py.
+
+The time of the last change (a vote, or a question or choice being edited) is
+kept per question in Django's cache and never touches the database, so
+checking whether a client's copy is still current costs one cache lookup.
+The receivers in polls/signals.py call touch().
+
+Like object_cache.invalidate(), a change made inside a transaction (the
+admin saves in one) is touched once more when its request is over. Until the
+commit other requests still read the old rows, and would otherwise send them
+with the new ETag.
+"""
+
+import datetime
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+
+KEY = 'polls:changed:%s'
+
+_pending = threading.local()
+
+
+def touch(*question_ids):
+    """Record that the given questions changed just now."""
+    if connection.in_atomic_block:
+        pending = getattr(_pending, 'ids', None)
+        if pending is None:
+            pending = _pending.ids = set()
+        pending.update(question_ids)
+    _stamp(question_ids)
+
+
+def _stamp(question_ids):
+    now = time.time()
+    # A timeout of None keeps the entries until the cache evicts them.
+    cache.set_many(dict((KEY % pk, now) for pk in question_ids), None)
+
+
+def touch_pending(**kwargs):
+    """Receiver of request_finished, see touch()."""
+    pending = getattr(_pending, 'ids', None)
+    if pending:
+        _pending.ids = None
+        _stamp(pending)
+
+
+def last_changed(question_id):
+    """Timestamp of the last change to @param 'question_id'. If the cache
+    lost it, now is the safe answer: clients fetch the question once more.
+    """
+    key = KEY % question_id
+    changed = cache.get(key)
+    if changed is None:
+        # Not touch()'s timeout, any id can be asked for and the made up
+        # stamps of ids that don't exist must not pile up.
+        cache.add(key, time.time())
+        changed = cache.get(key) or time.time()
+    return changed
+
+
+def last_changed_many(question_ids):
+    """{question_id: timestamp} for several questions in one cache round
+    trip. Questions the cache lost are left out.
+    """
+    found = cache.get_many([KEY % pk for pk in question_ids])
+    return dict((pk, found[KEY % pk]) for pk in question_ids
+                if KEY % pk in found)
+
+
+def etag(question_id, changed=None):
+    if changed is None:
+        changed = last_changed(question_id)
+    return '%s-%r' % (question_id, changed)
+
+
+def etags(question_ids):
+    """etag() of each of @param 'question_ids', in one cache round trip
+    unless the cache lost some of them.
+    """
+    found = last_changed_many(question_ids)
+    return [etag(pk, found.get(pk)) for pk in question_ids]
+
+
+def last_modified(question_id):
+    """The last change as a datetime for the Last-Modified header, or None
+    while the second it happened in is not over yet.
+
+    HTTP dates only have whole seconds. A change later in the same second
+    would give the same Last-Modified and the client's If-Modified-Since
+    would get a 304 for the old data, so such a response only has the ETag.
+    """
+    changed = int(last_changed(question_id))
+    if changed >= int(time.time()):
+        return None
+    return datetime.datetime.fromtimestamp(changed, timezone.utc)
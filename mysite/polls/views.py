@@ -1,11 +1,21 @@
-from django.http import Http404
+import math
+
+from django.conf import settings
+from django.contrib.auth.decorators import user_passes_test
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render
-from django.http import HttpResponseRedirect, HttpResponse
+from django.http import (HttpResponseRedirect, HttpResponse,
+                         HttpResponseBadRequest)
 from django.core.urlresolvers import reverse
 from django.views import generic
-from django.utils import timezone
+
+from mysite.db import pool
 
 from .models import Question, Choice
+from . import (live, object_cache, perf, results_cache, schedule, search,
+               throttle, votes)
+from .export import FORMATS, export_rows, parse_when
+from .pagination import InvalidCursor, decode_cursor, keyset_page
 
 # Views are really the controller in the MVC model. Therefore these can read
 # database records, use Django templates, generate PDF, zip or even an XML
@@ -14,6 +24,36 @@ from .models import Question, Choice
 
 # NOTE 9 explains how these classes are created without me doing anything....
 
+# Same as django.contrib.admin.views.decorators.staff_member_required, but
+# importing that loads the whole admin, which the slim public workers
+# (mysite/settings_public.py) don't have.
+staff_member_required = user_passes_test(
+    lambda u: u.is_active and u.is_staff, login_url='admin:login')
+
+
+def get_question_or_404(question_id, published=False, with_choices=False):
+    """get_object_or_404(Question, pk=question_id), but from the object cache
+    (polls/object_cache.py). With @param 'published' only if
+    Question.objects.published() would have found it, @param 'with_choices'
+    is passed on to object_cache.get_question().
+    """
+    question = object_cache.get_question(question_id, with_choices)
+    if question is None or (published and not question.is_published()):
+        raise Http404("No question matches the given query.")
+    return question
+
+
+class PublishedQuestionMixin(object):
+    """Makes a DetailView take its published question from the object
+    cache.
+    """
+    model = Question
+    with_choices = False
+
+    def get_object(self, queryset=None):
+        return get_question_or_404(self.kwargs['pk'], published=True,
+                                   with_choices=self.with_choices)
+
 
 class IndexView(generic.ListView):
     model = Question
@@ -23,52 +63,128 @@ class IndexView(generic.ListView):
     def get_queryset(self):
         """Return the last five published questions. Not including those
         published in the future."""
-        # Question.objects.filter() returns a queryset containing Questions
-        # whose published date is less than or equal to (earlier) timezone.now
-        choice_question_id_list = [x.question.id for x in Choice.objects.all()]
-        # NOTE 11.
-        return Question.objects.filter(
-                    pub_date__lte=timezone.now()
-                ).filter(
-                    pk__in=choice_question_id_list
-                ).order_by(
-                    '-pub_date')[:5]
-
-
-class DetailView(generic.DetailView):
-    model = Question
-    template_name = 'polls/detail.html'
+        # Same questions as Question.objects.published(), whose published
+        # date is less than or equal to (earlier) timezone.now and that have
+        # at least one Choice (NOTE 11 and NOTE 13), but taken from the list
+        # polls/schedule.py keeps in the cache. NOTE 24.
+        return schedule.latest(5)
+
+
+class ArchiveView(generic.ListView):
+    """Every published question, newest first, one page at a time. The pages
+    are linked by cursors instead of page numbers, see polls/pagination.py.
+    """
+    template_name = 'polls/archive.html'
+    context_object_name = 'question_list'
 
     def get_queryset(self):
-        # x is the Choice object which has an question.id that relates it to
-        # the Question database. Builds a list of only those numbers.
-        choice_question_id_list = [x.question.id for x in Choice.objects.all()]
-        return Question.objects.filter(
-                    pub_date__lte=timezone.now()
-                ).filter(
-                    pk__in=choice_question_id_list)
+        size = getattr(settings, 'POLLS_ARCHIVE_PAGE_SIZE', 20)
+        position = until = None
+        if self.kwargs.get('cursor'):
+            try:
+                position = decode_cursor(self.kwargs['cursor'])
+            except InvalidCursor:
+                raise Http404("Unknown page")
+            until = position[0]
+        questions, self.next_cursor = keyset_page(
+            Question.objects.published(until=until), position, size)
+        return questions
 
+    def get_context_data(self, **kwargs):
+        context = super(ArchiveView, self).get_context_data(**kwargs)
+        context['next_cursor'] = self.next_cursor
+        return context
 
-class ResultsView(generic.DetailView):
-    model = Question
-    template_name = 'polls/results.html'
+
+class SearchView(generic.ListView):
+    """Published questions with all the words of ?q= in them or in their
+    choices, best match first, see polls/search.py. Pages are numbered
+    (?page=2), ranked results can't be walked with a cursor, and stop after
+    POLLS_SEARCH_MAX_PAGES since every page has to skip all the ones before.
+    """
+    template_name = 'polls/search.html'
+    context_object_name = 'question_list'
 
     def get_queryset(self):
-        choice_question_id_list = [x.question.id for x in Choice.objects.all()]
-        return Question.objects.filter(
-                    pub_date__lte=timezone.now()
-                ).filter(
-                    pk__in=choice_question_id_list)
+        size = getattr(settings, 'POLLS_SEARCH_PAGE_SIZE', 20)
+        self.query = self.request.GET.get('q', '').strip()
+        try:
+            self.page = int(self.request.GET.get('page', 1))
+        except ValueError:
+            raise Http404("Unknown page")
+        if not 1 <= self.page <= getattr(settings, 'POLLS_SEARCH_MAX_PAGES',
+                                         50):
+            raise Http404("Unknown page")
+        questions, self.has_next = search.search(self.query, self.page, size)
+        return questions
+
+    def get_context_data(self, **kwargs):
+        context = super(SearchView, self).get_context_data(**kwargs)
+        context.update({
+            'query': self.query,
+            'page': self.page,
+            'next_page': self.page + 1 if self.has_next else None,
+        })
+        return context
+
+
+class DetailView(PublishedQuestionMixin, generic.DetailView):
+    # The question comes from the object cache, with the has_choices column
+    # instead of building a list of every Choice.question.id, see
+    # polls/models.py. So do the choices detail.html loops over, when its
+    # cached fragment has to be rendered again.
+    template_name = 'polls/detail.html'
+    with_choices = True
+
+
+class ResultsView(PublishedQuestionMixin, generic.DetailView):
+    template_name = 'polls/results.html'
+
+    def get_context_data(self, **kwargs):
+        context = super(ResultsView, self).get_context_data(**kwargs)
+        # The tally comes from the cache when it can, see
+        # polls/results_cache.py.
+        context['choice_list'] = results_cache.get_results(self.object)
+        return context
+
+
+def results_stream(request, pk):
+    """Server-sent events with the vote counts of a question, pushed as they
+    change. See polls/live.py.
+    """
+    question = get_object_or_404(
+        Question.objects.published().for_question(pk), pk=pk)
+    stream = live.EventStream(live.feed.subscribe(question.pk))
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    # Lets mysite/asgi_handler.py serve it from the event loop.
+    response.pollable_content = stream
+    response['Cache-Control'] = 'no-cache'
+    # Stops nginx from holding the events back in its buffer.
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 def vote(request, question_id):
-    q = get_object_or_404(Question, pk=question_id)
-    # get Question off PRIMARY KEY
+    # Floods and repeated votes are turned away before any query is made, see
+    # polls/throttle.py. A repeated vote just shows the results.
+    wait = throttle.rate_limited(request)
+    if wait:
+        response = HttpResponse("Too many votes, try again later.",
+                                status=429)
+        response['Retry-After'] = int(math.ceil(wait))
+        return response
+    # The same number as q.id below, /polls/01/vote/ is still question 1.
+    if throttle.already_voted(request, int(question_id)):
+        return HttpResponseRedirect(reverse('polls:results',
+                                            args=(question_id,)))
+    q = get_question_or_404(question_id, with_choices=True)
+    # get Question off PRIMARY KEY, through the object cache like the choice
+    # below. A vote then only writes, see polls/object_cache.py.
     #
     # request.POST is a dictionary-like object which gives me access to the
     # submitted date by referring to it by the name given.
     try:
-        selected_choice = q.choice_set.get(pk=request.POST['choice'])
+        selected_choice = object_cache.get_choice(q, request.POST['choice'])
     except (KeyError, Choice.DoesNotExist):
         # Redisplay the question voting form.
         dict_vars = {
@@ -77,8 +193,10 @@ def vote(request, question_id):
         }
         return render(request, 'polls/detail.html', dict_vars)
     else:
-        selected_choice.votes += 1
-        selected_choice.save()
+        # The increment happens inside the database (votes = votes + 1) so
+        # concurrent votes are never lost. See polls/votes.py.
+        votes.record_vote(selected_choice)
+        throttle.remember_vote(request, q.pk)
         # Always return a HttpResponseRedirect after successfully dealing with
         # POST data. NOTE 7. This prevents data from being posted twice if a
         # user hits the Back button.
@@ -95,6 +213,51 @@ def vote(request, question_id):
         # path instead.
         return HttpResponseRedirect(reverse('polls:results', args=(q.id,)))
 
+
+@staff_member_required
+def export(request, format):
+    """Streams every question, choice and vote count as CSV or NDJSON. The
+    optional ?since= and ?until= take ISO 8601 dates to filter on pub_date.
+    """
+    try:
+        bounds = [parse_when(request.GET[name]) if request.GET.get(name)
+                  else None for name in ('since', 'until')]
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    render_rows, content_type = FORMATS[format]
+    # StreamingHttpResponse sends each line as the generator produces it
+    # instead of building the whole file in memory first.
+    response = StreamingHttpResponse(render_rows(export_rows(*bounds)),
+                                     content_type=content_type)
+    response['Content-Disposition'] = (
+        'attachment; filename="polls.%s"' % format)
+    return response
+
+
+@staff_member_required
+def perf_stats(request):
+    """The request timings PerformanceMiddleware (polls/middleware.py)
+    collected in this worker, per view.
+    """
+    return JsonResponse(perf.snapshot())
+
+
+@staff_member_required
+def pool_stats(request):
+    """The counters of this worker's database connection pools, empty when
+    the database isn't using a pooled backend (mysite/db/pool.py).
+    """
+    return JsonResponse(pool.stats())
+
+
+@staff_member_required
+def object_cache_stats(request):
+    """Hit ratio and size of both layers of the object cache
+    (polls/object_cache.py) in this worker.
+    """
+    return JsonResponse(object_cache.stats())
+
+
 # These are the functions that get called by ulr() when it matches the regular
 # expression that is given as the first argument.
 # The request argument I think has to be there and then the other arguments
@@ -128,10 +291,12 @@ def detail(request, question_id):
     Raises a Http404() if the Question objects could not found in the
     database based off the given question_id
     """
-    question = get_object_or_404(Question, pk=question_id)
+    question = get_question_or_404(question_id, with_choices=True)
     return render(request, 'polls/detail.html', {'question': question})
 
 
 def results(request, question_id):
-    question = get_object_or_404(Question, pk=question_id)
-    return render(request, 'polls/results.html', {'question': question})
+    question = get_question_or_404(question_id)
+    choice_list = results_cache.get_results(question)
+    return render(request, 'polls/results.html',
+                  {'question': question, 'choice_list': choice_list})
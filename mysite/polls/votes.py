@@ -0,0 +1,299 @@
+"""The vote recording engine used by polls.views.vote.
+
+A vote is always applied inside the database as ``votes = votes + 1`` so two
+requests voting at the same time can never overwrite each other's count (the
+old ``choice.votes += 1; choice.save()`` read the row, added one in Python and
+wrote every column back, losing votes under load).
+
+For very hot polls the increments can also be spread over several
+ChoiceVoteShard rows by setting POLLS_VOTE_SHARDS in settings.py to the number
+of shards. Reads then add the shards back together with tally(). (Those are
+counter rows within one database. polls/sharding.py spreads whole questions
+over several databases, each vote is written to its question's one.)
+
+Buffered (write-behind) mode
+----------------------------
+Setting POLLS_VOTE_BUFFER = True makes record_vote() only add the vote to an
+in-process counter keyed by Choice.id. A background thread writes all of the
+pending counts with a single ``UPDATE ... SET votes = votes + CASE ... END``
+every POLLS_VOTE_FLUSH_INTERVAL milliseconds, or sooner once
+POLLS_VOTE_FLUSH_SIZE votes are waiting. This turns thousands of writes a
+second into a few.
+
+The durability tradeoff: a vote is only in the database once it has been
+flushed. The pending counts are written out when the process shuts down
+normally (atexit, and SIGTERM through install_shutdown_flush() which
+mysite/wsgi.py calls), but if a worker is killed with SIGKILL, runs out of
+memory or the machine dies, up to one flush interval worth of votes from that
+worker is lost. Voters also won't see their own vote on the results page until
+the next flush. Leave the buffer off where every vote must be stored before
+the response goes out. With the polls sharded a flush writes one UPDATE per
+shard.
+"""
+
+import atexit
+import logging
+import os
+import random
+import signal
+import threading
+
+from django.conf import settings
+from django.db import (IntegrityError, close_old_connections, router,
+                       transaction)
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.dispatch import Signal
+
+from .models import Choice, ChoiceVoteShard
+from . import sharding
+
+
+def vote_shards():
+    """Number of counter shards per choice, 0 or 1 means no sharding."""
+    return getattr(settings, 'POLLS_VOTE_SHARDS', 0)
+
+
+logger = logging.getLogger(__name__)
+
+# Sent every time votes have been written to the database. @param
+# 'increments' maps Choice.id to the number of votes added and
+# 'question_ids' lists the questions involved, or is None when the sender
+# does not know them (a buffer flush).
+votes_recorded = Signal(providing_args=['increments', 'question_ids'])
+
+
+class VoteBuffer(object):
+    """Process local accumulator of votes waiting to be written, see the
+    module docstring for when to use it.
+    """
+
+    def __init__(self, interval=0.5, max_pending=1000):
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending = {}
+        # Choice id to question id, which tells the shard of a choice.
+        self._questions = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def add(self, choice_id, n=1, question_id=None):
+        with self._lock:
+            self._pending[choice_id] = self._pending.get(choice_id, 0) + n
+            if question_id is not None:
+                self._questions[choice_id] = question_id
+            self._count += n
+            full = self._count >= self.max_pending
+        if full:
+            self._wake.set()
+
+    def pending(self):
+        """Copy of the counts that have not been written yet."""
+        with self._lock:
+            return dict(self._pending)
+
+    def flush(self):
+        """Write every pending count to the database in one statement and
+        return the number of votes written.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            questions, self._questions = self._questions, {}
+            self._count = 0
+        if not pending:
+            return 0
+        groups = list(self._by_shard(pending, questions).items())
+        written = 0
+        for position, (alias, increments) in enumerate(groups):
+            try:
+                with sharding.use_shard(alias):
+                    apply_increments(increments)
+            except Exception:
+                # Put the counts back so the next flush tries again.
+                unwritten = {}
+                for _, later in groups[position:]:
+                    unwritten.update(later)
+                logger.exception('Flushing %d buffered votes failed',
+                                 sum(unwritten.values()))
+                with self._lock:
+                    for choice_id, n in unwritten.items():
+                        self._pending[choice_id] = (
+                            self._pending.get(choice_id, 0) + n)
+                        self._count += n
+                        if choice_id in questions:
+                            self._questions[choice_id] = questions[choice_id]
+                raise
+            with sharding.use_shard(alias):
+                votes_recorded.send(sender=Choice, increments=increments,
+                                    question_ids=None)
+            written += sum(increments.values())
+        return written
+
+    def _by_shard(self, pending, questions):
+        """@param 'pending' split up by shard. Without sharding, or for
+        choices added without their question, under None: the database the
+        router picks.
+        """
+        groups = {}
+        for choice_id, n in pending.items():
+            question_id = questions.get(choice_id)
+            alias = None
+            if sharding.enabled() and question_id is not None:
+                alias = sharding.shard_for(question_id)
+            groups.setdefault(alias, {})[choice_id] = n
+        return groups
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run,
+                                            name='polls-vote-buffer')
+            self._thread.daemon = True
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the background thread and write what is left."""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None and \
+                self._thread is not threading.current_thread():
+            self._thread.join(self.interval * 4)
+        self.flush()
+
+    def stop_from_signal(self):
+        """stop() for a signal handler. The handler interrupts the main
+        thread, possibly inside add() with the lock held, so it must not
+        flush itself. The last flush runs on another thread and this only
+        waits a while for it.
+        """
+        self._stopped.set()
+        self._wake.set()
+        thread = self._thread
+        if thread is None:
+            thread = self._thread = threading.Thread(
+                target=self._run, name='polls-vote-buffer')
+            thread.daemon = True
+            thread.start()
+        thread.join(self.interval * 4)
+
+    def _run(self):
+        # Once stopped, the loop still goes around one last time to write
+        # what is left.
+        done = False
+        while not done:
+            done = self._stopped.is_set()
+            if not done:
+                self._wake.wait(self.interval)
+                self._wake.clear()
+            # This thread never goes through the request cycle, so it has to
+            # drop dead or expired connections itself.
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+
+def apply_increments(increments):
+    """Add the {choice_id: votes} counts of @param 'increments' to
+    Choice.votes with a single UPDATE ... CASE statement.
+    """
+    whens = [When(pk=choice_id, then=Value(n))
+             for choice_id, n in increments.items()]
+    Choice.objects.filter(pk__in=list(increments)).update(
+        votes=F('votes') + Case(*whens, default=Value(0),
+                                output_field=IntegerField()))
+
+
+vote_buffer = VoteBuffer(
+    interval=getattr(settings, 'POLLS_VOTE_FLUSH_INTERVAL', 500) / 1000.0,
+    max_pending=getattr(settings, 'POLLS_VOTE_FLUSH_SIZE', 1000),
+)
+
+
+def install_shutdown_flush():
+    """Make SIGTERM write out the vote buffer before the process exits. Any
+    handler already installed (by gunicorn for example) still runs
+    afterwards.
+    """
+    try:
+        previous = signal.getsignal(signal.SIGTERM)
+    except ValueError:
+        return
+
+    def handle_sigterm(signum, frame):
+        vote_buffer.stop_from_signal()
+        if callable(previous):
+            previous(signum, frame)
+        elif previous != signal.SIG_IGN:
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+
+    try:
+        signal.signal(signal.SIGTERM, handle_sigterm)
+    except ValueError:
+        # Not the main thread, the atexit hook still covers normal exits.
+        pass
+
+
+def record_vote(choice, shards=None):
+    """Atomically add one vote to @param 'choice'."""
+    if getattr(settings, 'POLLS_VOTE_BUFFER', False):
+        vote_buffer.add(choice.pk, question_id=choice.question_id)
+        vote_buffer.start()
+        return
+    if shards is None:
+        shards = vote_shards()
+    # The receivers of votes_recorded write to the same database.
+    with sharding.question_shard(choice.question_id):
+        if shards <= 1:
+            Choice.objects.filter(pk=choice.pk).update(votes=F('votes') + 1)
+        else:
+            _record_sharded_vote(choice, shards)
+        votes_recorded.send(sender=Choice, increments={choice.pk: 1},
+                            question_ids=[choice.question_id])
+
+
+def _record_sharded_vote(choice, shards):
+    shard = random.randrange(shards)
+    updated = ChoiceVoteShard.objects.filter(
+        choice_id=choice.pk, shard=shard
+    ).update(votes=F('votes') + 1)
+    if updated:
+        return
+    # First vote to land on this shard. Another request may be creating the
+    # same row right now, in which case unique_together makes one of the
+    # inserts fail and that one falls back to the UPDATE.
+    try:
+        with transaction.atomic(
+                using=router.db_for_write(ChoiceVoteShard)):
+            ChoiceVoteShard.objects.create(choice_id=choice.pk, shard=shard,
+                                           votes=1)
+    except IntegrityError:
+        ChoiceVoteShard.objects.filter(
+            choice_id=choice.pk, shard=shard
+        ).update(votes=F('votes') + 1)
+
+
+def tally(choices):
+    """Return @param 'choices' as a list with each choice.votes including the
+    votes held in its shards. Costs one extra query no matter how many choices
+    or shards there are.
+    """
+    choices = list(choices)
+    if not choices:
+        return choices
+    shard_votes = dict(
+        ChoiceVoteShard.objects.filter(
+            choice__in=[c.pk for c in choices]
+        ).values_list('choice').annotate(total=Sum('votes'))
+    )
+    for c in choices:
+        c.votes += shard_votes.get(c.pk, 0)
+    return choices